@@ -1,25 +1,22 @@
-from flask import Flask, request, jsonify
+from flask import Flask, g, has_request_context, request, jsonify
 from flask_cors import CORS
-import joblib
 import numpy as np
-import pandas as pd
-from datetime import datetime
 import os
-import requests
+import time
+
+from artifact_bundle import current_bundle_version, load_artifacts, set_current_bundle
+from cf_scoring import recommend_users
+from model_registry import ModelRegistry, ServingModels
+from precomputed_recommendations import open_table
+from product_catalog import encode_json, json_object
+from product_images import resolver_from_env
+from response_cache import cache_from_env
+from stage_metrics import SIZE_BUCKETS, metrics_from_env
 
 
 app = Flask(__name__)
 CORS(app)
 
-#load trained collaborative model
-CF_model = joblib.load('trained_model/cf_model.pkl')
-#matrix factorization from collaborative model
-user_product_matrix = joblib.load('trained_model/user_product_matrix.pkl')
-#product embeddings from content-based model
-product_embeddings = joblib.load('trained_model/product_embeddings.pkl')
-#user embeddings from content-based model
-user_embeddings = joblib.load('trained_model/user_embeddings.pkl')
-
 emotion_dict = {
         "happy": "positive",
         "angry": "negative",
@@ -30,171 +27,422 @@ emotion_dict = {
         "neutral": "unclassified"
     }
 
-products_df = pd.read_csv('capstone-dataset/products.csv')
-aisles_df = pd.read_csv('capstone-dataset/aisles.csv')
-departments_df = pd.read_csv('capstone-dataset/departments.csv')
-products_with_expiration_df = pd.read_csv('capstone-dataset/products_with_expiration.csv')
-user_features_df =  pd.read_csv('capstone-dataset/user_features_headers.csv')
-purchase_count_train_df =  pd.read_csv('capstone-dataset/purchase_count_train_df.csv')
+#the widest close-to-expiration window a request may ask for; every window is a cached pool
+MAX_DAYS = 365
+#the largest N a request may ask for; the aisle popularity table keeps the K=100 top products of every
+#aisle, so even N on a single aisle of a new user is filled from the table
+MAX_N = 100
+#the purchased products /predict returns per page by default, and the most a request may ask for;
+#actual_purchased_total tells a client how many pages there are
+HISTORY_PAGE_SIZE = 50
+MAX_HISTORY_LIMIT = 500
+#the most users one /predict_batch call may ask for
+MAX_BATCH_USERS = 1000
+
+def build_models(version=None):
+    """
+    Load a model version, memory-mapped from the artifact bundle when one has been built,
+    with the top N table precomputed for it if there is one.
+    """
+    artifacts = load_artifacts('trained_model', 'capstone-dataset', version)
+    return ServingModels(artifacts, set(emotion_dict.values()),
+                         open_table(os.path.join('trained_model', 'topn'), artifacts.version))
+
+def activate_bundle(models):
+    """
+    Point CURRENT at a bundle swapped in by /models/reload, so other workers and restarts follow it.
+    """
+    bundles_dir = os.path.join('trained_model', 'bundles')
+    if not models.version.startswith('legacy-') and current_bundle_version(bundles_dir) != models.version:
+        set_current_bundle(bundles_dir, models.version)
+
+#the active model version; swapped atomically by /models/reload and the bundle watcher
+model_registry = ModelRegistry(build_models)
+model_registry.load()
+model_registry.swap_listeners.append(activate_bundle)
+model_registry.watch(lambda: current_bundle_version(os.path.join('trained_model', 'bundles')),
+                     float(os.getenv('MODEL_WATCH_INTERVAL', 30)))
+
+#where /predict gets the base recommendations of known users by default: 'precomputed' or 'live'
+default_cf_mode = os.getenv('CF_MODE', 'precomputed')
+
+#product images, resolved concurrently and cached by product id
+image_resolver = resolver_from_env()
+#how long a request waits for image searches, in seconds
+image_deadline = float(os.getenv('PRODUCT_IMAGE_DEADLINE', 0.5))
 
-products_df = pd.merge(products_df, aisles_df, on="aisle_id")
-products_df = pd.merge(products_df, departments_df, on="department_id")
+#cache of serialized /predict responses, emptied whenever another model version is swapped in
+response_cache = cache_from_env()
+model_registry.swap_listeners.append(lambda models: response_cache.clear())
 
-mood_food_df = pd.read_csv('capstone-dataset/mood_categorized_aisles.csv')
-mood_food_df = mood_food_df.drop(columns=['aisle'])
-#products with mood categories
-products_mood_df = pd.merge(products_df, mood_food_df, on="aisle_id")
+#stage timings and counters served on /metrics; with PROFILE_TOKEN set, the X-Profile header returns a request's stage breakdown
+metrics = metrics_from_env('recommender')
+metrics.instrument(app)
 
-#products with expiration dates
-products_expiration_df = pd.merge(products_df, products_with_expiration_df, on="product_id")
+def cache_metrics():
+    stats = response_cache.stats()
+    return [('response_cache_hits_total', 'counter', 'response cache hits', stats['hits']),
+            ('response_cache_misses_total', 'counter', 'response cache misses', stats['misses']),
+            ('response_cache_entries', 'gauge', 'responses in the cache', stats.get('entries', 0)),
+            ('image_cache_entries', 'gauge', 'products with a cached image', len(image_resolver.cache))]
+metrics.add_collector(cache_metrics)
 
 
-def product_neighbors(recommended_id, given_products_df, threshold=0.0001):
+def neighbor_catalog_positions(recommended_items, neighbor_index, N=3, threshold=0.0001, models=None):
     """
-    The rule is that calculate the similarity of recommendations and products in given products dataframe.
-    Get the most similar products with the similarities greater than the threshold.
+    The rule is that calculate the similarity of recommendations and products in the candidate pool of the neighbor index.
+    Get the most similar products with the similarities greater than 0 and not greater than the threshold.
     Args:
-        recommended_id: the product id of a recommendation
-        current_emotion_related_pros: the dataframe of the current emotion-related products
+        recommended_items: the product ids of the recommendations
+        neighbor_index: the NeighborIndex of the candidate products
+        N: the number of products to return
         threshold: the threshold of similarity; 0.0001 by default
+    Returns:
+        the catalog rows of the products and their positions in the pool
     """
-    input_embedding = product_embeddings[recommended_id]
-    product_ids = given_products_df["product_id"].values
-    current_mood_related_product_embeddings = product_embeddings[product_ids]
-    squared_distances = np.sum((current_mood_related_product_embeddings - input_embedding)**2, axis=1)
-    
-    given_products_df.loc[:, 'similarity'] = squared_distances
-    filtered_pros = given_products_df[(given_products_df['similarity'] > 0) & (given_products_df['similarity'] <= threshold)]
-    return filtered_pros
+    models = models or model_registry.current
+    positions = neighbor_index.nearest(recommended_items, N=N, threshold=threshold)[0]
+    return models.catalog.positions_of(neighbor_index.product_ids[positions]), positions
 
-def recommended_current_emotion_related_items(recommended_items, current_emotion_related_pros, N=3):
+def current_emotion_related_positions(recommended_items, current_mood, N=3, models=None):
     """
-    Return the most similar items of the entire recommendation list and the entire current emotion-related product list.
+    Return the catalog rows of the most similar items of the entire recommendation list and the entire current
+    emotion-related product list.
     """
-    dataframes_list = []
-    for item in recommended_items:
-        union_df = product_neighbors(item, current_emotion_related_pros)
-        dataframes_list.append(union_df)
-    final_union_df = pd.concat(dataframes_list, ignore_index=True)
-    final_union_df = final_union_df.sort_values(by="similarity")
-    return final_union_df.head(N)
+    models = models or model_registry.current
+    return neighbor_catalog_positions(recommended_items, models.mood_neighbor_indexes[emotion_dict[current_mood]], N,
+                                      models=models)[0]
 
-def get_close_to_expiration_pros(days=15):
+def get_close_to_expiration_neighbors(days=15, models=None):
     """
-    Returns all items that are close to expiration within N days.
+    Returns the close-to-expiration products and their neighbor index.
     """
-    current_date = pd.to_datetime(datetime.now())
-    products_expiration_df['expiration_date'] = pd.to_datetime(products_expiration_df['expiration_date'])
-    products_expiration_df['days_until_expiration'] = (products_expiration_df['expiration_date'] - current_date).dt.days
-    result_df = products_expiration_df[(products_expiration_df["days_until_expiration"] > 0)  & (products_expiration_df["days_until_expiration"] <= days)]
-    return result_df
+    models = models or model_registry.current
+    with metrics.span('expiration_pool'):
+        return models.expiration_index.close_to_expiration(days)
 
-def recommended_close_to_expiration_items(recommended_items, N=3):
+def close_to_expiration_positions(recommended_items, N=3, days=15, models=None):
     """
-    Return recommend close-to-expiration items
+    Return the catalog rows of the recommended close-to-expiration items and their days until expiration.
     """
-    close_to_expiration_products_df = get_close_to_expiration_pros()
-    dataframes_list = []
-    for item in recommended_items:
-        union_df = product_neighbors(item, close_to_expiration_products_df)
-        dataframes_list.append(union_df)
-    final_union_df = pd.concat(dataframes_list, ignore_index=True)
-    final_union_df = final_union_df.sort_values(by="similarity")
-    return final_union_df.head(N)
+    close_to_expiration_products_df, neighbor_index = get_close_to_expiration_neighbors(days, models)
+    positions, pool_positions = neighbor_catalog_positions(recommended_items, neighbor_index, N, models=models)
+    return positions, close_to_expiration_products_df["days_until_expiration"].values[pool_positions]
 
 
-def get_products_df(product_ids):
-    return products_df[products_df["product_id"].isin(product_ids)]
-
+def parse_aisle_ids(aisle_ids):
+    """
+    Return the list of aisle ids of a comma-separated interested_aisles value, or None if it is malformed.
+    """
+    aisles = aisle_ids.split(",")
+    if not all(aisle.strip().isdigit() for aisle in aisles):
+        return None
+    return [int(aisle) for aisle in aisles]
 
-def get_initial_recommendations_for_new_users(aisle_ids, N):
+def get_initial_recommendations_for_new_users(aisle_ids, N, models=None):
     """
     Return initial recommendations for new users.
     """
-    aisles = list(map(int, aisle_ids.split(",")))
-    purchase_count_df_with_aisles = pd.merge(purchase_count_train_df, products_df[['product_id', 'aisle_id']], on='product_id', how='left')
-    filted_df = purchase_count_df_with_aisles[purchase_count_df_with_aisles["aisle_id"].isin(aisles)]
-    topN = N // len(aisles)
-    topN = 1 if topN == 0 else topN
-    recommendations = []
-    for aisle_id in aisles:
-        items_in_aisle = filted_df[filted_df['aisle_id'] == aisle_id]
-        items_in_aisle = items_in_aisle.groupby('product_id')['purchase_count'].sum().reset_index(name='purchase_count')
-        items_in_aisle = items_in_aisle.sort_values(by='purchase_count', ascending=False)
-        top_items_in_aisle = items_in_aisle.head(topN)["product_id"].values
-        recommendations.extend(top_items_in_aisle)
-    return recommendations
-
-def get_product_image(product_names):
-    urls = []
-    api_key = os.getenv('SEARCH_API_KEY')
-    search_engine_id = os.getenv('SEARCH_ENGINE_ID')
-    for product_name in product_names:
-        # search_url = f"https://www.googleapis.com/customsearch/v1?q={product_name}&cx={search_engine_id}&key={api_key}&searchType=image"
-        # response = requests.get(search_url)
-        # data = response.json()
-        # if 'items' in data:
-            # urls.append(data['items'][0]['link'])
-        urls.append("https://josiesorganics.com/wp-content/uploads/2022/01/Josies-Organics-Baby-Spinach-16oz-Front.png")
+    models = models or model_registry.current
+    return models.aisle_popularity.recommend(parse_aisle_ids(aisle_ids), N)
+
+def get_product_image(product_ids, product_names, deadline=None):
+    """
+    Return the image URL of every product, from the image cache or concurrent searches.
+    Args:
+        deadline: the time.monotonic() of the request deadline; products still being searched then get the default image
+    """
+    with metrics.span('images'):
+        urls, complete = image_resolver.resolve_status(product_ids, product_names, deadline)
+    #a response showing the default image for a pending or failed search is not cached
+    if not complete and has_request_context():
+        g.images_incomplete = True
     return urls
 
+def product_records_json(positions, models=None, deadline=None, days_until_expiration=None):
+    """
+    Return the JSON array of the products at the given catalog rows with their images, formatted like /predict.
+    """
+    models = models or model_registry.current
+    image_urls = get_product_image(models.catalog.product_ids[positions], models.catalog.product_names[positions], deadline)
+    return models.catalog.records_json(positions, image_urls, days_until_expiration)
+
+def get_catalog_positions(product_ids, models=None):
+    models = models or model_registry.current
+    return models.catalog.positions_of(product_ids)
+
+def purchased_product_positions(user_id, offset=0, limit=None, by_count=False, models=None):
+    """
+    Return the catalog rows of a page of the products a user purchased.
+    Args:
+        user_id: the id of the user
+        offset: the number of products to skip
+        limit: the maximum number of products to return; None for all
+        by_count: order by descending purchase count instead of the catalog order
+    """
+    models = models or model_registry.current
+    if by_count:
+        product_ids, counts = models.purchase_history.products(user_id, offset, limit, by_count=True)
+        return get_catalog_positions(product_ids, models)
+    product_ids, counts = models.purchase_history.products(user_id)
+    positions = np.sort(get_catalog_positions(product_ids, models))
+    return positions[offset:None if limit is None else offset + limit]
+
+def base_recommendations(user_ids, N=10, models=None, cf_mode='precomputed'):
+    """
+    Return the top N collaborative recommendations of known users as (item ids, scores) like recommend_users.
+    In the precomputed mode the rows come from the memory-mapped top N table; users added after the
+    precompute, negative ids, or an N outside the width of the table, are scored live.
+    """
+    models = models or model_registry.current
+    user_ids = np.asarray(user_ids, dtype=np.int64)
+    table = models.topn_table
+    covered = table.covers(user_ids, N) if cf_mode == 'precomputed' and table is not None else None
+    if covered is None or not covered.any():
+        return recommend_users(models.user_factors, models.item_factors, models.user_product_matrix, user_ids, N=N)
+    if covered.all():
+        return table.recommend(user_ids, N)
+    recommended_ids = np.full((len(user_ids), N), -1, dtype=np.int64)
+    scores = np.full((len(user_ids), N), -np.inf, dtype=np.float32)
+    recommended_ids[covered], scores[covered] = table.recommend(user_ids[covered], N)
+    recommended_ids[~covered], scores[~covered] = recommend_users(models.user_factors, models.item_factors,
+                                                                  models.user_product_matrix, user_ids[~covered], N=N)
+    return recommended_ids, scores
+
+def recommend_for_users(user_ids, moods, N=10, days=15, models=None, deadline=None, cf_mode='precomputed'):
+    """
+    Return the JSON of the recommendations of many known users at once, formatted like /predict.
+    All users are scored in blocked matrix multiplies against the ALS item factors and already purchased
+    products are filtered out with user_product_matrix. The mood and close-to-expiration stages run one
+    neighbor query per candidate pool for the whole batch.
+    Args:
+        user_ids: the ids of the users
+        moods: the current mood of every user
+        N: the number of initial recommendations per user
+        days: the close-to-expiration window in days
+    """
+    models = models or model_registry.current
+    user_ids = np.asarray(user_ids, dtype=np.int64)
+    n_users = len(user_ids)
+    with metrics.span('batch_cf_scoring'):
+        recommended_ids, scores = base_recommendations(user_ids, N, models, cf_mode)
+    query_ids = recommended_ids.ravel()
+    groups = np.repeat(np.arange(n_users), recommended_ids.shape[1])
+    valid = query_ids >= 0
+
+    #mood stage, one query per mood category
+    user_moods = np.array([emotion_dict[mood] for mood in moods])
+    mood_positions = [None] * n_users
+    with metrics.span('batch_mood_neighbors'):
+        for mood in set(user_moods):
+            in_mood = valid & (user_moods[groups] == mood)
+            neighbor_index = models.mood_neighbor_indexes[mood]
+            neighbors = neighbor_index.nearest_groups(query_ids[in_mood], groups[in_mood], n_users)
+            for i in np.flatnonzero(user_moods == mood):
+                mood_positions[i] = get_catalog_positions(neighbor_index.product_ids[neighbors[i][0]], models)
+
+    #close-to-expiration stage, one query for the whole batch
+    with metrics.span('batch_expiration_neighbors'):
+        close_to_expiration_products_df, neighbor_index = get_close_to_expiration_neighbors(days, models)
+        neighbors = neighbor_index.nearest_groups(query_ids[valid], groups[valid], n_users)
+        days_until_expiration = close_to_expiration_products_df["days_until_expiration"].values
+        close_to_exp_positions = [(get_catalog_positions(neighbor_index.product_ids[positions], models),
+                                   days_until_expiration[positions]) for positions, _ in neighbors]
+
+    #initial recommendations keep the catalog order, each product once, as the isin lookup did
+    with metrics.span('batch_catalog_lookup'):
+        initial_positions = []
+        for items in recommended_ids:
+            positions = get_catalog_positions(items[items >= 0], models)
+            initial_positions.append(np.unique(positions)[:6])
+    metrics.observe('candidates', n_users, SIZE_BUCKETS, pool='batch_users')
+
+    with metrics.span('batch_formatting'):
+        return [json_object({
+                    "userId": encode_json(int(user_id)),
+                    "initial_recommendations": product_records_json(initial_positions[i], models, deadline),
+                    "mood_related_recommendations": product_records_json(mood_positions[i], models, deadline),
+                    "close_to_exp_recommendations": product_records_json(close_to_exp_positions[i][0], models, deadline,
+                                                                         close_to_exp_positions[i][1])})
+                for i, user_id in enumerate(user_ids)]
+
 @app.route('/predict', methods=['GET'])
 def predict():
     user_id = request.args.get('userId')
     current_mood = request.args.get('mood')
     N = request.args.get('N', 10, type=int)
     aisle_ids = request.args.get('interested_aisles')
+    days = request.args.get('days', 15, type=int)
+    history_order = request.args.get('history_order', 'catalog')
+    history_offset = request.args.get('history_offset', 0, type=int)
+    history_limit = request.args.get('history_limit', HISTORY_PAGE_SIZE, type=int)
+    cf_mode = request.args.get('cf_mode', default_cf_mode)
     if not current_mood:
         return jsonify({"error": "Mood parameter is missing"}), 400
+    if current_mood not in emotion_dict:
+        return jsonify({"error": "Unknown mood"}), 400
+    if not 1 <= N <= MAX_N:
+        return jsonify({"error": f"N must be between 1 and {MAX_N}"}), 400
+    if not 1 <= days <= MAX_DAYS:
+        return jsonify({"error": f"days must be between 1 and {MAX_DAYS}"}), 400
+    if history_order not in ('catalog', 'count'):
+        return jsonify({"error": "history_order must be catalog or count"}), 400
+    if history_offset < 0 or history_limit < 0:
+        return jsonify({"error": "history_offset and history_limit must not be negative"}), 400
+    if history_limit > MAX_HISTORY_LIMIT:
+        return jsonify({"error": f"history_limit must not exceed {MAX_HISTORY_LIMIT}"}), 400
+    if cf_mode not in ('precomputed', 'live'):
+        return jsonify({"error": "cf_mode must be precomputed or live"}), 400
     if not user_id and not aisle_ids:
         return jsonify({"error": "user_id and interested_aisles parameters are missing"}), 400
-    
+    if not user_id and parse_aisle_ids(aisle_ids) is None:
+        return jsonify({"error": "interested_aisles must be comma-separated integers"}), 400
+
+    #in-flight requests finish on the version they started with
+    models = model_registry.current
+    known_user_id = None
+    if user_id:
+        try:
+            known_user_id = int(user_id)
+        except ValueError:
+            return jsonify({"error": "userId must be an integer"}), 400
+        if known_user_id < 0 or known_user_id >= models.user_product_matrix.shape[0]:
+            return jsonify({"error": "Unknown userId"}), 400
+    deadline = time.monotonic() + image_deadline
+    #responses change with the model version and the expiration window as well as with the parameters,
+    #keyed on the parsed ids so that 7, 07 and " 7" share an entry
+    with metrics.span('cache_lookup'):
+        cache_key = response_cache.key('predict', models.version, models.expiration_index.current_window(), known_user_id,
+                                       None if user_id else parse_aisle_ids(aisle_ids), current_mood, N, days,
+                                       history_order, history_offset, history_limit, cf_mode)
+        cached_response = response_cache.get(cache_key)
+    if cached_response is not None:
+        return app.response_class(cached_response, mimetype='application/json')
+
     initial_recommendations = None
     if not user_id:
-        initial_recommendations = get_initial_recommendations_for_new_users(aisle_ids, N)
+        with metrics.span('new_user_recommendations'):
+            initial_recommendations = get_initial_recommendations_for_new_users(aisle_ids, N, models)
     else:
         user_id = int(user_id)
         #generate initial recommendations
-        initial_recommendations, scores = CF_model.recommend(user_id, user_product_matrix[user_id], N=N)
-    #get current emotion related product list
-    current_emotion_related_pros = products_mood_df[products_mood_df["mood"]==emotion_dict[current_mood]]
+        with metrics.span('cf_scoring'):
+            recommended_ids, scores = base_recommendations([user_id], N, models, cf_mode)
+        initial_recommendations = recommended_ids[0][recommended_ids[0] >= 0]
+    metrics.observe('candidates', len(initial_recommendations), SIZE_BUCKETS, 'candidate pool sizes', pool='initial')
     #get the intersection of initial recommendations and current emotion related products
-    cur_mood_relate_recommendations_df = recommended_current_emotion_related_items(initial_recommendations, current_emotion_related_pros)
+    with metrics.span('mood_neighbors'):
+        mood_positions = current_emotion_related_positions(initial_recommendations, current_mood, models=models)
+    metrics.observe('candidates', len(models.mood_products[emotion_dict[current_mood]]), SIZE_BUCKETS, pool='mood')
     #get the intersection of initial recommendations and close-to-expiration products
-    close_to_exp_recommendations_df = recommended_close_to_expiration_items(initial_recommendations)
+    with metrics.span('expiration_neighbors'):
+        close_to_exp_positions, days_until_expiration = close_to_expiration_positions(initial_recommendations, days=days,
+                                                                                      models=models)
+    metrics.observe('candidates', len(models.expiration_index.close_to_expiration(days)[0]), SIZE_BUCKETS, pool='expiration')
 
-    initial_recommendations_df = get_products_df(initial_recommendations)
+    #initial recommendations keep the catalog order, each product once, as the isin lookup did
+    with metrics.span('catalog_lookup'):
+        initial_positions = np.unique(get_catalog_positions(initial_recommendations, models))
    #format the recommendations
-    initial_result = initial_recommendations_df[['product_id', 'product_name', 'aisle', 'department']].head(6)
-    image_urls = get_product_image(initial_result["product_name"].values)
-    initial_result["image_url"] = image_urls
-    initial_result_json = initial_result.to_dict(orient='records')
-    
-    mood_result = cur_mood_relate_recommendations_df[['product_id', 'product_name', 'aisle', 'department']].head(3)
-    image_urls = get_product_image(mood_result["product_name"].values)
-    mood_result["image_url"] = image_urls
-    mood_result_json = mood_result.to_dict(orient='records')
-
-    close_to_exp_result = close_to_exp_recommendations_df[['product_id', 'product_name', 'aisle', 'department', 'days_until_expiration']].head(3)
-    image_urls = get_product_image(close_to_exp_result["product_name"].values)
-    close_to_exp_result["image_url"] = image_urls
-    close_to_exp_result_json = close_to_exp_result.to_dict(orient='records')
-
-    actual_result_json = None
+    with metrics.span('formatting'):
+        initial_result_json = product_records_json(initial_positions[:6], models, deadline)
+        mood_result_json = product_records_json(mood_positions[:3], models, deadline)
+        close_to_exp_result_json = product_records_json(close_to_exp_positions[:3], models, deadline,
+                                                        days_until_expiration[:3])
+
+    actual_result_json = b'null'
+    actual_total = None
     #actual purchased products
     if user_id is not None:
-        pids = purchase_count_train_df[purchase_count_train_df["user_id"] == user_id]["product_id"].values
-        actual_purchased_products = get_products_df(pids)
-        actual_result = actual_purchased_products[['product_id', 'product_name', 'aisle', 'department']]
-        image_urls = get_product_image(actual_result["product_name"].values)
-        actual_result["image_url"] = image_urls
-        actual_result_json = actual_result.to_dict(orient='records')
-
-    return jsonify({'initial_recommendations': initial_result_json, 
-                    "mood_related_recommendations": mood_result_json,
-                    "close_to_exp_recommendations": close_to_exp_result_json,
-                    "actual_purchased_products": actual_result_json})
+        with metrics.span('purchase_history'):
+            positions = purchased_product_positions(user_id, history_offset, history_limit, history_order == 'count', models)
+            actual_result_json = product_records_json(positions, models, deadline)
+            actual_total = models.purchase_history.count(user_id)
 
+    #the response is joined from the pre-encoded records, byte for byte what jsonify writes outside debug mode
+    with metrics.span('serialization'):
+        response = app.response_class(json_object({'initial_recommendations': initial_result_json,
+                                                   "mood_related_recommendations": mood_result_json,
+                                                   "close_to_exp_recommendations": close_to_exp_result_json,
+                                                   "actual_purchased_products": actual_result_json,
+                                                   "actual_purchased_total": encode_json(actual_total),
+                                                   "model_version": encode_json(models.version)}) + b'\n',
+                                      mimetype='application/json')
+    if not g.get('images_incomplete'):
+        with metrics.span('cache_store'):
+            response_cache.set(cache_key, response.get_data())
+    return response
+
+
+
+@app.route('/predict_batch', methods=['POST'])
+def predict_batch():
+    """
+    Recommendations for many known users in one call.
+    The body is {"users": [{"userId": ..., "mood": ...}, ...], "N": 10, "days": 15, "cf_mode": "precomputed"}.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        body = {}
+    users = body.get('users')
+    N = body.get('N', 10)
+    days = body.get('days', 15)
+    cf_mode = body.get('cf_mode', default_cf_mode)
+    if not users:
+        return jsonify({"error": "users parameter is missing"}), 400
+    if not isinstance(users, list) or any(not isinstance(user, dict) for user in users):
+        return jsonify({"error": "users must be a list of objects"}), 400
+    if len(users) > MAX_BATCH_USERS:
+        return jsonify({"error": f"at most {MAX_BATCH_USERS} users per batch"}), 400
+    if any('userId' not in user or 'mood' not in user for user in users):
+        return jsonify({"error": "every user needs a userId and a mood"}), 400
+    if any(user['mood'] not in emotion_dict for user in users):
+        return jsonify({"error": "Unknown mood"}), 400
+    #JSON booleans are ints in Python and floats would be truncated, so only exact integers pass
+    if any(type(value) is not int for value in [user['userId'] for user in users] + [N, days]):
+        return jsonify({"error": "userId, N and days must be integers"}), 400
+    user_ids = [user['userId'] for user in users]
+    if not 1 <= N <= MAX_N:
+        return jsonify({"error": f"N must be between 1 and {MAX_N}"}), 400
+    if not 1 <= days <= MAX_DAYS:
+        return jsonify({"error": f"days must be between 1 and {MAX_DAYS}"}), 400
+    if cf_mode not in ('precomputed', 'live'):
+        return jsonify({"error": "cf_mode must be precomputed or live"}), 400
+    models = model_registry.current
+    if any(user_id < 0 or user_id >= models.user_product_matrix.shape[0] for user_id in user_ids):
+        return jsonify({"error": "Unknown userId"}), 400
+
+    results = recommend_for_users(user_ids, [user['mood'] for user in users], N=N, days=days, models=models,
+                                  deadline=time.monotonic() + image_deadline, cf_mode=cf_mode)
+    return app.response_class(json_object({"results": b'[' + b','.join(results) + b']',
+                                           "model_version": encode_json(models.version)}) + b'\n',
+                              mimetype='application/json')
+
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify(response_cache.stats())
+
+@app.route('/models', methods=['GET'])
+def models_status():
+    return jsonify(model_registry.status())
+
+
+@app.route('/models/reload', methods=['POST'])
+def reload_models():
+    """
+    Load a model version in the background and swap it in once it validates.
+    The optional body {"version": ...} names a bundle under trained_model/bundles; without it
+    the current bundle (or the legacy pickles) is reloaded.
+    """
+    body = request.get_json(silent=True) or {}
+    version = body.get('version')
+    if version is not None and (not isinstance(version, str) or os.path.basename(version) != version
+                                or version.startswith('.')):
+        return jsonify({"error": "Invalid version"}), 400
+    if not model_registry.reload_async(version):
+        return jsonify({"error": "A model version is already loading", **model_registry.status()}), 409
+    return jsonify(model_registry.status()), 202
 
 
 if __name__ == '__main__':
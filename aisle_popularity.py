@@ -0,0 +1,130 @@
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+
+
+class AislePopularity:
+    """
+    Per-aisle table of the K most purchased products, used for the cold-start
+    recommendations of new users.
+
+    The table is stored CSR-style: the products of aisle aisle_ids[i] are
+    product_ids[indptr[i]:indptr[i + 1]], ranked by total purchase count
+    (ties by product id), so a request for any combination of aisles is an
+    O(aisles x K) lookup instead of a merge and groupby over all purchases.
+    Only the top K of every aisle are kept, so the table answers any N up to K;
+    /predict accepts N up to MAX_N = 100, the default K.
+    """
+
+    def __init__(self, aisle_ids, indptr, product_ids, purchase_counts, fingerprint=''):
+        self.fingerprint = fingerprint
+        self.aisle_ids = np.asarray(aisle_ids, dtype=np.int64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.product_ids = np.asarray(product_ids, dtype=np.int64)
+        self.purchase_counts = np.asarray(purchase_counts, dtype=np.int64)
+        self._aisle_rows = {int(aisle_id): row for row, aisle_id in enumerate(self.aisle_ids)}
+
+    @classmethod
+    def build(cls, product_totals, products_df, K=100):
+        """
+        Build the table from the total purchase count of every product.
+        Args:
+            product_totals: the total purchase count indexed by product id, e.g. the
+                column sums of the user-product matrix
+            products_df: the dataframe with product_id and aisle_id columns
+            K: the number of products kept per aisle
+        """
+        product_totals = np.asarray(product_totals).ravel().astype(np.int64)
+        purchased = np.flatnonzero(product_totals > 0)
+        catalog = products_df[products_df["product_id"].isin(purchased)]
+        product_ids = catalog["product_id"].values.astype(np.int64)
+        aisle_ids = catalog["aisle_id"].values.astype(np.int64)
+        purchase_counts = product_totals[product_ids]
+
+        order = np.lexsort((product_ids, -purchase_counts, aisle_ids))
+        product_ids, aisle_ids, purchase_counts = product_ids[order], aisle_ids[order], purchase_counts[order]
+        unique_aisles, starts = np.unique(aisle_ids, return_index=True)
+        aisle_sizes = np.diff(np.append(starts, len(aisle_ids)))
+        rank = np.arange(len(aisle_ids)) - np.repeat(starts, aisle_sizes)
+        keep = rank < K
+        indptr = np.concatenate([[0], np.cumsum(np.minimum(aisle_sizes, K))])
+        return cls(unique_aisles, indptr, product_ids[keep], purchase_counts[keep])
+
+    @classmethod
+    def build_from_matrix(cls, user_product_matrix, products_df, K=100):
+        return cls.build(user_product_matrix.sum(axis=0), products_df, K)
+
+    def save(self, path):
+        np.savez(path, aisle_ids=self.aisle_ids, indptr=self.indptr,
+                 product_ids=self.product_ids, purchase_counts=self.purchase_counts,
+                 fingerprint=np.array(self.fingerprint))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            #tables saved before fingerprints were stored get an empty one
+            fingerprint = str(data["fingerprint"]) if "fingerprint" in data.files else ''
+            return cls(data["aisle_ids"], data["indptr"], data["product_ids"], data["purchase_counts"], fingerprint)
+
+    def top_products(self, aisle_id, N):
+        """
+        Return the N most purchased products of an aisle (at most K).
+        """
+        row = self._aisle_rows.get(int(aisle_id))
+        if row is None:
+            return self.product_ids[:0]
+        start = self.indptr[row]
+        return self.product_ids[start:min(start + N, self.indptr[row + 1])]
+
+    def recommend(self, aisles, N):
+        """
+        Return N recommendations spread evenly over the given aisles, at least one per aisle.
+        An aisle contributes at most K products, so N must not exceed K for the full N // len(aisles)
+        of every aisle; the ranking beyond K is not kept.
+        """
+        topN = N // len(aisles)
+        topN = 1 if topN == 0 else topN
+        recommendations = []
+        for aisle_id in aisles:
+            recommendations.extend(self.top_products(aisle_id, topN))
+        return recommendations
+
+
+def source_fingerprint(user_product_matrix, products_df, K=100):
+    """
+    Return a fingerprint of the inputs of the table: the shape, number of entries and total purchases
+    of the matrix, the number of catalog products and K. It changes when a notebook retrains on new orders.
+    """
+    n_users, n_products = user_product_matrix.shape
+    nnz = getattr(user_product_matrix, 'nnz', None)
+    if nnz is None:
+        nnz = int(np.count_nonzero(user_product_matrix))
+    return f"{n_users}x{n_products}:nnz={nnz}:sum={int(user_product_matrix.sum())}:products={len(products_df)}:K={K}"
+
+
+def load_or_build(path, user_product_matrix, products_df, K=100):
+    """
+    Load the table from path, building and saving it first if it does not exist yet or was built
+    from other inputs than user_product_matrix and products_df.
+    """
+    fingerprint = source_fingerprint(user_product_matrix, products_df, K)
+    if os.path.exists(path):
+        aisle_popularity = AislePopularity.load(path)
+        if aisle_popularity.fingerprint == fingerprint:
+            return aisle_popularity
+    aisle_popularity = AislePopularity.build_from_matrix(user_product_matrix, products_df, K)
+    aisle_popularity.fingerprint = fingerprint
+    aisle_popularity.save(path)
+    return aisle_popularity
+
+
+if __name__ == '__main__':
+    #offline build step, run from the repository root
+    products_df = pd.read_csv('capstone-dataset/products.csv')
+    user_product_matrix = joblib.load('trained_model/user_product_matrix.pkl')
+    aisle_popularity = AislePopularity.build_from_matrix(user_product_matrix, products_df)
+    aisle_popularity.fingerprint = source_fingerprint(user_product_matrix, products_df)
+    aisle_popularity.save('trained_model/aisle_top_products.npz')
+    print("Per-aisle top products have been saved to 'trained_model/aisle_top_products.npz'.")
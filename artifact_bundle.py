@@ -0,0 +1,268 @@
+import json
+import os
+import shutil
+from datetime import datetime
+
+import joblib
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+from aisle_popularity import AislePopularity, load_or_build
+from cf_scoring import factors_of
+from neighbor_index import RadiusGraph
+
+BUNDLE_FORMAT = 1
+#marks the missing expiration date of a product
+NO_EXPIRATION = np.iinfo(np.int32).min
+
+
+class Artifacts:
+    """
+    The models and catalog the recommender serves from, loaded either from the legacy
+    pickles and CSVs or from a memory-mapped bundle.
+    """
+
+    def __init__(self, version, user_factors, item_factors, user_product_matrix, product_embeddings,
+                 user_embeddings, products_df, products_mood_df, products_expiration_df, aisle_popularity,
+                 neighbor_graph=None):
+        self.version = version
+        #user and item factors of the ALS model
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        #CSR user x product purchase counts
+        self.user_product_matrix = user_product_matrix
+        #product and user embeddings from the content-based model
+        self.product_embeddings = product_embeddings
+        self.user_embeddings = user_embeddings
+        #products with aisle and department names
+        self.products_df = products_df
+        #products with mood categories
+        self.products_mood_df = products_mood_df
+        #products with expiration dates
+        self.products_expiration_df = products_expiration_df
+        self.aisle_popularity = aisle_popularity
+        #RadiusGraph of the product embeddings; None when it has to be built at load time
+        self.neighbor_graph = neighbor_graph
+
+
+def load_legacy_artifacts(model_dir='trained_model', dataset_dir='capstone-dataset'):
+    """
+    Load the artifacts from the pickles written by the notebooks and the dataset CSVs.
+    """
+    pickles = [os.path.join(model_dir, name) for name in
+               ('cf_model.pkl', 'user_product_matrix.pkl', 'product_embeddings.pkl', 'user_embeddings.pkl')]
+    #the legacy version changes whenever a notebook writes new pickles
+    version = 'legacy-' + datetime.fromtimestamp(max(os.path.getmtime(path) for path in pickles)).strftime('%Y%m%d%H%M%S')
+    CF_model = joblib.load(os.path.join(model_dir, 'cf_model.pkl'))
+    user_factors, item_factors = factors_of(CF_model)
+    user_product_matrix = joblib.load(os.path.join(model_dir, 'user_product_matrix.pkl'))
+    product_embeddings = joblib.load(os.path.join(model_dir, 'product_embeddings.pkl'))
+    user_embeddings = joblib.load(os.path.join(model_dir, 'user_embeddings.pkl'))
+
+    products_df = pd.read_csv(os.path.join(dataset_dir, 'products.csv'))
+    aisles_df = pd.read_csv(os.path.join(dataset_dir, 'aisles.csv'))
+    departments_df = pd.read_csv(os.path.join(dataset_dir, 'departments.csv'))
+    products_with_expiration_df = pd.read_csv(os.path.join(dataset_dir, 'products_with_expiration.csv'))
+    products_df = pd.merge(products_df, aisles_df, on="aisle_id")
+    products_df = pd.merge(products_df, departments_df, on="department_id")
+
+    mood_food_df = pd.read_csv(os.path.join(dataset_dir, 'mood_categorized_aisles.csv'))
+    mood_food_df = mood_food_df.drop(columns=['aisle'])
+    products_mood_df = pd.merge(products_df, mood_food_df, on="aisle_id")
+    products_expiration_df = pd.merge(products_df, products_with_expiration_df, on="product_id")
+
+    aisle_popularity = load_or_build(os.path.join(model_dir, 'aisle_top_products.npz'), user_product_matrix, products_df)
+    return Artifacts(version, user_factors, item_factors, user_product_matrix, product_embeddings, user_embeddings,
+                     products_df, products_mood_df, products_expiration_df, aisle_popularity)
+
+
+def write_bundle(artifacts, bundles_dir, version=None):
+    """
+    Write the artifacts as a versioned bundle of .npy arrays and a JSON manifest, then make it
+    the current bundle. The bundle is written to a temporary directory first and renamed into
+    place, so a half-written bundle is never opened.
+    Returns:
+        the path of the new bundle
+    """
+    version = version or datetime.now().strftime('%Y%m%d%H%M%S')
+    path = os.path.join(bundles_dir, version)
+    if os.path.exists(path):
+        raise ValueError(f"bundle {version} already exists")
+    temp_path = path + '.tmp'
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+
+    products_df = artifacts.products_df
+    product_ids = products_df["product_id"].values.astype(np.int64)
+    aisles_df = products_df[['aisle_id', 'aisle']].drop_duplicates('aisle_id').sort_values('aisle_id')
+    departments_df = products_df[['department_id', 'department']].drop_duplicates('department_id').sort_values('department_id')
+
+    #catalog columns aligned with products_df: names as one UTF-8 blob plus offsets, moods as codes
+    encoded_names = [name.encode('utf-8') for name in products_df["product_name"].astype(str)]
+    name_offsets = np.concatenate([[0], np.cumsum([len(name) for name in encoded_names])]).astype(np.int64)
+    name_bytes = np.frombuffer(b''.join(encoded_names), dtype=np.uint8)
+    moods = sorted(artifacts.products_mood_df["mood"].unique())
+    product_moods = pd.Series(pd.Categorical(artifacts.products_mood_df["mood"], categories=moods).codes,
+                              index=artifacts.products_mood_df["product_id"].values)
+    product_moods = product_moods[~product_moods.index.duplicated()].reindex(product_ids, fill_value=-1)
+    expiration_days = pd.to_datetime(artifacts.products_expiration_df["expiration_date"]).values.astype('datetime64[D]')
+    expiration_days = pd.Series(expiration_days.astype(np.int64).astype(np.int32),
+                                index=artifacts.products_expiration_df["product_id"].values)
+    expiration_days = expiration_days[~expiration_days.index.duplicated()].reindex(product_ids, fill_value=NO_EXPIRATION)
+
+    matrix = artifacts.user_product_matrix.tocsr()
+    #the radius graph is the slowest index to build, so it is built once here instead of in every worker
+    neighbor_graph = artifacts.neighbor_graph or RadiusGraph(artifacts.product_embeddings)
+    arrays = {
+        'user_factors': np.ascontiguousarray(artifacts.user_factors),
+        'item_factors': np.ascontiguousarray(artifacts.item_factors),
+        'user_product_indptr': matrix.indptr,
+        'user_product_indices': matrix.indices,
+        'user_product_data': matrix.data,
+        'product_embeddings': np.ascontiguousarray(artifacts.product_embeddings),
+        'user_embeddings': np.ascontiguousarray(artifacts.user_embeddings),
+        'product_id': product_ids,
+        'product_name_offsets': name_offsets,
+        'product_name_bytes': name_bytes,
+        'aisle_id': products_df["aisle_id"].values.astype(np.int64),
+        'department_id': products_df["department_id"].values.astype(np.int64),
+        'mood_code': product_moods.values.astype(np.int8),
+        'expiration_day': expiration_days.values.astype(np.int32),
+        'aisle_top_aisle_ids': artifacts.aisle_popularity.aisle_ids,
+        'aisle_top_indptr': artifacts.aisle_popularity.indptr,
+        'aisle_top_product_ids': artifacts.aisle_popularity.product_ids,
+        'aisle_top_purchase_counts': artifacts.aisle_popularity.purchase_counts,
+        'neighbor_indptr': neighbor_graph.indptr,
+        'neighbor_indices': neighbor_graph.indices,
+        'neighbor_distances': neighbor_graph.distances,
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(temp_path, name + '.npy'), array)
+
+    manifest = {
+        'format': BUNDLE_FORMAT,
+        'version': version,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'user_product_shape': list(matrix.shape),
+        'aisles': [[int(aisle_id), aisle] for aisle_id, aisle in zip(aisles_df['aisle_id'], aisles_df['aisle'])],
+        'departments': [[int(department_id), department]
+                        for department_id, department in zip(departments_df['department_id'], departments_df['department'])],
+        'moods': moods,
+        'neighbor_threshold': neighbor_graph.threshold,
+        'arrays': {name: {'dtype': str(array.dtype), 'shape': list(array.shape)} for name, array in arrays.items()},
+    }
+    with open(os.path.join(temp_path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_path, path)
+    set_current_bundle(bundles_dir, version)
+    return path
+
+
+def set_current_bundle(bundles_dir, version):
+    temp_file = os.path.join(bundles_dir, 'CURRENT.tmp')
+    with open(temp_file, 'w') as f:
+        f.write(version)
+    os.replace(temp_file, os.path.join(bundles_dir, 'CURRENT'))
+
+
+def current_bundle_version(bundles_dir):
+    """
+    Return the version of the current bundle, or None if no bundle has been built.
+    """
+    current_file = os.path.join(bundles_dir, 'CURRENT')
+    if not os.path.exists(current_file):
+        return None
+    with open(current_file) as f:
+        return f.read().strip()
+
+
+def current_bundle_path(bundles_dir):
+    """
+    Return the path of the current bundle, or None if no bundle has been built.
+    """
+    version = current_bundle_version(bundles_dir)
+    return os.path.join(bundles_dir, version) if version is not None else None
+
+
+def decode_names(name_bytes, name_offsets):
+    """
+    Return the strings of a UTF-8 blob split at the given byte offsets. An ASCII blob, the usual
+    catalog, is decoded once and sliced, since its byte offsets are also character offsets.
+    """
+    offsets = name_offsets.tolist()
+    if not np.any(name_bytes >= 128):
+        names = name_bytes.tobytes().decode('ascii')
+        return [names[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+    name_bytes = name_bytes.tobytes()
+    return [name_bytes[start:stop].decode('utf-8') for start, stop in zip(offsets[:-1], offsets[1:])]
+
+
+def open_bundle(path):
+    """
+    Open a bundle with every array memory-mapped read-only, so worker processes share one
+    physical copy through the page cache. The catalog DataFrames are small and are rebuilt in
+    every process from the memory-mapped columns: names are decoded from one blob and aisle,
+    department and mood names mapped from the manifest, a few milliseconds for 20k products.
+    """
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest['format'] != BUNDLE_FORMAT:
+        raise ValueError(f"unsupported bundle format {manifest['format']} in {path}")
+    arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in manifest['arrays']}
+
+    user_product_matrix = sparse.csr_matrix((arrays['user_product_data'], arrays['user_product_indices'],
+                                             arrays['user_product_indptr']),
+                                            shape=tuple(manifest['user_product_shape']), copy=False)
+
+    product_names = decode_names(arrays['product_name_bytes'], arrays['product_name_offsets'])
+    aisle_names = dict(manifest['aisles'])
+    department_names = dict(manifest['departments'])
+    products_df = pd.DataFrame({
+        'product_id': np.asarray(arrays['product_id']),
+        'product_name': product_names,
+        'aisle_id': np.asarray(arrays['aisle_id']),
+        'department_id': np.asarray(arrays['department_id']),
+    })
+    products_df['aisle'] = products_df['aisle_id'].map(aisle_names)
+    products_df['department'] = products_df['department_id'].map(department_names)
+
+    mood_codes = np.asarray(arrays['mood_code'])
+    products_mood_df = products_df[mood_codes >= 0].reset_index(drop=True)
+    products_mood_df['mood'] = np.array(manifest['moods'], dtype=object)[mood_codes[mood_codes >= 0]]
+
+    expiration_days = np.asarray(arrays['expiration_day'])
+    has_expiration = expiration_days != NO_EXPIRATION
+    products_expiration_df = products_df[has_expiration].reset_index(drop=True)
+    products_expiration_df['expiration_date'] = expiration_days[has_expiration].astype('datetime64[D]').astype('datetime64[ns]')
+
+    aisle_popularity = AislePopularity(arrays['aisle_top_aisle_ids'], arrays['aisle_top_indptr'],
+                                       arrays['aisle_top_product_ids'], arrays['aisle_top_purchase_counts'])
+    #bundles written before the radius graph was stored get it built at load time
+    neighbor_graph = None
+    if 'neighbor_indptr' in arrays:
+        neighbor_graph = RadiusGraph.from_csr(arrays['neighbor_indptr'], arrays['neighbor_indices'],
+                                              arrays['neighbor_distances'], manifest['neighbor_threshold'])
+    return Artifacts(manifest['version'], arrays['user_factors'], arrays['item_factors'], user_product_matrix,
+                     arrays['product_embeddings'], arrays['user_embeddings'], products_df, products_mood_df,
+                     products_expiration_df, aisle_popularity, neighbor_graph)
+
+
+def load_artifacts(model_dir='trained_model', dataset_dir='capstone-dataset', version=None):
+    """
+    Open the given bundle version, or the current bundle, under model_dir/bundles, falling back
+    to the legacy pickles and CSVs when no bundle has been built.
+    """
+    bundles_dir = os.path.join(model_dir, 'bundles')
+    if version is not None:
+        return open_bundle(os.path.join(bundles_dir, version))
+    path = current_bundle_path(bundles_dir)
+    if path is not None:
+        return open_bundle(path)
+    return load_legacy_artifacts(model_dir, dataset_dir)
+
+
+if __name__ == '__main__':
+    #build command, run from the repository root after retraining
+    path = write_bundle(load_legacy_artifacts(), os.path.join('trained_model', 'bundles'))
+    print(f"Artifact bundle has been saved to '{path}'.")
@@ -0,0 +1,10 @@
+"""
+Benchmarks of the recommender service on seeded synthetic data, run from the repository root:
+
+    python -m benchmarks.synthetic_data --out bench-data --interactions 1000000
+    python -m benchmarks.stages --data bench-data --save stages-1m
+    python -m benchmarks.load --data bench-data --concurrency 8 --compare load-1m
+
+--save writes the results to benchmarks/baselines/<name>.json; --compare reports every metric
+against a saved baseline and exits with status 1 when one regressed beyond the tolerance.
+"""
@@ -0,0 +1,122 @@
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+#the metrics compared against a baseline; lower is better for all of them
+COMPARED_METRICS = ('p50_ms', 'p95_ms', 'p99_ms')
+
+
+def summarize(latencies, elapsed=None):
+    """
+    Return the latency percentiles in milliseconds of a list of durations in seconds,
+    and the throughput when the wall-clock time of the whole run is given.
+    """
+    latencies_ms = np.asarray(latencies, dtype=np.float64) * 1000
+    summary = {'count': int(len(latencies_ms)),
+               'mean_ms': round(float(latencies_ms.mean()), 4),
+               'p50_ms': round(float(np.percentile(latencies_ms, 50)), 4),
+               'p95_ms': round(float(np.percentile(latencies_ms, 95)), 4),
+               'p99_ms': round(float(np.percentile(latencies_ms, 99)), 4),
+               'max_ms': round(float(latencies_ms.max()), 4)}
+    if elapsed is not None:
+        summary['throughput_rps'] = round(len(latencies_ms) / elapsed, 2)
+    return summary
+
+
+def measure(fn, inputs, warmup=5):
+    """
+    Call fn on every input and return the summary of the call durations.
+    The first warmup inputs are run first without being timed.
+    """
+    for value in inputs[:warmup]:
+        fn(value)
+    latencies = []
+    for value in inputs:
+        start = time.perf_counter()
+        fn(value)
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies)
+
+
+def load_service(data_dir):
+    """
+    Import RecommenderSystem serving the data in data_dir, without response caching, image
+    searches or the bundle watcher, so only the recommendation work is measured.
+    """
+    data_dir = os.path.abspath(data_dir)
+    repository_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if repository_dir not in sys.path:
+        sys.path.insert(0, repository_dir)
+    os.environ.setdefault('RESPONSE_CACHE', 'off')
+    os.environ.setdefault('MODEL_WATCH_INTERVAL', str(24 * 3600))
+    os.environ.pop('SEARCH_API_KEY', None)
+    #the service resolves trained_model/ and capstone-dataset/ relative to the working directory
+    os.chdir(data_dir)
+    import RecommenderSystem
+    return RecommenderSystem
+
+
+def report(kind, config, results):
+    return {'kind': kind,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'machine': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count()},
+            'config': config,
+            'results': results}
+
+
+def save_baseline(name, data):
+    os.makedirs(BASELINES_DIR, exist_ok=True)
+    path = os.path.join(BASELINES_DIR, name + '.json')
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+    return path
+
+
+def load_baseline(name):
+    with open(os.path.join(BASELINES_DIR, name + '.json')) as f:
+        return json.load(f)
+
+
+def compare(data, baseline, tolerance=0.2):
+    """
+    Print every compared metric next to its baseline value and return the names of the metrics
+    that are more than tolerance (a fraction) slower than the baseline.
+    """
+    if baseline['config'] != data['config']:
+        print(f"warning: the baseline was run with {baseline['config']}")
+    regressions = []
+    for name, result in data['results'].items():
+        baseline_result = baseline['results'].get(name)
+        if baseline_result is None:
+            print(f"{name}: not in the baseline")
+            continue
+        for metric in COMPARED_METRICS:
+            value, baseline_value = result[metric], baseline_result[metric]
+            ratio = value / baseline_value if baseline_value else float('inf')
+            regressed = ratio > 1 + tolerance
+            if regressed:
+                regressions.append(f"{name}.{metric}")
+            print(f"{name:42s} {metric:8s} {baseline_value:10.3f} -> {value:10.3f} ms "
+                  f"({ratio:5.2f}x){'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def finish(data, save=None, baseline=None, tolerance=0.2):
+    """
+    Save and compare the results as asked on the command line; exits with status 1 on a regression.
+    """
+    print(json.dumps(data['results'], indent=2))
+    if save:
+        print(f"Baseline has been saved to '{save_baseline(save, data)}'.")
+    if baseline:
+        regressions = compare(data, load_baseline(baseline), tolerance)
+        if regressions:
+            print(f"{len(regressions)} metrics regressed by more than {tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
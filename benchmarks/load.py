@@ -0,0 +1,106 @@
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from benchmarks.common import finish, load_service, report, summarize
+
+
+def request_paths(n_requests, n_users, aisle_ids, moods, new_user_share=0.1, N=10, seed=0):
+    """
+    Return the seeded /predict paths of a run: random known users and moods, and a share of new
+    users with three random interested aisles.
+    """
+    rng = np.random.default_rng(seed)
+    paths = []
+    for _ in range(n_requests):
+        mood = rng.choice(moods)
+        if rng.random() < new_user_share:
+            aisles = ",".join(map(str, rng.choice(aisle_ids, 3, replace=False)))
+            paths.append(f'/predict?interested_aisles={aisles}&mood={mood}&N={N}')
+        else:
+            paths.append(f'/predict?userId={rng.integers(0, n_users)}&mood={mood}&N={N}')
+    return paths
+
+
+def drive(send, paths, concurrency):
+    """
+    Send every path from concurrency threads as fast as the service answers.
+    Args:
+        send: function sending one path and returning the HTTP status code
+    Returns:
+        the latency summary with throughput and the number of failed requests
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def one(path):
+        start = time.perf_counter()
+        status = send(path)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if status != 200:
+                errors.append(status)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, paths))
+    summary = summarize(latencies, time.perf_counter() - start)
+    summary['errors'] = len(errors)
+    return summary
+
+
+def run(data_dir, url=None, n_requests=2000, concurrency=8, new_user_share=0.1, N=10, seed=0):
+    """
+    Drive /predict end to end, in process through the Flask test client, or over HTTP against a
+    running service at url. The users and aisles are sampled from the data in data_dir either way.
+    Returns:
+        (the model version benchmarked, {'predict': latency summary})
+    """
+    service = load_service(data_dir)
+    models = service.model_registry.current
+    paths = request_paths(n_requests, models.user_product_matrix.shape[0], models.products_df["aisle_id"].unique(),
+                          list(service.emotion_dict), new_user_share, N, seed)
+    if url is not None:
+        session = requests.Session()
+        session.mount(url, requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+        version = session.get(url + '/models').json()['active']
+        send = lambda path: session.get(url + path).status_code
+    else:
+        version = models.version
+        local = threading.local()
+
+        def send(path):
+            client = getattr(local, 'client', None)
+            if client is None:
+                client = local.client = service.app.test_client()
+            return client.get(path).status_code
+
+    #warm up the caches built on the first request of a day
+    for path in paths[:concurrency]:
+        send(path)
+    return version, {'predict': drive(send, paths, concurrency)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="End-to-end /predict load driver.")
+    parser.add_argument('--data', required=True, help="a directory written by benchmarks.synthetic_data")
+    parser.add_argument('--url', help="the base URL of a running service on the same data, e.g. http://localhost:5525")
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--new-user-share', type=float, default=0.1)
+    parser.add_argument('--N', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help="save the results as baselines/<name>.json")
+    parser.add_argument('--compare', help="compare the results with baselines/<name>.json")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slowdown, as a fraction")
+    args = parser.parse_args()
+    version, results = run(args.data, args.url, args.requests, args.concurrency, args.new_user_share, args.N, args.seed)
+    config = {'model_version': version, 'target': 'http' if args.url else 'in-process', 'requests': args.requests,
+              'concurrency': args.concurrency, 'new_user_share': args.new_user_share, 'N': args.N, 'seed': args.seed}
+    finish(report('load', config, results), args.save, args.compare, args.tolerance)
@@ -0,0 +1,91 @@
+import argparse
+
+import numpy as np
+
+from benchmarks.common import finish, load_service, measure, report
+from expiration_index import ExpirationIndex
+from neighbor_index import NeighborIndex
+
+
+def run(data_dir, samples=200, N=10, days=15, seed=0):
+    """
+    Time every stage of /predict separately over samples random users.
+    Returns:
+        (the model version benchmarked, {stage name: latency summary})
+    """
+    service = load_service(data_dir)
+    models = service.model_registry.current
+    rng = np.random.default_rng(seed)
+    n_users = models.user_product_matrix.shape[0]
+    user_ids = rng.integers(0, n_users, samples)
+    moods = rng.choice(list(service.emotion_dict), samples)
+    aisle_ids = models.products_df["aisle_id"].unique()
+    interested_aisles = [",".join(map(str, rng.choice(aisle_ids, 3, replace=False))) for _ in range(samples)]
+    #the base recommendations the later stages start from
+    recommended = [ids[ids >= 0] for ids in service.base_recommendations(user_ids, N, models, 'live')[0]]
+    cases = list(zip(user_ids, moods, recommended))
+
+    results = {}
+    results['cf_live'] = measure(lambda case: service.base_recommendations([case[0]], N, models, 'live'), cases)
+    if models.topn_table is not None:
+        results['cf_precomputed'] = measure(
+            lambda case: service.base_recommendations([case[0]], N, models, 'precomputed'), cases)
+    results['product_neighbors_mood'] = measure(
+        lambda case: service.current_emotion_related_positions(case[2], case[1], models=models), cases)
+    results['close_to_expiration_pool'] = measure(
+        lambda case: service.get_close_to_expiration_neighbors(days, models), cases)
+    #a fresh index per call measures the pool and neighbor index build of the first request of a day
+    results['close_to_expiration_pool_build'] = measure(
+        lambda case: ExpirationIndex(models.products_expiration_df,
+                                     lambda pool_df: NeighborIndex(pool_df["product_id"].values,
+                                                                   models.product_embeddings,
+                                                                   models.neighbor_graph)).close_to_expiration(days),
+        cases[:max(samples // 10, 5)], warmup=1)
+    results['product_neighbors_close_to_expiration'] = measure(
+        lambda case: service.close_to_expiration_positions(case[2], days=days, models=models), cases)
+    results['get_initial_recommendations_for_new_users'] = measure(
+        lambda aisles: service.get_initial_recommendations_for_new_users(aisles, N, models), interested_aisles)
+    results['purchase_history'] = measure(
+        lambda case: service.product_records_json(
+            service.purchased_product_positions(int(case[0]), 0, service.HISTORY_PAGE_SIZE, False, models), models),
+        cases)
+
+    #JSON formatting of full responses from the catalog rows of every stage, found once per user
+    responses = []
+    for user_id, mood, items in cases:
+        close_to_exp_positions, days_until_expiration = service.close_to_expiration_positions(items, days=days,
+                                                                                              models=models)
+        responses.append((np.sort(service.get_catalog_positions(items, models))[:6],
+                          service.current_emotion_related_positions(items, mood, models=models)[:3],
+                          close_to_exp_positions[:3], days_until_expiration[:3],
+                          service.purchased_product_positions(int(user_id), 0, service.HISTORY_PAGE_SIZE,
+                                                             models=models)))
+
+    def format_response(response):
+        initial, mood, close_to_exp, days_until_expiration, purchased = response
+        return service.json_object({
+            'initial_recommendations': service.product_records_json(initial, models),
+            'mood_related_recommendations': service.product_records_json(mood, models),
+            'close_to_exp_recommendations': service.product_records_json(close_to_exp, models,
+                                                                         days_until_expiration=days_until_expiration),
+            'actual_purchased_products': service.product_records_json(purchased, models),
+            'actual_purchased_total': service.encode_json(len(purchased)),
+            'model_version': service.encode_json(models.version)}) + b'\n'
+    results['json_formatting'] = measure(format_response, responses)
+    return models.version, results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the /predict stages.")
+    parser.add_argument('--data', required=True, help="a directory written by benchmarks.synthetic_data")
+    parser.add_argument('--samples', type=int, default=200)
+    parser.add_argument('--N', type=int, default=10)
+    parser.add_argument('--days', type=int, default=15)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help="save the results as baselines/<name>.json")
+    parser.add_argument('--compare', help="compare the results with baselines/<name>.json")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slowdown, as a fraction")
+    args = parser.parse_args()
+    version, results = run(args.data, args.samples, args.N, args.days, args.seed)
+    config = {'model_version': version, 'samples': args.samples, 'N': args.N, 'days': args.days, 'seed': args.seed}
+    finish(report('stages', config, results), args.save, args.compare, args.tolerance)
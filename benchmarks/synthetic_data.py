@@ -0,0 +1,119 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+from aisle_popularity import AislePopularity
+from artifact_bundle import Artifacts, write_bundle
+from precomputed_recommendations import precompute
+
+MOODS = ['positive', 'negative', 'unclassified']
+
+
+def generate(out_dir, n_users=10000, n_products=20000, n_interactions=100000, n_aisles=134, n_departments=21,
+             factors=64, embedding_dim=16, seed=0, topn=None):
+    """
+    Write a synthetic dataset shaped like capstone-dataset and a model bundle trained on nothing,
+    so the service can be benchmarked at any scale without the real data and pickles.
+    Product popularity follows a Zipf-like law, product embeddings are clustered per aisle so the
+    neighbor stages find matches, and expiration dates spread over the next 60 days.
+    Args:
+        out_dir: the directory to write capstone-dataset/ and trained_model/ to
+        n_users: the number of users
+        n_products: the number of products
+        n_interactions: the number of purchases sampled; repeated pairs add up to purchase counts
+        n_aisles: the number of aisles
+        n_departments: the number of departments
+        factors: the number of ALS factors
+        embedding_dim: the dimension of the content-based embeddings
+        seed: the random seed; the same arguments always write the same data
+        topn: the width of the precomputed top N table; None to skip it
+    Returns:
+        the path of the bundle
+    """
+    rng = np.random.default_rng(seed)
+    dataset_dir = os.path.join(out_dir, 'capstone-dataset')
+    model_dir = os.path.join(out_dir, 'trained_model')
+    os.makedirs(dataset_dir, exist_ok=True)
+    os.makedirs(model_dir, exist_ok=True)
+
+    #catalog
+    aisles_df = pd.DataFrame({'aisle_id': np.arange(1, n_aisles + 1),
+                              'aisle': [f'aisle {i}' for i in range(1, n_aisles + 1)]})
+    departments_df = pd.DataFrame({'department_id': np.arange(1, n_departments + 1),
+                                   'department': [f'department {i}' for i in range(1, n_departments + 1)]})
+    aisle_departments = rng.integers(1, n_departments + 1, n_aisles)
+    product_aisles = rng.integers(1, n_aisles + 1, n_products)
+    products_df = pd.DataFrame({'product_id': np.arange(n_products),
+                                'product_name': [f'Product {i}' for i in range(n_products)],
+                                'aisle_id': product_aisles,
+                                'department_id': aisle_departments[product_aisles - 1]})
+    mood_df = aisles_df.assign(mood=rng.choice(MOODS, n_aisles))
+    today = pd.Timestamp.now().normalize()
+    expiration_df = pd.DataFrame({'product_id': products_df['product_id'],
+                                  'expiration_date': (today + pd.to_timedelta(rng.integers(0, 60, n_products), 'D'))})
+
+    #purchases
+    popularity = 1.0 / np.arange(1, n_products + 1) ** 0.8
+    popularity = rng.permutation(popularity / popularity.sum())
+    users = rng.integers(0, n_users, n_interactions)
+    products = rng.choice(n_products, n_interactions, p=popularity)
+    user_product_matrix = sparse.csr_matrix((np.ones(n_interactions, dtype=np.float64), (users, products)),
+                                            shape=(n_users, n_products))
+    user_product_matrix.sum_duplicates()
+    counts = user_product_matrix.tocoo()
+    purchase_counts_df = pd.DataFrame({'user_id': counts.row, 'product_id': counts.col,
+                                       'purchase_count': counts.data.astype(np.int64)})
+
+    #models
+    user_factors = rng.normal(scale=0.1, size=(n_users, factors)).astype(np.float32)
+    item_factors = rng.normal(scale=0.1, size=(n_products, factors)).astype(np.float32)
+    aisle_centers = rng.normal(size=(n_aisles, embedding_dim))
+    #per-product noise around the aisle center puts some same-aisle pairs within the 0.0001 neighbor threshold
+    noise = rng.normal(size=(n_products, embedding_dim)) * rng.uniform(0.0005, 0.004, (n_products, 1))
+    product_embeddings = (aisle_centers[product_aisles - 1] + noise).astype(np.float32)
+    user_embeddings = rng.normal(size=(n_users, embedding_dim)).astype(np.float32)
+
+    products_df.to_csv(os.path.join(dataset_dir, 'products.csv'), index=False)
+    aisles_df.to_csv(os.path.join(dataset_dir, 'aisles.csv'), index=False)
+    departments_df.to_csv(os.path.join(dataset_dir, 'departments.csv'), index=False)
+    mood_df.to_csv(os.path.join(dataset_dir, 'mood_categorized_aisles.csv'), index=False)
+    expiration_df.assign(expiration_date=expiration_df['expiration_date'].dt.strftime('%Y-%m-%d')).to_csv(
+        os.path.join(dataset_dir, 'products_with_expiration.csv'), index=False)
+    purchase_counts_df.to_csv(os.path.join(dataset_dir, 'purchase_count_train_df.csv'), index=False)
+
+    #the same merges load_legacy_artifacts does
+    products_df = pd.merge(products_df, aisles_df, on="aisle_id")
+    products_df = pd.merge(products_df, departments_df, on="department_id")
+    products_mood_df = pd.merge(products_df, mood_df.drop(columns=['aisle']), on="aisle_id")
+    products_expiration_df = pd.merge(products_df, expiration_df, on="product_id")
+    aisle_popularity = AislePopularity.build_from_matrix(user_product_matrix, products_df)
+
+    version = f'synthetic-{seed}-{n_interactions}'
+    artifacts = Artifacts(version, user_factors, item_factors, user_product_matrix, product_embeddings,
+                          user_embeddings, products_df, products_mood_df, products_expiration_df, aisle_popularity)
+    bundles_dir = os.path.join(model_dir, 'bundles')
+    if os.path.exists(os.path.join(bundles_dir, version)):
+        raise SystemExit(f"{os.path.join(bundles_dir, version)} already exists; use another --out or --seed.")
+    path = write_bundle(artifacts, bundles_dir, version)
+    if topn:
+        precompute(user_factors, item_factors, user_product_matrix, os.path.join(model_dir, 'topn'), version, N=topn)
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a seeded synthetic dataset and model bundle.")
+    parser.add_argument('--out', required=True, help="the directory to write the data to")
+    parser.add_argument('--interactions', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=None, help="default: interactions / 10")
+    parser.add_argument('--products', type=int, default=None, help="default: interactions / 5, at most 50000")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--topn', type=int, default=100, help="width of the precomputed top N table; 0 to skip it")
+    args = parser.parse_args()
+    n_users = args.users or max(args.interactions // 10, 100)
+    n_products = args.products or min(max(args.interactions // 5, 1000), 50000)
+    path = generate(args.out, n_users, n_products, args.interactions, seed=args.seed, topn=args.topn)
+    print(f"Synthetic data with {args.interactions} interactions, {n_users} users and {n_products} products "
+          f"has been saved to '{args.out}' (bundle '{path}').")
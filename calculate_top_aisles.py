@@ -1,36 +1,19 @@
-import pandas as pd
-
-# Load CSV files
-aisles_df = pd.read_csv('aisles.csv')
-departments_df = pd.read_csv('departments.csv')
-products_df = pd.read_csv('products.csv')
-orders_df = pd.read_csv('orders.csv')
-order_products_prior_df = pd.read_csv('order_products__prior.csv')
-order_products_train_df = pd.read_csv('order_products__train.csv')
-
-# Merge dataframes to include aisle and department information
-products_df = pd.merge(products_df, aisles_df, on="aisle_id")
-products_df = pd.merge(products_df, departments_df, on="department_id")
+import sys
 
-# Merge order products with product details
-order_products_prior_df = pd.merge(order_products_prior_df, products_df, on="product_id")
-order_products_train_df = pd.merge(order_products_train_df, products_df, on="product_id")
-
-# Filter prior and train orders
-order_user_prior_df = orders_df[orders_df["eval_set"] == 'prior']
-order_user_train_df = orders_df[orders_df["eval_set"] == 'train']
+import pandas as pd
 
-order_user_product_prior_df = pd.merge(order_user_prior_df, order_products_prior_df, on="order_id")
-order_user_product_train_df = pd.merge(order_user_train_df, order_products_train_df, on="order_id")
+from purchase_aggregation import aggregate, top_aisles
 
-# Combine prior and train order dataframes
-all_orders_df = pd.concat([order_user_product_prior_df, order_user_product_train_df])
+# Number of processes aggregating chunks of order products in parallel
+processes = int(sys.argv[1]) if len(sys.argv) > 1 else 1
 
-# Calculate total purchases for each aisle, retaining aisle_id
-aisle_purchase_counts = all_orders_df.groupby(['aisle_id', 'aisle'])['product_id'].count().reset_index(name='total_purchases')
+# Stream the prior and train order products in chunks, counting the purchases of every aisle
+# on id arrays instead of merging the full order tables with the product metadata
+aisle_purchase_counts, _ = aggregate('.', processes=processes, count_pairs=False)
 
-# Get the top 50 aisles by total purchases
-top_50_aisles = aisle_purchase_counts.nlargest(50, 'total_purchases')
+# Get the top 50 aisles by total purchases, retaining aisle_id
+aisles_df = pd.read_csv('aisles.csv')
+top_50_aisles = top_aisles(aisle_purchase_counts, aisles_df, 50)
 
 # Output the result to a new CSV file
 top_50_aisles.to_csv('top_50_aisles.csv', index=False)
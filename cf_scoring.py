@@ -0,0 +1,54 @@
+import numpy as np
+
+
+def factors_of(model):
+    """
+    Return the (user factors, item factors) of a trained implicit ALS model as numpy arrays.
+    """
+    if hasattr(model, "to_cpu"):
+        model = model.to_cpu()
+    return np.asarray(model.user_factors), np.asarray(model.item_factors)
+
+
+def recommend_users(user_factors, item_factors, user_items, user_ids, N=10, block_size=256):
+    """
+    Score many users against the item factors and return their top N items.
+    Users are scored in blocks with one matrix multiply each; the items a user already
+    purchased (the non-zero entries of the user's row in user_items) are filtered out
+    the same way CF_model.recommend does.
+    Args:
+        user_factors: the user factors of the ALS model
+        item_factors: the item factors of the ALS model
+        user_items: the CSR user-product matrix; None to keep purchased items
+        user_ids: the ids of the users to score
+        N: the number of recommendations per user
+        block_size: the number of users scored per matrix multiply
+    Returns:
+        (item ids, scores), both of shape (len(user_ids), N) and sorted by descending score;
+        slots without a recommendable item hold id -1 and score -inf
+    """
+    user_ids = np.asarray(user_ids, dtype=np.int64)
+    N = max(min(N, item_factors.shape[0]), 0)
+    ids = np.full((len(user_ids), N), -1, dtype=np.int64)
+    top_scores = np.full((len(user_ids), N), -np.inf, dtype=np.float32)
+    if N <= 0:
+        return ids, top_scores
+
+    for start in range(0, len(user_ids), block_size):
+        block_users = user_ids[start:start + block_size]
+        scores = user_factors[block_users] @ item_factors.T
+        if user_items is not None:
+            liked = user_items[block_users]
+            rows = np.repeat(np.arange(len(block_users)), np.diff(liked.indptr))
+            scores[rows, liked.indices] = -np.inf
+
+        top = np.argpartition(-scores, N - 1, axis=1)[:, :N]
+        block_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-block_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        block_scores = np.take_along_axis(block_scores, order, axis=1)
+        top[np.isneginf(block_scores)] = -1
+
+        ids[start:start + len(block_users)] = top
+        top_scores[start:start + len(block_users)] = block_scores
+    return ids, top_scores
@@ -0,0 +1,234 @@
+import os
+import sys
+
+import numpy as np
+import scipy.sparse as sparse
+
+from cf_scoring import recommend_users
+from worker_pool import fork_map, shared
+
+METRICS = ('precision', 'recall', 'f1_score', 'map', 'ndcg')
+NEIGHBOR_METRICS = ('precision', 'recall', 'f1_score')
+
+
+def _with_shape(matrix, shape):
+    matrix = sparse.csr_matrix(matrix)
+    if matrix.shape != shape:
+        matrix = sparse.csr_matrix((matrix.data, matrix.indices, np.concatenate(
+            [matrix.indptr, np.full(shape[0] - matrix.shape[0], matrix.indptr[-1])])), shape=shape)
+    return matrix
+
+
+def relevant_items(train_matrix, test_matrix):
+    """
+    Return the CSR matrix of the items each user purchased in the test set but never in the
+    training set, the actual items the notebooks score recommendations against.
+    Args:
+        train_matrix: the CSR user x product purchase counts the model was trained on
+        test_matrix: the CSR user x product purchase counts of the test orders
+    """
+    shape = (max(train_matrix.shape[0], test_matrix.shape[0]), max(train_matrix.shape[1], test_matrix.shape[1]))
+    train = _with_shape(train_matrix, shape).astype(bool).astype(np.int8)
+    test = _with_shape(test_matrix, shape).astype(bool).astype(np.int8)
+    relevant = test - test.multiply(train)
+    relevant.eliminate_zeros()
+    relevant.sort_indices()
+    return relevant.tocsr()
+
+
+def test_users(test_matrix, share=None, max_users=None, seed=0):
+    """
+    Return the ids of the users with test purchases, or a seeded random sample of them.
+    Args:
+        share: the share of the test users to sample, like the percentage of the content-based notebook
+        max_users: the most users to sample
+    """
+    users = np.flatnonzero(np.diff(test_matrix.indptr))
+    n_users = len(users)
+    if share is not None:
+        n_users = int(n_users * share)
+    if max_users is not None:
+        n_users = min(n_users, max_users)
+    if n_users < len(users):
+        users = np.sort(np.random.default_rng(seed).choice(users, n_users, replace=False))
+    return users
+
+
+def top_n_metrics(recommended, relevant_rows):
+    """
+    Return the precision, recall, F1, average precision and NDCG at N of every user, vectorized.
+    Precision is over the recommended items, recall and F1 are computed per user and are 0 for users
+    without relevant items, as in the notebooks; average precision and NDCG use binary relevance.
+    Args:
+        recommended: int array of shape (users, N) of the ranked recommended items, -1 for empty slots
+        relevant_rows: the CSR relevant items of the same users, one row per row of recommended
+    Returns:
+        dict of float arrays of length users, keyed by METRICS
+    """
+    n_users, N = recommended.shape
+    n_items = relevant_rows.shape[1]
+    relevant_rows.sort_indices()
+    rows = np.repeat(np.arange(n_users, dtype=np.int64), np.diff(relevant_rows.indptr))
+    relevant_keys = rows * n_items + relevant_rows.indices
+    valid = (recommended >= 0) & (recommended < n_items)
+    keys = (np.arange(n_users, dtype=np.int64)[:, None] * n_items + recommended)[valid]
+    positions = np.minimum(np.searchsorted(relevant_keys, keys), max(len(relevant_keys) - 1, 0))
+    hits = np.zeros(recommended.shape, dtype=bool)
+    if len(relevant_keys):
+        hits[valid] = relevant_keys[positions] == keys
+
+    n_hits = hits.sum(axis=1)
+    n_recommended = valid.sum(axis=1)
+    n_relevant = np.diff(relevant_rows.indptr)
+    precision = np.divide(n_hits, n_recommended, out=np.zeros(n_users), where=n_recommended > 0)
+    recall = np.divide(n_hits, n_relevant, out=np.zeros(n_users), where=n_relevant > 0)
+    f1_score = np.divide(2 * precision * recall, precision + recall, out=np.zeros(n_users),
+                         where=precision + recall > 0)
+
+    ranks = np.arange(1, N + 1)
+    n_ideal = np.minimum(n_relevant, N)
+    precision_at_rank = np.cumsum(hits, axis=1) / ranks
+    average_precision = np.divide((precision_at_rank * hits).sum(axis=1), n_ideal, out=np.zeros(n_users),
+                                  where=n_ideal > 0)
+    discounts = 1 / np.log2(ranks + 1)
+    ideal_dcg = np.concatenate([[0], np.cumsum(discounts)])[n_ideal]
+    ndcg = np.divide((hits * discounts).sum(axis=1), ideal_dcg, out=np.zeros(n_users), where=ideal_dcg > 0)
+    return {'precision': precision, 'recall': recall, 'f1_score': f1_score, 'map': average_precision, 'ndcg': ndcg}
+
+
+def _arrays(*arrays):
+    return {'arrays': arrays}
+
+
+def _score_users(users, N):
+    """
+    Score one block of users with the shared factors and return the sums of their metrics.
+    """
+    user_factors, item_factors, train_matrix, relevant = shared['arrays']
+    if user_factors is None:
+        #one shared ranking, the popular items
+        recommended = np.broadcast_to(item_factors[:N], (len(users), min(N, len(item_factors))))
+    else:
+        recommended, _ = recommend_users(user_factors, item_factors, train_matrix, users, N)
+    metrics = top_n_metrics(recommended, relevant[users])
+    return {name: float(values.sum()) for name, values in metrics.items()}
+
+
+def _score_neighbors(items, N):
+    """
+    Find the N most similar items of one block of items and return the sums of their aisle metrics.
+    """
+    vectors, item_aisles, aisle_sizes = shared['arrays']
+    similarities = vectors[items] @ vectors.T
+    top = np.argpartition(-similarities, N - 1, axis=1)[:, :N]
+    aisles = item_aisles[items]
+    same_aisle = (item_aisles[top] == aisles[:, None]).sum(axis=1)
+    precision = same_aisle / N
+    recall = same_aisle / aisle_sizes[aisles]
+    f1_score = np.divide(2 * precision * recall, precision + recall, out=np.zeros(len(items)),
+                         where=precision + recall > 0)
+    return {'precision': float(precision.sum()), 'recall': float(recall.sum()), 'f1_score': float(f1_score.sum())}
+
+
+def _run_blocks(score, ids, N, init_args, block_size, processes):
+    """
+    Run score over the blocks of ids, in a pool of forked processes when there are several blocks,
+    and return the means of the summed metrics.
+    """
+    blocks = [(ids[start:start + block_size], N) for start in range(0, len(ids), block_size)]
+    processes = processes or os.cpu_count() or 1
+    totals = {}
+    for result in fork_map(score, blocks, _arrays, init_args, processes if len(blocks) > 1 else 1):
+        for name, value in result.items():
+            totals[name] = totals.get(name, 0.0) + value
+    return {name: value / len(ids) for name, value in totals.items()} if len(ids) else {}
+
+
+def evaluate(user_factors, item_factors, train_matrix, test_matrix, N=10, filter_purchased=True, users=None,
+             block_size=1024, processes=None):
+    """
+    Evaluate the top N recommendations of a model that scores users by the dot product of user and
+    item vectors: the ALS factors, the SVD embeddings or the content-based user and product embeddings.
+    Users are scored in blocks with one matrix multiply each, spread over a pool of processes.
+    Args:
+        user_factors: the user vectors, indexed by user id
+        item_factors: the item vectors, indexed by product id
+        train_matrix: the CSR user x product purchase counts the model was trained on
+        test_matrix: the CSR user x product purchase counts of the test orders
+        N: the number of recommendations per user
+        filter_purchased: leave out the items a user purchased in train_matrix, as CF_model.recommend does
+        users: the ids of the users to evaluate; every user with test purchases by default
+        block_size: the number of users per block
+        processes: the number of processes; None for one per core
+    Returns:
+        dict of the metrics averaged over the users, keyed by METRICS
+    """
+    relevant = relevant_items(train_matrix, test_matrix)
+    users = test_users(test_matrix) if users is None else np.asarray(users, dtype=np.int64)
+    init_args = (user_factors, item_factors, train_matrix if filter_purchased else None, relevant)
+    return _run_blocks(_score_users, users, N, init_args, block_size, processes)
+
+
+def evaluate_popularity(train_matrix, test_matrix, N=10, users=None, block_size=8192, processes=1):
+    """
+    Evaluate the baseline recommending the N items with the most purchases in train_matrix to every user.
+    Returns:
+        dict of the metrics averaged over the users, keyed by METRICS
+    """
+    relevant = relevant_items(train_matrix, test_matrix)
+    users = test_users(test_matrix) if users is None else np.asarray(users, dtype=np.int64)
+    purchases = np.asarray(train_matrix.sum(axis=0)).ravel()
+    popular_items = np.argsort(-purchases, kind='stable')[:N]
+    init_args = (None, popular_items, None, relevant)
+    return _run_blocks(_score_users, users, N, init_args, block_size, processes)
+
+
+def evaluate_neighbors(item_vectors, item_aisles, N=10, items=None, block_size=1024, processes=None):
+    """
+    Evaluate the N most similar items of every item by the share of them in the item's own aisle:
+    precision is that share, recall the share of the aisle found. Similarity is the cosine of the
+    item vectors, as similar_items of the ALS model and the distances of the L2-normalized content-based
+    embeddings rank them; an item counts as its own neighbor, as it does there.
+    Args:
+        item_vectors: the item factors or product embeddings, indexed by product id
+        item_aisles: the aisle id of every product id, -1 for ids that are not products
+        items: the product ids to evaluate, all with an aisle; every product by default
+    Returns:
+        dict of the metrics averaged over the items, keyed by NEIGHBOR_METRICS
+    """
+    item_vectors = np.asarray(item_vectors, dtype=np.float32)
+    norms = np.linalg.norm(item_vectors, axis=1, keepdims=True)
+    vectors = np.divide(item_vectors, norms, out=np.zeros_like(item_vectors), where=norms > 0)
+    #product ids past the end of item_aisles are not products
+    item_aisles = np.concatenate([np.asarray(item_aisles, dtype=np.int64)[:len(vectors)],
+                                  np.full(max(len(vectors) - len(item_aisles), 0), -1)])
+    if items is None:
+        items = np.flatnonzero(item_aisles >= 0)
+    aisle_sizes = np.bincount(item_aisles[item_aisles >= 0], minlength=int(item_aisles.max()) + 1)
+    N = min(N, len(vectors))
+    return _run_blocks(_score_neighbors, np.asarray(items, dtype=np.int64), N, (vectors, item_aisles, aisle_sizes),
+                       block_size, processes)
+
+
+if __name__ == '__main__':
+    #evaluation of the current model version, run from the repository root: python evaluation.py [N]
+    from artifact_bundle import load_artifacts
+    from purchase_aggregation import aggregate, build_user_product_matrix, product_aisle_lookup
+
+    artifacts = load_artifacts('trained_model', 'capstone-dataset')
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    _, pair_counts = aggregate('capstone-dataset', artifacts.products_df)
+    train_matrix = artifacts.user_product_matrix
+    test_matrix = build_user_product_matrix(pair_counts['train'])
+    item_aisles = product_aisle_lookup(artifacts.products_df)
+
+    results = {
+        'baseline': evaluate_popularity(train_matrix, test_matrix, N),
+        'als': evaluate(artifacts.user_factors, artifacts.item_factors, train_matrix, test_matrix, N),
+        'content_based': evaluate(artifacts.user_embeddings, artifacts.product_embeddings, train_matrix, test_matrix,
+                                  N, filter_purchased=False),
+        'als_neighbors': evaluate_neighbors(artifacts.item_factors, item_aisles, N),
+        'content_based_neighbors': evaluate_neighbors(artifacts.product_embeddings, item_aisles, N),
+    }
+    for model, metrics in results.items():
+        print(model, ' '.join(f"{name}={value:.4f}" for name, value in metrics.items()))
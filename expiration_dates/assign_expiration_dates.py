@@ -1,41 +1,209 @@
-import pandas as pd
+import argparse
+import json
+import os
+import shutil
+from datetime import datetime
+
 import numpy as np
-from datetime import datetime, timedelta
+import pandas as pd
+
+#days after today every product may expire within: 1 to 364
+MAX_DAYS = 365
+#(share of the department, expiration within days) rules applied in order over the random dates;
+#the shares are sampled independently, so a later rule can override an earlier one
+FRESH_RULES = [(0.045, 3), (0.955, 7)]  # Ensuring the remaining 95.5% are within 7 days
+DEPARTMENT_RULES = {'produce': FRESH_RULES, 'bakery': FRESH_RULES, 'meat seafood': FRESH_RULES}
+DEFAULT_RULES = [(0.02, 30)]
+#columns of a store partition, one .npy file each
+STORE_COLUMNS = ('product_id', 'department_id', 'expiration_date')
+
+
+def rule_tables(departments):
+    """
+    Return the rules of every department as two arrays of shape (number of rules, max department id + 1):
+    the share of the department each rule applies to and the days its dates fall within.
+    Departments with fewer rules get share 0 for the missing ones.
+    Args:
+        departments: the departments dataframe with department_id and department
+    """
+    rules = [DEPARTMENT_RULES.get(name, DEFAULT_RULES) for name in departments['department']]
+    n_rules = max(len(department_rules) for department_rules in rules)
+    shares = np.zeros((n_rules, int(departments['department_id'].max()) + 1))
+    days = np.full(shares.shape, 2, dtype=np.int64)
+    for department_id, department_rules in zip(departments['department_id'], rules):
+        for step, (share, within) in enumerate(department_rules):
+            shares[step, department_id] = share
+            days[step, department_id] = within
+    return shares, days
+
+
+def _sample_within_groups(rng, groups, sizes):
+    """
+    Return the indices of sizes[g] lots drawn without replacement from every group g,
+    for all groups at once: the lots are shuffled within their group and the first sizes[g] kept.
+    """
+    order = np.lexsort((rng.random(len(groups)), groups))
+    sorted_groups = groups[order]
+    starts = np.concatenate([[0], np.cumsum(np.bincount(groups, minlength=len(sizes)))[:-1]])
+    ranks = np.arange(len(groups)) - starts[sorted_groups]
+    return order[ranks < sizes[sorted_groups]]
+
+
+def expiration_dates(department_ids, rules, rng, today):
+    """
+    Draw the expiration dates of a set of lots like the notebooks' rules: a random date within a year,
+    then for every rule a date within its days for a random share of each department.
+    Args:
+        department_ids: int array of the department id of every lot
+        rules: the (shares, days) of rule_tables
+        rng: the numpy Generator drawing the dates
+        today: the datetime64[D] the dates count from
+    Returns:
+        datetime64[D] array of the expiration date of every lot
+    """
+    shares, days = rules
+    department_ids = np.asarray(department_ids, dtype=np.int64)
+    offsets = rng.integers(1, MAX_DAYS, size=len(department_ids))
+    department_sizes = np.bincount(department_ids, minlength=shares.shape[1])
+    for step in range(len(shares)):
+        sample_sizes = (department_sizes * shares[step]).astype(np.int64)
+        selected = _sample_within_groups(rng, department_ids, sample_sizes)
+        offsets[selected] = rng.integers(1, days[step, department_ids[selected]])
+    return np.datetime64(today, 'D') + offsets
+
+
+def assign_expiration_dates(products, departments, seed=0, today=None):
+    """
+    Return the products merged with the department names and an expiration_date column of 'YYYY-MM-DD'
+    strings, the products_with_expiration.csv the recommender serves from. The same seed and today
+    always give the same dates.
+    """
+    today = np.datetime64(today or datetime.now().date(), 'D')
+    products = products.merge(departments, on='department_id')
+    dates = expiration_dates(products['department_id'].values, rule_tables(departments),
+                             np.random.default_rng(seed), today)
+    products['expiration_date'] = np.datetime_as_string(dates, unit='D')
+    return products
+
+
+def store_path(stores_dir, store_id):
+    return os.path.join(stores_dir, f'store={store_id}')
+
+
+def store_rng(seed, store_id, day=None):
+    """
+    Return the Generator of a store's lots, or of its update on day; it depends only on the seed,
+    the store and the day, so any store can be regenerated on its own.
+    """
+    key = [seed, store_id] if day is None else [seed, store_id, int(np.datetime64(day, 'D').astype(np.int64))]
+    return np.random.default_rng(key)
+
+
+def write_store(stores_dir, store_id, columns, manifest):
+    """
+    Write the columns of one store as .npy files and its manifest into stores_dir/store=<id>/,
+    replacing any previous partition only once it is complete.
+    """
+    path = store_path(stores_dir, store_id)
+    temp_path = path + '.tmp'
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+    for name in STORE_COLUMNS:
+        np.save(os.path.join(temp_path, name + '.npy'), columns[name])
+    with open(os.path.join(temp_path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(temp_path, path)
+    return path
+
+
+def load_store(stores_dir, store_id, mmap_mode='r'):
+    """
+    Return the columns of a store partition, memory-mapped by default, and its manifest.
+    """
+    path = store_path(stores_dir, store_id)
+    columns = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode) for name in STORE_COLUMNS}
+    with open(os.path.join(path, 'manifest.json')) as f:
+        return columns, json.load(f)
+
+
+def store_ids(stores_dir):
+    """
+    Return the ids of the store partitions in stores_dir, in order.
+    """
+    return sorted(int(name.split('=', 1)[1]) for name in os.listdir(stores_dir)
+                  if name.startswith('store=') and not name.endswith('.tmp'))
 
-# Load the datasets
-products = pd.read_csv('products.csv')
-departments = pd.read_csv('departments.csv')
 
-# Merge the datasets to include department names
-products = products.merge(departments, on='department_id')
+def generate_stores(products, departments, stores_dir, n_stores, seed=0, today=None):
+    """
+    Write one partition of lots per store, one lot per product with its own expiration date.
+    Args:
+        products: the products dataframe with product_id and department_id
+        departments: the departments dataframe with department_id and department
+        stores_dir: the directory of the store partitions
+        n_stores: the number of stores, with ids 0 to n_stores - 1
+        seed: the seed every store's Generator is derived from
+        today: the date the expiration dates count from, today by default
+    """
+    today = np.datetime64(today or datetime.now().date(), 'D')
+    rules = rule_tables(departments)
+    product_ids = products['product_id'].values.astype(np.int32)
+    department_ids = products['department_id'].values.astype(np.int8)
+    for store_id in range(n_stores):
+        dates = expiration_dates(department_ids, rules, store_rng(seed, store_id), today)
+        write_store(stores_dir, store_id,
+                    {'product_id': product_ids, 'department_id': department_ids, 'expiration_date': dates},
+                    {'store_id': store_id, 'seed': seed, 'generated': str(today), 'updated': str(today),
+                     'lots': len(product_ids)})
 
-# Function to assign random expiration dates
-def assign_random_expiration_date():
-    return (datetime.now() + timedelta(days=np.random.randint(1, 365))).strftime('%Y-%m-%d')
 
-def assign_near_expiration_date(days):
-    return (datetime.now() + timedelta(days=np.random.randint(1, days))).strftime('%Y-%m-%d')
+def update_store(stores_dir, store_id, departments, today=None):
+    """
+    Restock the expired lots of a store (expiration date before today) with new dates drawn from the
+    department rules, writing only their entries of expiration_date.npy in place.
+    Returns:
+        the number of lots regenerated
+    """
+    today = np.datetime64(today or datetime.now().date(), 'D')
+    columns, manifest = load_store(stores_dir, store_id, mmap_mode='r+')
+    dates = columns['expiration_date']
+    expired = np.flatnonzero(dates < today)
+    if len(expired):
+        dates[expired] = expiration_dates(columns['department_id'][expired], rule_tables(departments),
+                                          store_rng(manifest['seed'], store_id, today), today)
+        dates.flush()
+    manifest['updated'] = str(today)
+    with open(os.path.join(store_path(stores_dir, store_id), 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return len(expired)
 
-# Initialize the expiration_date column with random dates
-products['expiration_date'] = products.apply(lambda x: assign_random_expiration_date(), axis=1)
 
-# Assign near expiration dates for specific departments
-def set_near_expiration(df, department, probability, days):
-    mask = df['department'] == department
-    sample_size = int(mask.sum() * probability)
-    expiration_indices = np.random.choice(df[mask].index, size=sample_size, replace=False)
-    df.loc[expiration_indices, 'expiration_date'] = [assign_near_expiration_date(days) for _ in range(sample_size)]
+if __name__ == '__main__':
+    #run from expiration_dates/
+    parser = argparse.ArgumentParser(description="Assign seeded expiration dates to the products.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--today', help="the date the expiration dates count from, YYYY-MM-DD; today by default")
+    parser.add_argument('--stores', type=int, help="write a partition of lots for this many stores instead of the CSV")
+    parser.add_argument('--out', default='stores', help="the directory of the store partitions")
+    parser.add_argument('--update', action='store_true', help="restock the expired lots of the store partitions")
+    args = parser.parse_args()
 
-for dept in ['produce', 'bakery', 'meat seafood']:
-    set_near_expiration(products, dept, 0.045, 3)
-    set_near_expiration(products, dept, 0.955, 7)  # Ensuring the remaining 95.5% are within 7 days
+    # Load the datasets
+    products = pd.read_csv('products.csv')
+    departments = pd.read_csv('departments.csv')
 
-for dept in products['department'].unique():
-    if dept not in ['produce', 'bakery', 'meat seafood']:
-        set_near_expiration(products, dept, 0.02, 30)
+    if args.update:
+        for store_id in store_ids(args.out):
+            print(f"store {store_id}: {update_store(args.out, store_id, departments, args.today)} expired lots restocked")
+    elif args.stores:
+        generate_stores(products, departments, args.out, args.stores, args.seed, args.today)
+        print(f"Lots of {args.stores} stores have been saved to '{args.out}'.")
+    else:
+        products = assign_expiration_dates(products, departments, args.seed, args.today)
 
-# Check if expiration_date column has values
-print(products.head())
+        # Check if expiration_date column has values
+        print(products.head())
 
-# Save the updated dataset
-products.to_csv('products_with_expiration.csv', index=False)
\ No newline at end of file
+        # Save the updated dataset
+        products.to_csv('products_with_expiration.csv', index=False)
@@ -0,0 +1,84 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, time
+
+import numpy as np
+import pandas as pd
+
+
+class ExpirationIndex:
+    """
+    Index of the products with expiration dates, built once at load time.
+
+    The expiration dates are parsed once and stored as integer day numbers sorted in
+    ascending order, so "expiring within N days" is a binary-search slice instead of a
+    date parse over the whole catalog on every request. The close-to-expiration pools are
+    cached per (date, days) in a small LRU, and the cache is dropped automatically when the
+    date rolls over.
+    """
+
+    def __init__(self, products_expiration_df, pool_index_builder=None, max_pools=8):
+        """
+        Args:
+            products_expiration_df: the products with an expiration_date column
+            pool_index_builder: optional function called once per new pool with the pool dataframe,
+                e.g. to build its NeighborIndex; its result is cached alongside the pool
+            max_pools: the most pools kept; the least recently used one is dropped beyond it
+        """
+        expiration_dates = pd.to_datetime(products_expiration_df["expiration_date"])
+        self.products = products_expiration_df.assign(expiration_date=expiration_dates).reset_index(drop=True)
+        expiration_days = expiration_dates.values.astype("datetime64[D]").astype(np.int64)
+        self.order = np.argsort(expiration_days, kind="stable")
+        self.sorted_days = expiration_days[self.order]
+        self.pool_index_builder = pool_index_builder
+        self.max_pools = max_pools
+        self._pools = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def day_number(now):
+        return int(np.datetime64(now.date(), "D").astype(np.int64))
+
+    def current_window(self, now=None):
+        """
+        Return the (day number, offset) the pools of now are keyed on; it changes when the date rolls over.
+        days_until_expiration counts the whole days left from now, so unless it is exactly midnight
+        a product expiring tomorrow has 0 days left (offset 1).
+        """
+        now = now or datetime.now()
+        return self.day_number(now), 0 if now.time() == time(0) else 1
+
+    def window(self, first_day, last_day):
+        """
+        Return the row positions of the products expiring between the two day numbers (inclusive),
+        in the original row order.
+        """
+        start = np.searchsorted(self.sorted_days, first_day, side="left")
+        stop = np.searchsorted(self.sorted_days, last_day, side="right")
+        return np.sort(self.order[start:stop])
+
+    def close_to_expiration(self, days=15, now=None):
+        """
+        Returns all items that are close to expiration within N days, and the result of
+        pool_index_builder for them.
+        """
+        today, offset = self.current_window(now)
+        key = (today, offset, days)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is not None:
+                self._pools.move_to_end(key)
+            else:
+                positions = self.window(today + 1 + offset, today + days + offset)
+                pool_df = self.products.iloc[positions].reset_index(drop=True)
+                expiration_days = pool_df["expiration_date"].values.astype("datetime64[D]").astype(np.int64)
+                pool_df["days_until_expiration"] = expiration_days - today - offset
+                pool_index = self.pool_index_builder(pool_df) if self.pool_index_builder else None
+                pool = (pool_df, pool_index)
+                #the date rolled over; pools of earlier days are stale
+                for stale_key in [k for k in self._pools if k[0] != today]:
+                    del self._pools[stale_key]
+                self._pools[key] = pool
+                while len(self._pools) > self.max_pools:
+                    self._pools.popitem(last=False)
+        return pool
@@ -0,0 +1,127 @@
+import io
+import os
+import threading
+import time
+
+import numpy as np
+
+
+class FaceIndex:
+    """
+    In-memory index of the face embeddings of every registered user, persisted in the storage bucket.
+
+    Signup stores a user's embedding once as face_embeddings/<user>.npy; login computes one embedding
+    and compares it with all users in a single matrix-vector product instead of recomputing the
+    representations of the whole photo gallery. The embeddings are L2-normalized, so the cosine
+    distance to every user is 1 - matrix @ embedding.
+
+    Signups and re-registrations handled by other workers are picked up by sync(), which lists the
+    bucket at most once every sync_interval seconds and reloads the embeddings whose blob generation
+    changed.
+    """
+
+    def __init__(self, bucket, prefix='face_embeddings/', threshold=0.68, sync_interval=5.0):
+        """
+        Args:
+            bucket: the storage bucket (Firebase Storage or a LocalBucket)
+            prefix: the blob prefix of the stored embeddings
+            threshold: the largest cosine distance accepted as a match
+            sync_interval: the fewest seconds between two listings of the bucket by sync()
+        """
+        self.bucket = bucket
+        self.prefix = prefix
+        self.threshold = threshold
+        self.sync_interval = sync_interval
+        self.user_keys = []
+        self._rows = {}
+        #blob generation of the embedding of every user, to notice re-registrations
+        self._generations = {}
+        self._last_sync = None
+        self._sync_lock = threading.Lock()
+        self._matrix = None
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, user_key):
+        return user_key in self._rows
+
+    def blob_name(self, user_key):
+        return f'{self.prefix}{user_key}.npy'
+
+    def add(self, user_key, embedding, persist=True, generation=None):
+        """
+        Add or replace the embedding of a user.
+        Args:
+            user_key: the user name with spaces replaced by underscores, as in source_photos/
+            embedding: the face embedding
+            persist: store the embedding in the bucket
+            generation: the generation of the stored blob, when the embedding was loaded from the bucket
+        """
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        embedding = embedding / (np.linalg.norm(embedding) or 1.0)
+        if persist:
+            buffer = io.BytesIO()
+            np.save(buffer, embedding)
+            blob = self.bucket.blob(self.blob_name(user_key))
+            blob.upload_from_string(buffer.getvalue(), content_type='application/octet-stream')
+            generation = blob.generation
+        with self._lock:
+            self._generations[user_key] = generation
+            if self._matrix is None:
+                self._matrix = np.empty((16, len(embedding)), dtype=np.float32)
+            row = self._rows.get(user_key)
+            if row is None:
+                if self._size == len(self._matrix):
+                    #grow by doubling, so adding users stays amortized O(1)
+                    self._matrix = np.concatenate([self._matrix, np.empty_like(self._matrix)])
+                row = self._size
+                self.user_keys.append(user_key)
+                self._rows[user_key] = row
+                self._size += 1
+            self._matrix[row] = embedding
+
+    def sync(self, force=False):
+        """
+        Load the embeddings stored in the bucket that are new or changed since they were loaded, e.g.
+        signups and re-registrations handled by another worker. Unless forced, the bucket is not listed
+        again within sync_interval of the last sync, nor while another thread is listing it.
+        Returns the number of embeddings loaded.
+        """
+        if not self._sync_lock.acquire(blocking=force):
+            return 0
+        try:
+            now = time.monotonic()
+            if not force and self._last_sync is not None and now - self._last_sync < self.sync_interval:
+                return 0
+            self._last_sync = now
+            loaded = 0
+            for blob in self.bucket.list_blobs(prefix=self.prefix):
+                user_key = os.path.splitext(os.path.basename(blob.name))[0]
+                if user_key in self._rows and self._generations.get(user_key) == blob.generation:
+                    continue
+                self.add(user_key, np.load(io.BytesIO(blob.download_as_bytes())), persist=False,
+                         generation=blob.generation)
+                loaded += 1
+            return loaded
+        finally:
+            self._sync_lock.release()
+
+    def search(self, embedding):
+        """
+        Return (user key, cosine distance) of the closest user within the threshold, or None.
+        """
+        with self._lock:
+            size = self._size
+            matrix = self._matrix
+        if size == 0:
+            return None
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        embedding = embedding / (np.linalg.norm(embedding) or 1.0)
+        distances = 1.0 - matrix[:size] @ embedding
+        best = int(np.argmin(distances))
+        if distances[best] > self.threshold:
+            return None
+        return self.user_keys[best], float(distances[best])
@@ -0,0 +1,62 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PoolBusy(Exception):
+    """
+    Raised when the inference queue stays full for longer than the queue timeout.
+    """
+
+
+class InferencePool:
+    """
+    Bounded thread pool for the CPU-heavy face inference. At most max_workers jobs run at once and
+    at most max_pending more wait in the queue; a request that cannot get a queue slot within
+    queue_timeout seconds is rejected with PoolBusy instead of piling up behind the others.
+    TensorFlow releases the GIL while it runs a model, so the threads use several cores.
+    """
+
+    def __init__(self, max_workers, max_pending, queue_timeout=5.0):
+        """
+        Args:
+            max_workers: the number of jobs running at once
+            max_pending: the number of jobs waiting for a worker
+            queue_timeout: the seconds to wait for a queue slot before rejecting a job
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="face-inference")
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = 0
+
+    def run(self, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) on a worker and return its result, raising PoolBusy if the queue is full.
+        """
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.rejected += 1
+            raise PoolBusy(f"{self.max_workers + self.max_pending} face inference jobs are already queued")
+        with self._lock:
+            self.in_flight += 1
+        try:
+            return self.executor.submit(fn, *args, **kwargs).result()
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def shutdown(self, wait=True):
+        """
+        Stop taking jobs; the running and queued ones still finish, later run() calls raise RuntimeError.
+        Args:
+            wait: block until the running and queued jobs have finished
+        """
+        self.executor.shutdown(wait=wait)
+
+    def stats(self):
+        return {"workers": self.max_workers, "max_pending": self.max_pending,
+                "in_flight": self.in_flight, "rejected": self.rejected}
@@ -0,0 +1,74 @@
+import os
+import shutil
+
+
+class LocalBlob:
+    """
+    A file under a LocalBucket, with the subset of the Firebase Storage blob API the face service uses.
+    """
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.path = os.path.join(bucket.root, name)
+
+    @property
+    def generation(self):
+        """
+        The modification time of the file in nanoseconds, standing in for the object generation; None if missing.
+        """
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    @property
+    def public_url(self):
+        return "file://" + os.path.abspath(self.path)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def upload_from_filename(self, filename, content_type=None):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        shutil.copyfile(filename, self.path)
+
+    def upload_from_string(self, data, content_type=None):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, self.path)
+
+    def download_to_filename(self, filename):
+        shutil.copyfile(self.path, filename)
+
+    def download_as_bytes(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+class LocalBucket:
+    """
+    Local directory standing in for the Firebase Storage bucket, e.g. in tests.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def blob(self, name):
+        return LocalBlob(self, name)
+
+    def list_blobs(self, prefix=""):
+        blobs = []
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(".tmp"):
+                    continue
+                name = os.path.relpath(os.path.join(directory, filename), self.root).replace(os.sep, "/")
+                if name.startswith(prefix):
+                    blobs.append(LocalBlob(self, name))
+        return sorted(blobs, key=lambda blob: blob.name)
@@ -3,19 +3,32 @@ from flask_cors import CORS
 from deepface import DeepFace
 from werkzeug.utils import secure_filename
 import os
-import shutil
+import sys
 import cv2
+import numpy as np
 import requests
 import firebase_admin
 from firebase_admin import credentials, firestore, storage
 from dotenv import load_dotenv
 
+from face_index import FaceIndex
+from inference_pool import InferencePool, PoolBusy
+from local_storage import LocalBucket
+
+# stage_metrics is shared with the recommender service at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..'))
+from stage_metrics import metrics_from_env
+
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
 CORS(app)
 
+# stage timings and counters served on /metrics; with PROFILE_TOKEN set, the X-Profile header returns a request's stage breakdown
+metrics = metrics_from_env('face')
+metrics.instrument(app)
+
 # Firebase Admin SDK setup
 cred = credentials.Certificate({
   "type": os.getenv('FIREBASE_TYPE'),
@@ -35,18 +48,87 @@ firebase_admin.initialize_app(cred, {'storageBucket': os.getenv('FIREBASE_STORAG
 # Initialize Firestore DB
 db = firestore.client()
 
-# Temp directory for processing images
-temp_directory = "./temp"
-os.makedirs(temp_directory, exist_ok=True)
+# Storage bucket of the source photos and face embeddings; FACE_STORAGE_DIR swaps in a local directory, e.g. for tests
+bucket = LocalBucket(os.getenv('FACE_STORAGE_DIR')) if os.getenv('FACE_STORAGE_DIR') else storage.bucket()
+
+def decode_image(data):
+    """
+    Function to decode an encoded photo into the BGR image array DeepFace and OpenCV work on.
+    """
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None or image.size == 0:
+        print("The photo could not be decoded.")
+        return None
+    return image
+
+def detect_face(image, enforce_detection=True):
+    """
+    Function to detect and align the first face in an image, once per photo.
+    Without enforce_detection the whole image is used when no face is detected, as DeepFace.find
+    did for the gallery photos.
+    Returns the face as a uint8 BGR array, or None.
+    """
+    try:
+        with metrics.span('detection'):
+            faces = DeepFace.extract_faces(img_path=image, detector_backend='opencv', enforce_detection=enforce_detection)
+        if len(faces) == 0:
+            print("No face detected in the photo.")
+            return None
+
+        face = faces[0]['face']
+        if face is None or face.size == 0:
+            print("Extracted face is empty or invalid.")
+            return None
+
+        # convert face to the uint8 BGR image DeepFace expects
+        if face.dtype != 'uint8':
+            face = (face * 255).astype('uint8')
+        return np.ascontiguousarray(face[:, :, ::-1])
+
+    except Exception as e:
+        print(f"Error during face detection: {e}")
+        return None
+
+def compute_face_embedding(face):
+    """
+    Function to compute the VGG-Face embedding of a detected face.
+    """
+    try:
+        # the face is already cropped and aligned, so skip detection
+        with metrics.span('embedding'):
+            representations = DeepFace.represent(img_path=face, model_name='VGG-Face', detector_backend='skip', enforce_detection=False)
+        return representations[0]['embedding']
+
+    except Exception as e:
+        print(f"Error during face embedding: {e}")
+        return None
+
+def warm_up_models():
+    """
+    Function to load the detector, VGG-Face and emotion models and run each once at startup,
+    so the first login does not pay for loading them.
+    """
+    image = np.zeros((224, 224, 3), dtype=np.uint8)
+    DeepFace.extract_faces(img_path=image, detector_backend='opencv', enforce_detection=False)
+    compute_face_embedding(image)
+    analyze_emotion(image)
 
-def clear_temp_directory():
-    if os.path.exists(temp_directory):
-        shutil.rmtree(temp_directory)
-    os.makedirs(temp_directory, exist_ok=True)
+def backfill_face_index():
+    """
+    Function to compute once the embeddings of source photos uploaded before the face index existed.
+    """
+    for blob in bucket.list_blobs(prefix='source_photos/'):
+        user_key = os.path.splitext(os.path.basename(blob.name))[0]
+        if user_key in face_index:
+            continue
+        image = decode_image(blob.download_as_bytes())
+        face = detect_face(image, enforce_detection=False) if image is not None else None
+        embedding = compute_face_embedding(face) if face is not None else None
+        if embedding is not None:
+            face_index.add(user_key, embedding)
 
 @app.route('/upload', methods=['POST'])
 def upload_photo():
-    clear_temp_directory()
     print("Received a request to /upload")
     print(f"Request form: {request.form}")
 
@@ -63,57 +145,58 @@ def upload_photo():
     if user_type not in ['signup', 'login']:
         return jsonify({"error": "Invalid user type"}), 400
 
-    # Download the image from Firebase Storage
-    response = requests.get(photo_url)
+    # Download the image from Firebase Storage and decode it once, in memory
+    with metrics.span('download'):
+        response = requests.get(photo_url)
     if response.status_code != 200:
         return jsonify({"error": "Failed to download the photo"}), 500
-    
-    safe_filename = os.path.basename(photo_url.split('?')[0])
-    photo_path = os.path.join(temp_directory, safe_filename)
-    with open(photo_path, 'wb') as f:
-        f.write(response.content)
+
+    with metrics.span('decode'):
+        image = decode_image(response.content)
+    if image is None:
+        return jsonify({"error": "Failed to process the photo"}), 400
 
     if user_type == 'signup':
-        # Save the photo to Firebase Storage
-        bucket = storage.bucket()
-        blob = bucket.blob(f'source_photos/{user_name.replace(" ", "_")}.jpg')
-        blob.upload_from_filename(photo_path)
+        # Compute the face embedding once, so logins never have to recompute it
+        try:
+            with metrics.span('inference'):
+                embedding = inference_pool.run(metrics.propagate(signup_embedding), image)
+        except PoolBusy as e:
+            return busy_response(e)
+        if embedding is None:
+            return jsonify({"error": "Failed to process the photo"}), 500
+
+        # Save the photo and its embedding to Firebase Storage
+        user_key = user_name.replace(" ", "_")
+        with metrics.span('storage'):
+            blob = bucket.blob(f'source_photos/{user_key}.jpg')
+            blob.upload_from_string(response.content, content_type='image/jpeg')
+            face_index.add(user_key, embedding)
 
         # Create a new user in Firestore
-        user_ref = db.collection('users').add({
-            'userName': user_name,
-            'photoURL': blob.public_url
-        })
+        with metrics.span('firestore'):
+            user_ref = db.collection('users').add({
+                'userName': user_name,
+                'photoURL': blob.public_url
+            })
+        metrics.inc('signups_total', help_text='registered users')
         user_id = user_ref[1].id
-        return jsonify({"message": f"Welcome {user_name.split(";")[0]}, your photo has been saved. Please go to log in.", "userId": user_id})
+        return jsonify({"message": f"Welcome {user_name.split(';')[0]}, your photo has been saved. Please go to log in.", "userId": user_id})
 
     elif user_type == 'login':
         try:
-            # Create a directory to store all downloaded source photos
-            source_photos_temp_directory = os.path.join(temp_directory, 'source_photos')
-            os.makedirs(source_photos_temp_directory, exist_ok=True)
-
-            # List all photos in source_photos from Firebase Storage
-            bucket = storage.bucket()
-            blobs = list(bucket.list_blobs(prefix='source_photos/'))
-
-            # Download all photos to the temp directory for face recognition
-            for blob in blobs:
-                file_name = os.path.basename(blob.name)
-                local_path = os.path.join(source_photos_temp_directory, file_name)
-                blob.download_to_filename(local_path)
-
-            matched_photo = find_identity(photo_path, source_photos_temp_directory)
-            print(f"matched_photo: {matched_photo}")
-            if matched_photo is not None and not matched_photo.empty:
-                matched_photo_path = matched_photo.iloc[0]['identity']
-                user_name = extract_username_from_path(matched_photo_path)
-                emotion = analyze_emotion(photo_path)
+            with metrics.span('inference'):
+                matched_user, emotion = inference_pool.run(metrics.propagate(identify_and_analyze), image)
+            print(f"matched_user: {matched_user}")
+            metrics.inc('logins_total', help_text='logins by outcome', outcome='matched' if matched_user else 'no_match')
+            if matched_user is not None:
+                user_name = extract_username_from_path(matched_user)
 
                 # Retrieve the user ID from Firebase Firestore
-                users_collection = db.collection('users')
-                docs = users_collection.where('userName', '==', user_name).stream()
-                user_doc = next(docs, None)
+                with metrics.span('firestore'):
+                    users_collection = db.collection('users')
+                    docs = users_collection.where('userName', '==', user_name).stream()
+                    user_doc = next(docs, None)
                 if not user_doc:
                     return jsonify({"message": "User not found."}), 404
 
@@ -127,44 +210,61 @@ def upload_photo():
                 })
             else:
                 return jsonify({"message": "No matching user found. Please ensure your photo is clear or sign up if you haven't yet."})
+        except PoolBusy as e:
+            return busy_response(e)
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
-def find_identity(photo_path, database_directory):
+def busy_response(e):
     """
-    Function to find identity using facial recognition.
+    Function to reject a request while the inference queue is full, asking the client to retry.
     """
-    try:
-        faces = DeepFace.extract_faces(img_path=photo_path, detector_backend='opencv')
-        if len(faces) == 0:
-            print("No face detected in the uploaded photo.")
-            return None
+    response = jsonify({"error": f"The service is busy, please try again. ({e})"})
+    response.headers['Retry-After'] = '1'
+    return response, 503
 
-        face = faces[0]['face']
-        if face is None or face.size == 0:
-            print("Extracted face is empty or invalid.")
-            return None
-    
-        # convert face to a format suitable for saving
-        if face.dtype != 'uint8':
-            face = (face * 255).astype('uint8')
+def signup_embedding(image):
+    """
+    Function to compute the face embedding of a signup photo, run on the inference pool.
+    """
+    face = detect_face(image, enforce_detection=False)
+    return compute_face_embedding(face) if face is not None else None
 
-        # save the extracted face to a temporary file
-        temp_face_path = os.path.join(temp_directory, 'temp_face.jpg')
-        cv2.imwrite(temp_face_path, face)
+def identify_and_analyze(image):
+    """
+    Function to identify the user in a login photo and analyze their emotion, run on the inference pool.
+    Detects once and feeds the same face to the identity and emotion models.
+    Returns (matched user key or None, emotion or None).
+    """
+    face = detect_face(image)
+    if face is None:
+        return None, None
+    matched_user = find_identity(face)
+    if matched_user is None:
+        return None, None
+    return matched_user, analyze_emotion(face)
 
-        # Use DeepFace to compare with the downloaded database photos in the directory
-        df = DeepFace.find(img_path=temp_face_path, db_path=database_directory, model_name='VGG-Face', enforce_detection=False)
-        
-        if isinstance(df, list) and len(df) > 0 and not df[0].empty:
-            return df[0]
-        else:
-            return None
-        
-    except Exception as e:
-        print(f"Error during facial recognition: {e}")
+def find_identity(face):
+    """
+    Function to find identity using facial recognition against the face index.
+    Returns the key of the matched user, or None.
+    """
+    embedding = compute_face_embedding(face)
+    if embedding is None:
+        return None
+
+    with metrics.span('search'):
+        match = face_index.search(embedding)
+        if match is None and face_index.sync():
+            # users who signed up or re-registered through another worker since the last sync
+            match = face_index.search(embedding)
+    if match is None:
         return None
 
+    user_key, distance = match
+    print(f"Matched {user_key} at cosine distance {distance:.4f}")
+    return user_key
+
 def extract_username_from_path(path):
     """
     Function to extract username from the photo's filename.
@@ -173,12 +273,13 @@ def extract_username_from_path(path):
     username = os.path.splitext(filename)[0].replace("_", " ")  # replace underscores with spaces
     return username
 
-def analyze_emotion(photo_path):
+def analyze_emotion(face):
     """
-    Function to analyze emotion in the photo.
+    Function to analyze emotion in a detected face.
     """
     try:
-        predictions = DeepFace.analyze(img_path=photo_path, actions=['emotion'])
+        with metrics.span('emotion'):
+            predictions = DeepFace.analyze(img_path=face, actions=['emotion'], detector_backend='skip', enforce_detection=False)
 
         # For debug
         print(f"FOR DEBUG: Full emotion analysis result: {predictions}")
@@ -195,6 +296,32 @@ def analyze_emotion(photo_path):
         print(f"Error during emotion analysis: {e}")
         return "unknown"
 
+# Face embeddings of every registered user, stored once at signup and searched in memory at login
+# FACE_SYNC_INTERVAL limits how often a failed login lists the bucket for signups of other workers
+face_index = FaceIndex(bucket, threshold=float(os.getenv('FACE_MATCH_THRESHOLD', 0.68)),
+                       sync_interval=float(os.getenv('FACE_SYNC_INTERVAL', 5)))
+face_index.sync(force=True)
+warm_up_models()
+backfill_face_index()
+
+# Bounded pool for the face inference: FACE_WORKERS run at once, FACE_QUEUE_SIZE more may wait
+# up to FACE_QUEUE_TIMEOUT seconds, and further requests get a 503 with Retry-After
+face_workers = int(os.getenv('FACE_WORKERS', os.cpu_count() or 1))
+inference_pool = InferencePool(max_workers=face_workers,
+                               max_pending=int(os.getenv('FACE_QUEUE_SIZE', 4 * face_workers)),
+                               queue_timeout=float(os.getenv('FACE_QUEUE_TIMEOUT', 5)))
+
+def inference_metrics():
+    stats = inference_pool.stats()
+    return [('inference_in_flight', 'gauge', 'inference jobs running or queued', stats['in_flight']),
+            ('inference_rejected_total', 'counter', 'requests rejected while the inference queue was full', stats['rejected']),
+            ('index_users', 'gauge', 'users in the face index', len(face_index))]
+metrics.add_collector(inference_metrics)
+
+@app.route('/inference_stats', methods=['GET'])
+def inference_stats():
+    return jsonify(inference_pool.stats())
+
 # Run the Flask application
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001)
+    app.run(host='0.0.0.0', port=5001, threaded=True)
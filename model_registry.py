@@ -0,0 +1,232 @@
+import threading
+import time
+import traceback
+from datetime import datetime
+
+import numpy as np
+
+from cf_scoring import recommend_users
+from expiration_index import ExpirationIndex
+from neighbor_index import NeighborIndex, RadiusGraph
+from product_catalog import ProductCatalog
+from purchase_history import PurchaseHistory
+
+
+class ServingModels:
+    """
+    One model version as served: the loaded artifacts plus every index built over them.
+    Instances are never modified after validation, so a request that took a reference
+    keeps a consistent view while a newer version is swapped in.
+    """
+
+    def __init__(self, artifacts, moods, topn_table=None):
+        """
+        Args:
+            artifacts: the Artifacts to serve
+            moods: the mood categories that get a neighbor index
+            topn_table: the TopNTable precomputed for this version, if any
+        """
+        self.version = artifacts.version
+        #user and item factors of the collaborative model
+        self.user_factors = artifacts.user_factors
+        self.item_factors = artifacts.item_factors
+        #user x product purchase counts the collaborative model was trained on
+        self.user_product_matrix = artifacts.user_product_matrix
+        #product and user embeddings from the content-based model
+        self.product_embeddings = artifacts.product_embeddings
+        self.user_embeddings = artifacts.user_embeddings
+        self.products_df = artifacts.products_df
+        self.products_mood_df = artifacts.products_mood_df
+        self.products_expiration_df = artifacts.products_expiration_df
+        #per-aisle top products for the cold-start recommendations of new users
+        self.aisle_popularity = artifacts.aisle_popularity
+        #precomputed top N items of the users known at precompute time
+        self.topn_table = topn_table
+
+        #neighbors of every product within the similarity threshold, shared by every candidate pool;
+        #memory-mapped from the bundle, built here only for the legacy pickles
+        self.neighbor_graph = artifacts.neighbor_graph
+        if self.neighbor_graph is None:
+            self.neighbor_graph = RadiusGraph(self.product_embeddings)
+        #one neighbor index per mood category
+        self.mood_products = {}
+        self.mood_neighbor_indexes = {}
+        for mood in moods:
+            self.mood_products[mood] = self.products_mood_df[self.products_mood_df["mood"] == mood].reset_index(drop=True)
+            self.mood_neighbor_indexes[mood] = NeighborIndex(self.mood_products[mood]["product_id"].values,
+                                                             self.product_embeddings, self.neighbor_graph)
+        #per-user purchase history for the actual purchased products
+        self.purchase_history = PurchaseHistory(self.user_product_matrix)
+        #close-to-expiration pools, each with its neighbor index, cached per date and window
+        self.expiration_index = ExpirationIndex(
+            self.products_expiration_df,
+            lambda pool_df: NeighborIndex(pool_df["product_id"].values, self.product_embeddings, self.neighbor_graph))
+        #catalog arrays keyed by product id with the pre-encoded JSON of every product; its rows follow
+        #products_df, so sorted rows keep the catalog order of a result
+        self.catalog = ProductCatalog(self.products_df)
+
+    def validate(self):
+        """
+        Check shapes and id ranges and run a smoke query; raises ValueError on the first problem.
+        """
+        n_users, n_items = self.user_product_matrix.shape
+        if self.user_factors.shape[0] != n_users:
+            raise ValueError(f"{self.user_factors.shape[0]} user factors for {n_users} users in user_product_matrix")
+        if self.item_factors.shape[0] != n_items:
+            raise ValueError(f"{self.item_factors.shape[0]} item factors for {n_items} products in user_product_matrix")
+        if self.user_factors.shape[1] != self.item_factors.shape[1]:
+            raise ValueError("user and item factors have different dimensions")
+        if len(self.user_product_matrix.indptr) != n_users + 1 or np.any(np.diff(self.user_product_matrix.indptr) < 0):
+            raise ValueError("user_product_matrix has an invalid indptr")
+        if len(self.user_product_matrix.indices) and self.user_product_matrix.indices.max() >= n_items:
+            raise ValueError("user_product_matrix has product ids out of range")
+        if len(self.products_df) == 0:
+            raise ValueError("the product catalog is empty")
+        n_embeddings = self.product_embeddings.shape[0]
+        if self.products_df["product_id"].min() < 0 or self.products_df["product_id"].max() >= n_embeddings:
+            raise ValueError(f"catalog product ids out of range of {n_embeddings} product embeddings")
+        if n_items > n_embeddings:
+            raise ValueError(f"{n_items} products in user_product_matrix but only {n_embeddings} product embeddings")
+        if len(self.neighbor_graph) != n_embeddings:
+            raise ValueError(f"radius graph of {len(self.neighbor_graph)} products for {n_embeddings} product embeddings")
+        popular_ids = self.aisle_popularity.product_ids
+        if len(popular_ids) and (popular_ids.min() < 0 or popular_ids.max() >= n_embeddings):
+            raise ValueError("aisle popularity table has product ids out of range")
+
+        if self.topn_table is not None:
+            self.validate_topn_table(n_users, n_items)
+
+        #smoke query through every stage
+        recommended_ids, scores = recommend_users(self.user_factors, self.item_factors, self.user_product_matrix,
+                                                  [0], N=10)
+        if not np.all(np.isfinite(scores[recommended_ids >= 0])):
+            raise ValueError("the smoke query returned non-finite scores")
+        recommended_ids = recommended_ids[recommended_ids >= 0]
+        for neighbor_index in self.mood_neighbor_indexes.values():
+            neighbor_index.nearest(recommended_ids)
+        pool_df, neighbor_index = self.expiration_index.close_to_expiration()
+        neighbor_index.nearest(recommended_ids)
+        self.purchase_history.products(0, limit=10)
+
+    def validate_topn_table(self, n_users, n_items, block_size=65536):
+        """
+        Check the version, shapes and dtypes of the top N table and that every listed product is a
+        catalog product of the collaborative model. The memory-mapped rows are read block_size
+        users at a time, so a large table is never copied whole.
+        """
+        table = self.topn_table
+        if table.version != self.version:
+            raise ValueError(f"top N table of version {table.version} for models of version {self.version}")
+        if table.item_ids.ndim != 2 or table.scores.shape != table.item_ids.shape:
+            raise ValueError(f"top N item ids of shape {table.item_ids.shape} with scores of shape {table.scores.shape}")
+        if not np.issubdtype(table.item_ids.dtype, np.integer) or not np.issubdtype(table.scores.dtype, np.floating):
+            raise ValueError(f"top N table of {table.item_ids.dtype} item ids and {table.scores.dtype} scores")
+        if table.n_users > n_users:
+            raise ValueError(f"top N table has {table.n_users} users but user_product_matrix has {n_users}")
+        in_catalog = np.zeros(n_items, dtype=bool)
+        catalog_ids = self.catalog.product_ids
+        in_catalog[catalog_ids[catalog_ids < n_items]] = True
+        for start in range(0, table.n_users, block_size):
+            item_ids = np.asarray(table.item_ids[start:start + block_size])
+            #rows are padded with -1
+            if item_ids.size and (item_ids.min() < -1 or item_ids.max() >= n_items):
+                raise ValueError("top N table has product ids out of range")
+            if not in_catalog[item_ids[item_ids >= 0]].all():
+                raise ValueError("top N table lists products that are not in the catalog")
+
+
+class ModelRegistry:
+    """
+    Holds the active ServingModels and swaps in new versions without restarting the process.
+    A new version is loaded and validated on a background thread and then swapped in with a
+    single reference assignment; requests that already took the old version finish on it.
+    """
+
+    def __init__(self, build, keep=3):
+        """
+        Args:
+            build: function building a ServingModels for a version (None for the current one)
+            keep: the number of recently active versions listed by status()
+        """
+        self.build = build
+        self.keep = keep
+        self.current = None
+        self.loading = None
+        self.last_error = None
+        self.history = []
+        self.swap_listeners = []
+        self._lock = threading.Lock()
+
+    def load(self, version=None):
+        """
+        Build, validate and activate a version synchronously.
+        """
+        models = self.build(version)
+        models.validate()
+        with self._lock:
+            self.current = models
+            self.history = ([{"version": models.version, "activated": datetime.now().isoformat(timespec='seconds')}]
+                            + self.history)[:self.keep]
+        for listener in self.swap_listeners:
+            listener(models)
+        return models
+
+    def _start_loading(self, version):
+        """
+        Mark a load as running; False if one already is, so /models/reload and the watcher never
+        build two versions at once.
+        """
+        with self._lock:
+            if self.loading is not None:
+                return False
+            self.loading = version or "current"
+            return True
+
+    def reload_async(self, version=None):
+        """
+        Load a version on a background thread. Returns False if a load is already running.
+        """
+        if not self._start_loading(version):
+            return False
+        threading.Thread(target=self._reload, args=(version,), daemon=True).start()
+        return True
+
+    def _reload(self, version):
+        """
+        Load a version marked by _start_loading and record its error; returns whether it was swapped in.
+        """
+        try:
+            self.load(version)
+            self.last_error = None
+            return True
+        except Exception as e:
+            traceback.print_exc()
+            self.last_error = {"version": version, "error": str(e)}
+            return False
+        finally:
+            with self._lock:
+                self.loading = None
+
+    def watch(self, probe, interval=30):
+        """
+        Poll probe() for the version that should be active and reload when it changes, so every
+        worker process picks up a new bundle on its own. A version that failed validation is not
+        retried until probe() reports a different one; while /models/reload is loading a version the
+        poll is skipped.
+        """
+        def poll():
+            failed = None
+            while True:
+                time.sleep(interval)
+                version = probe()
+                if version is None or version in (self.current.version, failed):
+                    continue
+                if self._start_loading(version) and not self._reload(version):
+                    failed = version
+        threading.Thread(target=poll, daemon=True).start()
+
+    def status(self):
+        return {"active": self.current.version if self.current is not None else None,
+                "loading": self.loading,
+                "last_error": self.last_error,
+                "history": self.history}
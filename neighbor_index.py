@@ -0,0 +1,183 @@
+import numpy as np
+
+
+def _ranges(starts, lengths):
+    """
+    Return the concatenation of range(start, start + length) for every pair, vectorized.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    total = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(np.asarray(starts, dtype=np.int64) - offsets, lengths) + np.arange(total)
+
+
+class RadiusGraph:
+    """
+    The neighbors of every product within a fixed squared distance of its embedding, built once per
+    set of product embeddings and stored as a CSR graph: row p holds the product ids q with
+    0 < squared distance(p, q) <= threshold, sorted by product id, and their squared distances.
+
+    Products are swept in the order of their projection on the principal axis of the embeddings:
+    two products within the threshold are within its square root of each other on any unit axis,
+    so every block of products is only compared with the slice of products whose projections are
+    that close. The squared distances of those pairs are first estimated with ||q||^2 + ||p||^2 - 2 q.p
+    in float64, then recomputed exactly for the surviving pairs the same way the per-item scan of /predict
+    did, so the threshold rule gives identical results. Every candidate pool then only maps these
+    neighbors to its own positions, and a query is a gather instead of a distance computation.
+    """
+
+    def __init__(self, embeddings, threshold=0.0001, block_size=256):
+        """
+        Args:
+            embeddings: the product embeddings indexed by product id
+            threshold: the threshold of similarity; 0.0001 by default
+            block_size: the number of products scored per matrix multiply while building
+        """
+        self.threshold = threshold
+        vectors = np.asarray(embeddings)
+        vectors64 = vectors.astype(np.float64)
+        norms = np.einsum("ij,ij->i", vectors64, vectors64)
+        #slack for the rounding error of the expanded form; the exact pass removes false positives
+        slack = 1e-9 * (1.0 + 2 * norms.max()) if len(norms) else 0.0
+
+        if len(vectors) > 1:
+            axis = np.linalg.svd(vectors64 - vectors64.mean(axis=0), full_matrices=False)[2][0]
+        else:
+            axis = np.zeros(vectors.shape[1])
+        projections = vectors64 @ axis
+        order = np.argsort(projections, kind="stable")
+        sorted_projections = projections[order]
+        radius = np.sqrt(threshold) * (1 + 1e-6) + 1e-9
+
+        rows_list, cols_list, distances_list = [], [], []
+        for start in range(0, len(vectors), block_size):
+            block = order[start:start + block_size]
+            low = np.searchsorted(sorted_projections, sorted_projections[start] - radius, side="left")
+            high = np.searchsorted(sorted_projections, sorted_projections[start + len(block) - 1] + radius, side="right")
+            candidates = order[low:high]
+            approx = norms[block, None] + norms[None, candidates] - 2.0 * (vectors64[block] @ vectors64[candidates].T)
+            rows, cols = np.nonzero(approx <= threshold + slack)
+            rows, cols = block[rows], candidates[cols]
+            squared_distances = np.sum((vectors[cols] - vectors[rows])**2, axis=1)
+            keep = (squared_distances > 0) & (squared_distances <= threshold)
+            rows_list.append(rows[keep])
+            cols_list.append(cols[keep])
+            distances_list.append(squared_distances[keep])
+        rows = np.concatenate(rows_list) if rows_list else np.empty(0, dtype=np.int64)
+        cols = np.concatenate(cols_list) if cols_list else np.empty(0, dtype=np.int64)
+        distances = np.concatenate(distances_list) if distances_list else np.empty(0, dtype=vectors.dtype)
+        edges = np.lexsort((cols, rows))
+        self.indices = cols[edges].astype(np.int64)
+        self.distances = distances[edges]
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=len(vectors)))]).astype(np.int64)
+
+    @classmethod
+    def from_csr(cls, indptr, indices, distances, threshold=0.0001):
+        """
+        Return the graph of already built CSR arrays, e.g. memory-mapped from an artifact bundle.
+        """
+        graph = cls.__new__(cls)
+        graph.threshold = threshold
+        graph.indptr = indptr
+        graph.indices = indices
+        graph.distances = distances
+        return graph
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def neighbors(self, product_ids):
+        """
+        Return the neighbors of every product id as (query positions, neighbor product ids, squared distances).
+        """
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        starts = self.indptr[product_ids]
+        lengths = self.indptr[product_ids + 1] - starts
+        edges = _ranges(starts, lengths)
+        return np.repeat(np.arange(len(product_ids)), lengths), self.indices[edges], self.distances[edges]
+
+
+class NeighborIndex:
+    """
+    Nearest-neighbor index over the product embeddings of one candidate pool
+    (e.g. the products of a mood category or the close-to-expiration products).
+
+    The neighbors of every product within the threshold come precomputed from a RadiusGraph shared by
+    all pools; the index only maps product ids to their positions in the pool, so it is cheap to build
+    and a radius/top-k query for a whole list of recommended items is a gather over the graph.
+    """
+
+    def __init__(self, product_ids, embeddings, graph=None):
+        """
+        Args:
+            product_ids: the product ids of the candidate pool, in pool order
+            embeddings: the product embeddings indexed by product id
+            graph: the RadiusGraph of embeddings; built here if None, which scans every product pair
+        """
+        self.embeddings = embeddings
+        self.graph = graph if graph is not None else RadiusGraph(embeddings)
+        self.product_ids = np.asarray(product_ids, dtype=np.int64)
+        #pool positions of every product id, grouped by product id: a product may appear more than once
+        self._pool_order = np.argsort(self.product_ids, kind="stable")
+        counts = np.bincount(self.product_ids, minlength=len(self.graph))
+        self._pool_indptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def radius_query(self, query_ids, threshold=0.0001):
+        """
+        Return every (query, candidate) pair with 0 < squared distance <= threshold.
+        Args:
+            query_ids: the product ids of the recommended items
+            threshold: the threshold of similarity, at most the threshold of the graph; 0.0001 by default
+        Returns:
+            (query positions, pool positions, squared distances), ordered by query
+            and then by pool position
+        """
+        if threshold > self.graph.threshold:
+            raise ValueError(f"threshold {threshold} is above the {self.graph.threshold} of the radius graph")
+        rows, neighbor_ids, squared_distances = self.graph.neighbors(query_ids)
+        if threshold < self.graph.threshold:
+            keep = squared_distances <= threshold
+            rows, neighbor_ids, squared_distances = rows[keep], neighbor_ids[keep], squared_distances[keep]
+        starts = self._pool_indptr[neighbor_ids]
+        lengths = self._pool_indptr[neighbor_ids + 1] - starts
+        cols = self._pool_order[_ranges(starts, lengths)]
+        rows = np.repeat(rows, lengths)
+        squared_distances = np.repeat(squared_distances, lengths)
+        order = np.lexsort((cols, rows))
+        return rows[order], cols[order], squared_distances[order]
+
+    def nearest(self, query_ids, N=3, threshold=0.0001):
+        """
+        Return the N closest pool entries within the threshold over all query items.
+        A pool product close to several query items appears once per query item,
+        the same as concatenating the per-item scan results of each item.
+        Returns:
+            (pool positions, squared distances), sorted by distance
+        """
+        rows, cols, squared_distances = self.radius_query(query_ids, threshold)
+        order = np.argsort(squared_distances, kind="stable")[:N]
+        return cols[order], squared_distances[order]
+
+    def nearest_groups(self, query_ids, groups, n_groups, N=3, threshold=0.0001):
+        """
+        Batched nearest for many recommendation lists at once, e.g. one list per user.
+        Args:
+            query_ids: the product ids of the recommended items of all lists, concatenated
+            groups: the list number (0 <= group < n_groups) of every query id
+            n_groups: the number of lists
+        Returns:
+            a list of n_groups (pool positions, squared distances), each sorted by distance
+        """
+        groups = np.asarray(groups, dtype=np.int64)
+        rows, cols, squared_distances = self.radius_query(query_ids, threshold)
+        row_groups = groups[rows]
+        order = np.lexsort((squared_distances, row_groups))
+        row_groups, cols, squared_distances = row_groups[order], cols[order], squared_distances[order]
+        bounds = np.searchsorted(row_groups, np.arange(n_groups + 1))
+        return [(cols[bounds[g]:bounds[g + 1]][:N], squared_distances[bounds[g]:bounds[g + 1]][:N])
+                for g in range(n_groups)]
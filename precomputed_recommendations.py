@@ -0,0 +1,139 @@
+import json
+import os
+import shutil
+import sys
+from datetime import datetime
+
+import numpy as np
+
+from artifact_bundle import load_artifacts
+from cf_scoring import recommend_users
+from worker_pool import fork_map, shared
+
+
+class TopNTable:
+    """
+    Fixed-width table of the precomputed top N items of every known user and their scores,
+    one row per user id. Rows are padded with id -1 and score -inf.
+    """
+
+    def __init__(self, version, item_ids, scores):
+        """
+        Args:
+            version: the model version the table was computed from
+            item_ids: int32 array of shape (number of users, N)
+            scores: float32 array of shape (number of users, N)
+        """
+        self.version = version
+        self.item_ids = item_ids
+        self.scores = scores
+
+    @property
+    def n_users(self):
+        return self.item_ids.shape[0]
+
+    @property
+    def N(self):
+        return self.item_ids.shape[1]
+
+    def covers(self, user_ids, N):
+        """
+        Whether the table holds the top N items of each user; a bool array for an array of user ids.
+        """
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        return (user_ids >= 0) & (user_ids < self.n_users) & (1 <= N <= self.N)
+
+    def recommend(self, user_ids, N):
+        """
+        Return (item ids, scores) of shape (len(user_ids), N), like cf_scoring.recommend_users.
+        """
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        return self.item_ids[user_ids, :N].astype(np.int64), np.asarray(self.scores[user_ids, :N])
+
+    @staticmethod
+    def open(path):
+        """
+        Open a table written by precompute with both arrays memory-mapped read-only.
+        """
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        return TopNTable(manifest['version'], np.load(os.path.join(path, 'item_ids.npy'), mmap_mode='r'),
+                         np.load(os.path.join(path, 'scores.npy'), mmap_mode='r'))
+
+
+def table_path(tables_dir, version):
+    return os.path.join(tables_dir, version)
+
+
+def open_table(tables_dir, version):
+    """
+    Open the table precomputed for a model version, or return None if there is none.
+    """
+    path = table_path(tables_dir, version)
+    if not os.path.exists(os.path.join(path, 'manifest.json')):
+        return None
+    return TopNTable.open(path)
+
+
+def _score_arrays(user_factors, item_factors, user_items, item_ids_path, scores_path):
+    #every worker maps the output itself
+    return {'user_factors': user_factors, 'item_factors': item_factors, 'user_items': user_items,
+            'item_ids': np.load(item_ids_path, mmap_mode='r+'), 'scores': np.load(scores_path, mmap_mode='r+')}
+
+
+def _score_range(start, stop):
+    item_ids, scores = recommend_users(shared['user_factors'], shared['item_factors'], shared['user_items'],
+                                       np.arange(start, stop), N=shared['item_ids'].shape[1])
+    shared['item_ids'][start:stop] = item_ids
+    shared['scores'][start:stop] = scores
+    return stop - start
+
+
+def precompute(user_factors, item_factors, user_items, tables_dir, version, N=100, chunk_size=8192, processes=None):
+    """
+    Score every user against the item factors and write their top N items as a TopNTable.
+    Users are split into chunks scored by a pool of processes; each process writes its rows straight
+    into the memory-mapped output, so results are never sent back through the pool.
+    Args:
+        user_factors: the user factors of the ALS model
+        item_factors: the item factors of the ALS model
+        user_items: the CSR user-product matrix whose items are filtered out
+        tables_dir: the directory of the tables, one subdirectory per model version
+        version: the model version of the factors
+        N: the number of items per user
+        chunk_size: the number of users per task
+        processes: the number of processes; None for one per core
+    Returns:
+        the path of the table
+    """
+    n_users = user_factors.shape[0]
+    N = min(N, item_factors.shape[0])
+    path = table_path(tables_dir, version)
+    temp_path = path + '.tmp'
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+    item_ids_path = os.path.join(temp_path, 'item_ids.npy')
+    scores_path = os.path.join(temp_path, 'scores.npy')
+    np.lib.format.open_memmap(item_ids_path, mode='w+', dtype=np.int32, shape=(n_users, N)).flush()
+    np.lib.format.open_memmap(scores_path, mode='w+', dtype=np.float32, shape=(n_users, N)).flush()
+
+    chunks = [(start, min(start + chunk_size, n_users)) for start in range(0, n_users, chunk_size)]
+    init_args = (user_factors, item_factors, user_items, item_ids_path, scores_path)
+    processes = processes or os.cpu_count() or 1
+    scored = sum(fork_map(_score_range, chunks, _score_arrays, init_args, processes if len(chunks) > 1 else 1))
+
+    with open(os.path.join(temp_path, 'manifest.json'), 'w') as f:
+        json.dump({'version': version, 'created': datetime.now().isoformat(timespec='seconds'),
+                   'n_users': int(scored), 'N': int(N)}, f, indent=2)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(temp_path, path)
+    return path
+
+
+if __name__ == '__main__':
+    #offline precompute of the current model version, run from the repository root after building it
+    artifacts = load_artifacts('trained_model', 'capstone-dataset')
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    path = precompute(artifacts.user_factors, artifacts.item_factors, artifacts.user_product_matrix,
+                      os.path.join('trained_model', 'topn'), artifacts.version, N=N)
+    print(f"Top {N} recommendations of {artifacts.user_factors.shape[0]} users have been saved to '{path}'.")
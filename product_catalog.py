@@ -0,0 +1,93 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+
+def encode_json(value):
+    """
+    Encode a value the way jsonify does outside debug mode: sorted keys, compact separators, ASCII only.
+    """
+    return json.dumps(value, ensure_ascii=True, sort_keys=True, separators=(',', ':')).encode('ascii')
+
+
+def json_object(fields):
+    """
+    Join pre-encoded values into a JSON object with sorted keys.
+    Args:
+        fields: dict of key to the encoded JSON bytes of its value
+    """
+    return b'{' + b','.join(encode_json(key) + b':' + fields[key] for key in sorted(fields)) + b'}'
+
+
+class ProductCatalog:
+    """
+    The product catalog as contiguous arrays in products_df row order, keyed by product id through
+    a position array, with aisle and department as categorical codes. The JSON of every product
+    record is encoded once at load time in three fragments around the per-request image_url:
+        {"aisle":...,["days_until_expiration":...,]"department":...,"image_url":<url>,"product_id":...,"product_name":...}
+    so a response is a gather of fragments and a byte join instead of DataFrame slices and to_dict.
+    The keys are in the sorted order jsonify writes.
+    """
+
+    def __init__(self, products_df):
+        """
+        Args:
+            products_df: the products with product_id, product_name, aisle and department
+        """
+        self.product_ids = products_df["product_id"].values.astype(np.int64)
+        self.product_names = products_df["product_name"].values.astype(object)
+        #catalog row of every product id, -1 for ids that are not in the catalog
+        self.positions = np.full(int(self.product_ids.max()) + 1 if len(self.product_ids) else 0, -1, dtype=np.int64)
+        self.positions[self.product_ids] = np.arange(len(self.product_ids))
+
+        aisles = pd.Categorical(products_df["aisle"])
+        departments = pd.Categorical(products_df["department"])
+        self.aisle_codes = aisles.codes.astype(np.int16)
+        self.department_codes = departments.codes.astype(np.int16)
+        self.aisle_names = np.asarray(aisles.categories, dtype=object)
+        self.department_names = np.asarray(departments.categories, dtype=object)
+
+        #pre-encoded JSON fragments: per aisle, per department and per product
+        self.aisle_fragments = np.array([b'{"aisle":' + encode_json(name) + b',' for name in self.aisle_names],
+                                        dtype=object)
+        self.department_fragments = np.array([b'"department":' + encode_json(name) + b',"image_url":'
+                                              for name in self.department_names], dtype=object)
+        self.product_fragments = np.array([b',"product_id":' + encode_json(int(product_id)) +
+                                           b',"product_name":' + encode_json(name) + b'}'
+                                           for product_id, name in zip(self.product_ids, self.product_names)],
+                                          dtype=object)
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def positions_of(self, product_ids):
+        """
+        Return the catalog rows of the product ids that are in the catalog, in the given order.
+        """
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        product_ids = product_ids[(product_ids >= 0) & (product_ids < len(self.positions))]
+        positions = self.positions[product_ids]
+        return positions[positions >= 0]
+
+    def records_json(self, positions, image_urls, days_until_expiration=None):
+        """
+        Return the JSON array of the records of the given catalog rows, assembled from the fragments.
+        Args:
+            positions: the catalog rows, in response order
+            image_urls: the image URL of every row
+            days_until_expiration: the days left of every row, for close-to-expiration records
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        aisle_fragments = self.aisle_fragments[self.aisle_codes[positions]]
+        department_fragments = self.department_fragments[self.department_codes[positions]]
+        product_fragments = self.product_fragments[positions]
+        if days_until_expiration is None:
+            records = [aisle + department + encode_json(image_url) + product for aisle, department, image_url, product
+                       in zip(aisle_fragments, department_fragments, image_urls, product_fragments)]
+        else:
+            records = [aisle + b'"days_until_expiration":' + encode_json(int(days)) + b',' + department +
+                       encode_json(image_url) + product for aisle, days, department, image_url, product
+                       in zip(aisle_fragments, days_until_expiration, department_fragments, image_urls,
+                              product_fragments)]
+        return b'[' + b','.join(records) + b']'
@@ -0,0 +1,261 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_IMAGE_URL = "https://josiesorganics.com/wp-content/uploads/2022/01/Josies-Organics-Baby-Spinach-16oz-Front.png"
+SEARCH_API_URL = "https://www.googleapis.com/customsearch/v1"
+
+
+class ImageCache:
+    """
+    Persistent product_id -> image URL cache. The table is small enough to keep in memory;
+    SQLite only makes it survive restarts and lets the offline warm-up job fill it.
+    An empty URL records that the search found no image.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if path is not None:
+            with self._connection() as connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS images "
+                                   "(product_id INTEGER PRIMARY KEY, url TEXT, fetched REAL)")
+                for product_id, url, fetched in connection.execute("SELECT product_id, url, fetched FROM images"):
+                    self._entries[product_id] = (url, fetched)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, product_id):
+        return self._entries.get(product_id)
+
+    def set(self, product_id, url, fetched=None):
+        fetched = fetched or time.time()
+        with self._lock:
+            self._entries[product_id] = (url, fetched)
+        if self.path is not None:
+            with self._connection() as connection:
+                connection.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?)", (product_id, url, fetched))
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ProductImageResolver:
+    """
+    Resolves product images through the image search API with a pooled session and a thread pool.
+    Cached URLs are returned right away; missing ones are fetched concurrently and waited for
+    until the request deadline, after which the default image is used and the fetch finishes in
+    the background to fill the cache. Entries older than max_age are refreshed lazily. A failed
+    search (timeout, 429, 5xx, ...) is not retried before retry_after seconds, or the Retry-After
+    the API sent, and the product gets the default image in the meantime; only the max_failures
+    most recent failures are remembered.
+    """
+
+    def __init__(self, api_key=None, search_engine_id=None, search_url=SEARCH_API_URL, cache=None,
+                 default_url=DEFAULT_IMAGE_URL, max_workers=8, max_age=7 * 24 * 3600, timeout=2.0,
+                 retry_after=60, max_failures=10000):
+        """
+        Args:
+            api_key: the search API key; without it every product gets the default image
+            search_engine_id: the search engine id
+            search_url: the search endpoint, e.g. a local stub server in tests
+            cache: the ImageCache to use
+            default_url: the image of products without a resolved image
+            max_workers: the number of concurrent searches
+            max_age: the age in seconds after which a cached URL is refreshed
+            timeout: the timeout in seconds of a single search
+            retry_after: the seconds before a failed search is retried
+            max_failures: the number of failed products remembered, the least recently failed are forgotten first
+        """
+        self.api_key = api_key
+        self.search_engine_id = search_engine_id
+        self.search_url = search_url
+        self.cache = cache if cache is not None else ImageCache()
+        self.default_url = default_url
+        self.max_age = max_age
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.max_failures = max_failures
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="product-image")
+        self._pending = {}
+        #product_id -> time.monotonic() before which a failed search is not retried, oldest failure first
+        self._failures = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.api_key and self.search_engine_id)
+
+    def search(self, product_name):
+        """
+        Return the first image the search API finds for a product name, or '' if there is none.
+        """
+        response = self.session.get(self.search_url, timeout=self.timeout,
+                                    params={"q": product_name, "cx": self.search_engine_id,
+                                            "key": self.api_key, "searchType": "image", "num": 1})
+        response.raise_for_status()
+        data = response.json()
+        if 'items' in data and data['items']:
+            return data['items'][0]['link']
+        return ''
+
+    def _retry_at(self, error):
+        retry_after = self.retry_after
+        response = getattr(error, 'response', None)
+        if response is not None:
+            try:
+                retry_after = max(float(response.headers.get('Retry-After', '')), retry_after)
+            except ValueError:
+                pass
+        return time.monotonic() + retry_after
+
+    def failed_recently(self, product_id):
+        """
+        Whether the last search of a product failed less than its retry-after ago.
+        """
+        retry_at = self._failures.get(product_id)
+        if retry_at is None:
+            return False
+        if time.monotonic() < retry_at:
+            return True
+        with self._lock:
+            if self._failures.get(product_id) == retry_at:
+                del self._failures[product_id]
+        return False
+
+    def _record_failure(self, product_id, retry_at):
+        with self._lock:
+            self._failures.pop(product_id, None)
+            self._failures[product_id] = retry_at
+            while len(self._failures) > self.max_failures:
+                self._failures.popitem(last=False)
+
+    def _fetch(self, product_id, product_name):
+        try:
+            url = self.search(product_name)
+        except Exception as error:
+            self._record_failure(product_id, self._retry_at(error))
+            raise
+        else:
+            self.cache.set(product_id, url)
+            with self._lock:
+                self._failures.pop(product_id, None)
+            return url
+        finally:
+            with self._lock:
+                self._pending.pop(product_id, None)
+
+    def _submit(self, product_id, product_name):
+        with self._lock:
+            future = self._pending.get(product_id)
+            if future is None:
+                future = self.executor.submit(self._fetch, product_id, product_name)
+                self._pending[product_id] = future
+        return future
+
+    def resolve(self, product_ids, product_names, deadline=None):
+        """
+        Return the image URL of every product.
+        Args:
+            product_ids: the ids of the products
+            product_names: the names of the products, used as search queries
+            deadline: the time.monotonic() by which to stop waiting for searches; None waits for all
+        """
+        return self.resolve_status(product_ids, product_names, deadline)[0]
+
+    def resolve_status(self, product_ids, product_names, deadline=None):
+        """
+        Like resolve, and whether every product got its searched image: False when a search was still
+        running at the deadline, failed, or is waiting out its retry-after, and the default image stands in.
+        Returns:
+            (the image URLs, whether all of them are resolved)
+        """
+        product_ids = [int(product_id) for product_id in product_ids]
+        if not self.enabled:
+            return [self.default_url] * len(product_ids), True
+
+        now = time.time()
+        complete = True
+        urls = [None] * len(product_ids)
+        futures = {}
+        for i, (product_id, product_name) in enumerate(zip(product_ids, product_names)):
+            entry = self.cache.get(product_id)
+            if entry is not None:
+                url, fetched = entry
+                urls[i] = url or self.default_url
+                if now - fetched > self.max_age and not self.failed_recently(product_id):
+                    self._submit(product_id, product_name)
+            elif self.failed_recently(product_id):
+                urls[i] = self.default_url
+                complete = False
+            else:
+                futures[i] = self._submit(product_id, product_name)
+
+        if futures:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            wait(set(futures.values()), timeout=timeout)
+        for i, future in futures.items():
+            if future.done() and future.exception() is None:
+                urls[i] = future.result() or self.default_url
+            else:
+                urls[i] = self.default_url
+                complete = False
+        return urls, complete
+
+    def warm(self, product_ids, product_names, refresh=False):
+        """
+        Fill the cache for the given products, e.g. the whole catalog in an offline job.
+        Returns:
+            (the number of products searched, the number of searches that failed)
+        """
+        futures = [self._submit(int(product_id), product_name)
+                   for product_id, product_name in zip(product_ids, product_names)
+                   if refresh or self.cache.get(int(product_id)) is None]
+        wait(futures)
+        failed = sum(future.exception() is not None for future in futures)
+        return len(futures) - failed, failed
+
+
+def resolver_from_env(cache_path='trained_model/product_images.sqlite'):
+    """
+    Build the resolver configured by SEARCH_API_KEY, SEARCH_ENGINE_ID, SEARCH_API_URL,
+    PRODUCT_IMAGE_CACHE, PRODUCT_IMAGE_WORKERS and PRODUCT_IMAGE_RETRY_AFTER.
+    """
+    api_key = os.getenv('SEARCH_API_KEY')
+    #the cache file is only created once the real lookup is turned on
+    cache = ImageCache(os.getenv('PRODUCT_IMAGE_CACHE', cache_path)) if api_key else None
+    return ProductImageResolver(api_key=api_key,
+                                search_engine_id=os.getenv('SEARCH_ENGINE_ID'),
+                                search_url=os.getenv('SEARCH_API_URL', SEARCH_API_URL),
+                                cache=cache,
+                                max_workers=int(os.getenv('PRODUCT_IMAGE_WORKERS', 8)),
+                                retry_after=float(os.getenv('PRODUCT_IMAGE_RETRY_AFTER', 60)))
+
+
+if __name__ == '__main__':
+    #offline warm-up of the image cache for the whole catalog, run from the repository root
+    products_df = pd.read_csv('capstone-dataset/products.csv')
+    resolver = resolver_from_env()
+    if not resolver.enabled:
+        raise SystemExit("SEARCH_API_KEY and SEARCH_ENGINE_ID must be set to warm the image cache.")
+    searched, failed = resolver.warm(products_df["product_id"].values, products_df["product_name"].values)
+    print(f"Searched images for {searched} products, {failed} searches failed; {len(resolver.cache)} products are cached.")
@@ -0,0 +1,220 @@
+import itertools
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+from worker_pool import fork_map, shared
+
+#eval_set codes of the orders
+PRIOR, TRAIN, OTHER = 0, 1, 2
+EVAL_SETS = {'prior': PRIOR, 'train': TRAIN}
+
+
+def load_products(dataset_dir):
+    """
+    Return products.csv merged with the aisle and department names, as the notebooks do.
+    """
+    aisles_df = pd.read_csv(os.path.join(dataset_dir, 'aisles.csv'))
+    departments_df = pd.read_csv(os.path.join(dataset_dir, 'departments.csv'))
+    products_df = pd.read_csv(os.path.join(dataset_dir, 'products.csv'))
+    products_df = pd.merge(products_df, aisles_df, on="aisle_id")
+    return pd.merge(products_df, departments_df, on="department_id")
+
+
+def order_lookup(orders_path, chunksize=1000000):
+    """
+    Read orders.csv in chunks with narrow dtypes into two arrays indexed by order id:
+    the user of every order (-1 for unknown orders) and its eval_set code.
+    """
+    order_users = np.full(0, -1, dtype=np.int32)
+    order_sets = np.full(0, OTHER, dtype=np.int8)
+    for chunk in pd.read_csv(orders_path, usecols=['order_id', 'user_id', 'eval_set'], chunksize=chunksize,
+                             dtype={'order_id': np.int32, 'user_id': np.int32, 'eval_set': 'category'}):
+        order_ids = chunk['order_id'].values
+        size = int(order_ids.max()) + 1
+        if size > len(order_users):
+            order_users = np.concatenate([order_users, np.full(size - len(order_users), -1, dtype=np.int32)])
+            order_sets = np.concatenate([order_sets, np.full(size - len(order_sets), OTHER, dtype=np.int8)])
+        order_users[order_ids] = chunk['user_id'].values
+        eval_sets = chunk['eval_set'].cat
+        set_codes = np.array([EVAL_SETS.get(name, OTHER) for name in eval_sets.categories] + [OTHER], dtype=np.int8)
+        #code -1 of a missing eval_set picks the trailing OTHER
+        order_sets[order_ids] = set_codes[eval_sets.codes.values]
+    return order_users, order_sets
+
+
+def product_aisle_lookup(products_df):
+    """
+    Return the aisle id of every product id, -1 for products missing from products_df.
+    """
+    product_ids = products_df['product_id'].values
+    product_aisles = np.full(int(product_ids.max()) + 1, -1, dtype=np.int32)
+    product_aisles[product_ids] = products_df['aisle_id'].values
+    return product_aisles
+
+
+class PairCounter:
+    """
+    Accumulates user x product purchase counts as sorted (user * n_products + product) keys and counts.
+    Chunk results are buffered and merged once they outgrow the merged counts, so memory stays
+    bounded by a small multiple of the number of distinct pairs.
+    """
+
+    def __init__(self, n_products):
+        self.n_products = n_products
+        self.keys = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+        self._pending = []
+        self._pending_size = 0
+
+    def add(self, keys, counts):
+        self._pending.append((keys, counts))
+        self._pending_size += len(keys)
+        if self._pending_size > max(len(self.keys), 1 << 20):
+            self._merge()
+
+    def _merge(self):
+        if not self._pending:
+            return
+        keys = np.concatenate([self.keys] + [keys for keys, counts in self._pending])
+        counts = np.concatenate([self.counts] + [counts for keys, counts in self._pending])
+        self._pending = []
+        self._pending_size = 0
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]])) if len(keys) else np.empty(0, dtype=np.int64)
+        self.keys = keys[starts]
+        self.counts = np.add.reduceat(counts[order], starts) if len(keys) else counts
+
+    def result(self):
+        """
+        Return (user ids, product ids, purchase counts) sorted by user id and product id.
+        """
+        self._merge()
+        return self.keys // self.n_products, self.keys % self.n_products, self.counts
+
+
+def _lookups(order_users, order_sets, product_aisles, n_aisles):
+    return {'order_users': order_users, 'order_sets': order_sets, 'product_aisles': product_aisles, 'n_aisles': n_aisles}
+
+
+def _aggregate_chunk(order_ids, product_ids, eval_set, count_pairs):
+    """
+    Join one chunk of order_products on the id lookups and return (eval_set, aisle totals, pair keys, pair counts).
+    Rows of unknown orders, unknown products or orders of another eval_set are dropped, as the
+    inner merges of the notebooks drop them.
+    """
+    order_users, order_sets = shared['order_users'], shared['order_sets']
+    product_aisles = shared['product_aisles']
+    known = (order_ids < len(order_users)) & (product_ids < len(product_aisles))
+    order_ids, product_ids = order_ids[known], product_ids[known]
+    aisles = product_aisles[product_ids]
+    keep = (order_sets[order_ids] == eval_set) & (aisles >= 0)
+    aisle_totals = np.bincount(aisles[keep], minlength=shared['n_aisles'])
+    if not count_pairs:
+        return eval_set, aisle_totals, None, None
+    keys = order_users[order_ids[keep]].astype(np.int64) * len(product_aisles) + product_ids[keep]
+    keys, counts = np.unique(keys, return_counts=True)
+    return eval_set, aisle_totals, keys, counts.astype(np.int64)
+
+
+def _chunks(path, eval_set, chunksize, count_pairs):
+    for chunk in pd.read_csv(path, usecols=['order_id', 'product_id'], chunksize=chunksize,
+                             dtype={'order_id': np.int32, 'product_id': np.int32}):
+        yield chunk['order_id'].values, chunk['product_id'].values, eval_set, count_pairs
+
+
+def aggregate(dataset_dir, products_df=None, chunksize=1000000, processes=1, count_pairs=True):
+    """
+    Stream order_products__prior.csv and order_products__train.csv in chunks and aggregate the
+    aisle totals over both and the user x product purchase counts of each, joining on id arrays
+    only. Memory is bounded by the id lookups, the chunks in flight and the distinct pairs.
+    Args:
+        dataset_dir: the directory of the Instacart CSVs
+        products_df: the products to count, merged with aisles and departments; read from dataset_dir if None
+        chunksize: the number of rows read at a time
+        processes: the number of processes aggregating chunks in parallel
+        count_pairs: also count the user x product pairs; False for the aisle totals only
+    Returns:
+        (aisle totals indexed by aisle id, {'prior': (users, products, counts), 'train': (...)}),
+        with the pair counts None when count_pairs is False
+    """
+    if products_df is None:
+        products_df = load_products(dataset_dir)
+    order_users, order_sets = order_lookup(os.path.join(dataset_dir, 'orders.csv'), chunksize)
+    product_aisles = product_aisle_lookup(products_df)
+    n_aisles = int(product_aisles.max()) + 1
+    init_args = (order_users, order_sets, product_aisles, n_aisles)
+
+    aisle_totals = np.zeros(n_aisles, dtype=np.int64)
+    pair_counters = {}
+    tasks = []
+    for eval_set, filename in ((PRIOR, 'order_products__prior.csv'), (TRAIN, 'order_products__train.csv')):
+        pair_counters[eval_set] = PairCounter(len(product_aisles))
+        tasks.append(_chunks(os.path.join(dataset_dir, filename), eval_set, chunksize, count_pairs))
+
+    #the chunks are read lazily while the workers aggregate the previous ones
+    for eval_set, chunk_totals, keys, counts in fork_map(_aggregate_chunk, itertools.chain(*tasks), _lookups,
+                                                          init_args, processes):
+        aisle_totals[:len(chunk_totals)] += chunk_totals
+        if count_pairs:
+            pair_counters[eval_set].add(keys, counts)
+
+    pair_counts = {name: pair_counters[code].result() if count_pairs else None for name, code in EVAL_SETS.items()}
+    return aisle_totals, pair_counts
+
+
+def top_aisles(aisle_totals, aisles_df, n=50):
+    """
+    Return the n aisles with the most purchases like calculate_top_aisles.py always has:
+    aisle_id, aisle and total_purchases, ties kept in aisle id order.
+    """
+    aisle_ids = np.flatnonzero(aisle_totals)
+    counts_df = pd.DataFrame({'aisle_id': aisle_ids, 'total_purchases': aisle_totals[aisle_ids]})
+    counts_df = pd.merge(counts_df, aisles_df[['aisle_id', 'aisle']], on='aisle_id')
+    return counts_df[['aisle_id', 'aisle', 'total_purchases']].nlargest(n, 'total_purchases')
+
+
+def purchase_count_df(pair_counts):
+    """
+    Return the user_id, product_id, purchase_count dataframe of groupby(['user_id', 'product_id']).size().
+    """
+    users, products, counts = pair_counts
+    return pd.DataFrame({'user_id': users, 'product_id': products, 'purchase_count': counts})
+
+
+def build_user_product_matrix(pair_counts):
+    """
+    Return the CSR user x product matrix of purchase counts, equal to the notebooks'
+    coo_matrix((purchase_count, (user_id, product_id))).tocsr().
+    """
+    users, products, counts = pair_counts
+    return sparse.coo_matrix((counts, (users, products))).tocsr()
+
+
+def purchase_counts(dataset_dir, products_df=None, chunksize=1000000, processes=1):
+    """
+    Return the train_df (eval_set prior) and test_df (eval_set train) purchase counts of the notebooks.
+    """
+    aisle_totals, pair_counts = aggregate(dataset_dir, products_df, chunksize, processes)
+    return purchase_count_df(pair_counts['prior']), purchase_count_df(pair_counts['train'])
+
+
+def write_csv(df, path, rows_per_write=1000000):
+    """
+    Write a dataframe to CSV a slice at a time, so the text of every row is never held at once.
+    """
+    with open(path, 'w', newline='') as f:
+        for start in range(0, max(len(df), 1), rows_per_write):
+            df.iloc[start:start + rows_per_write].to_csv(f, index=False, header=start == 0)
+
+
+if __name__ == '__main__':
+    #offline data prep, run from the repository root: python purchase_aggregation.py [processes]
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    aisle_totals, pair_counts = aggregate('capstone-dataset', processes=processes)
+    write_csv(purchase_count_df(pair_counts['prior']), 'capstone-dataset/purchase_count_train_df.csv')
+    print("Purchase counts have been saved to 'capstone-dataset/purchase_count_train_df.csv'.")
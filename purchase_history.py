@@ -0,0 +1,49 @@
+import numpy as np
+
+
+class PurchaseHistory:
+    """
+    Per-user purchase history backed by the CSR user x product matrix.
+
+    The products a user purchased are the column indices of the user's row and the
+    counts are its values, so a lookup is a slice through indptr in O(row length)
+    instead of a scan over every purchase.
+    """
+
+    def __init__(self, user_product_matrix):
+        self.indptr = user_product_matrix.indptr
+        self.indices = user_product_matrix.indices
+        self.data = user_product_matrix.data
+        self.n_users = user_product_matrix.shape[0]
+
+    def count(self, user_id):
+        """
+        Return the number of distinct products the user purchased.
+        """
+        if user_id < 0 or user_id >= self.n_users:
+            return 0
+        return int(self.indptr[user_id + 1] - self.indptr[user_id])
+
+    def products(self, user_id, offset=0, limit=None, by_count=False):
+        """
+        Return a page of the products the user purchased and their purchase counts.
+        Args:
+            user_id: the id of the user
+            offset: the number of products to skip
+            limit: the maximum number of products to return; None for all
+            by_count: order by descending purchase count (ties by product id) instead of by product id
+        Returns:
+            (product ids, purchase counts)
+        """
+        if user_id < 0 or user_id >= self.n_users:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=self.data.dtype)
+        start, stop = self.indptr[user_id], self.indptr[user_id + 1]
+        product_ids = np.asarray(self.indices[start:stop], dtype=np.int64)
+        counts = np.asarray(self.data[start:stop])
+        if by_count:
+            order = np.lexsort((product_ids, -counts))
+        else:
+            order = np.argsort(product_ids, kind="stable")
+        end = None if limit is None else offset + limit
+        order = order[offset:end]
+        return product_ids[order], counts[order]
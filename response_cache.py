@@ -0,0 +1,220 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryBackend:
+    """
+    In-process LRU cache with a TTL, bounded by number of entries and total bytes.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024, ttl=300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._bytes += len(value)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def size(self):
+        return {"entries": len(self._entries), "bytes": self._bytes}
+
+    def _remove(self, key):
+        expires, value = self._entries.pop(key)
+        self._bytes -= len(value)
+
+
+class SQLiteBackend:
+    """
+    Approximate LRU cache with a TTL in a local SQLite file, shared by all worker processes on the host.
+    To keep hits and writes cheap, the access time of an entry is only updated once it is older than
+    touch_interval, and entries are evicted in batches: every eviction_slack writes, a process counts
+    the entries and, past max_entries + eviction_slack, deletes the expired ones and the least recently
+    used down to max_entries. The size reported to /metrics scans the table, so it is recounted at most
+    once every size_interval seconds.
+    """
+
+    def __init__(self, path, max_entries=100000, ttl=300, touch_interval=10, eviction_slack=None, size_interval=30):
+        """
+        Args:
+            path: the SQLite file
+            max_entries: the number of entries kept after an eviction
+            ttl: the lifetime of an entry in seconds
+            touch_interval: the seconds between two updates of the access time of an entry
+            eviction_slack: the number of entries allowed past max_entries, and of writes between two
+                counts; a tenth of max_entries by default
+            size_interval: the seconds size() reuses its last count for
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.touch_interval = touch_interval
+        self.eviction_slack = eviction_slack if eviction_slack is not None else max(max_entries // 10, 1)
+        self.size_interval = size_interval
+        self._writes = 0
+        #the last size() and its time.monotonic()
+        self._size = None
+        self._size_counted = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS cache "
+                               "(key TEXT PRIMARY KEY, value BLOB, expires REAL, accessed REAL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        now = time.time()
+        with self._connection() as connection:
+            row = connection.execute("SELECT value, accessed FROM cache WHERE key = ? AND expires > ?",
+                                     (key, now)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] >= self.touch_interval:
+                connection.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        with self._connection() as connection:
+            connection.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)", (key, value, now + self.ttl, now))
+        with self._lock:
+            self._writes += 1
+            if self._writes < self.eviction_slack:
+                return
+            self._writes = 0
+        self.evict(now)
+
+    def evict(self, now=None):
+        """
+        Delete the expired entries and the least recently used ones down to max_entries, if there
+        are more than max_entries + eviction_slack.
+        """
+        now = now if now is not None else time.time()
+        with self._connection() as connection:
+            entries = connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            if entries <= self.max_entries + self.eviction_slack:
+                return
+            entries -= connection.execute("DELETE FROM cache WHERE expires <= ?", (now,)).rowcount
+            if entries > self.max_entries:
+                connection.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed "
+                                   "LIMIT ?)", (entries - self.max_entries,))
+        with self._lock:
+            self._size = None
+
+    def clear(self):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM cache")
+        with self._lock:
+            self._size = None
+
+    def size(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._size is not None and now - self._size_counted < self.size_interval:
+                return dict(self._size)
+        entries, size = self._connection().execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM cache").fetchone()
+        with self._lock:
+            self._size = {"entries": entries, "bytes": size}
+            self._size_counted = now
+        return {"entries": entries, "bytes": size}
+
+
+class ResponseCache:
+    """
+    Cache of serialized responses in front of a pluggable backend, with hit/miss counters.
+    Keys are built from the request parameters plus a scope (e.g. the model version and the
+    current expiration day), so a new scope makes every older entry unreachable.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts):
+        return json.dumps(parts, separators=(",", ":"), default=str)
+
+    def get(self, key):
+        value = self.backend.get(key) if self.backend is not None else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if self.backend is not None:
+            self.backend.set(key, value)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        stats = {"backend": type(self.backend).__name__ if self.backend is not None else None,
+                 "hits": self.hits, "misses": self.misses}
+        if self.backend is not None:
+            stats.update(self.backend.size())
+        return stats
+
+
+def cache_from_env():
+    """
+    Build the response cache configured by RESPONSE_CACHE (memory, sqlite or off),
+    RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_MAX_BYTES (memory only)
+    and RESPONSE_CACHE_PATH (sqlite only).
+    """
+    kind = os.getenv('RESPONSE_CACHE', 'memory')
+    ttl = float(os.getenv('RESPONSE_CACHE_TTL', 300))
+    max_entries = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 10000))
+    max_bytes = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    if kind == 'off':
+        return ResponseCache(None)
+    if kind == 'sqlite':
+        return ResponseCache(SQLiteBackend(os.getenv('RESPONSE_CACHE_PATH', 'response_cache.sqlite'), max_entries, ttl))
+    if kind == 'memory':
+        return ResponseCache(MemoryBackend(max_entries, max_bytes, ttl))
+    raise ValueError(f"unknown RESPONSE_CACHE backend {kind}")
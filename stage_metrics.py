@@ -0,0 +1,335 @@
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request
+
+#seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+#numbers of products, users, ...
+SIZE_BUCKETS = (0, 1, 3, 10, 30, 100, 300, 1000, 3000, 10000, 30000, 100000)
+
+
+class _Span:
+    """
+    Times one stage into the stage histogram and, while the request is profiled, its breakdown.
+    A span opened inside another one is a sub-stage named <parent>.<stage>, so the top-level stages
+    of a request never overlap.
+    """
+    __slots__ = ('metrics', 'stage', 'parent', 'start')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        local = self.metrics._local
+        self.parent = getattr(local, 'stage', None)
+        if self.parent is not None:
+            self.stage = f"{self.parent}.{self.stage}"
+        local.stage = self.stage
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        self.metrics._local.stage = self.parent
+        self.metrics.observe('stage_seconds', elapsed, help_text='pipeline stage latency', stage=self.stage)
+        profile = getattr(self.metrics._local, 'profile', None)
+        if profile is not None:
+            profile.append((self.stage, elapsed))
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class StackSampler:
+    """
+    Samples the stack of one thread at a fixed interval from a background thread and counts the
+    collapsed stacks, the input format of flame graph tools.
+    """
+
+    def __init__(self, thread_id, interval=0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        return self.stacks
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms of one service, rendered in the Prometheus text format.
+    Stages are timed with span(). Profiling is off unless a profile_token is set: a request sent with
+    the X-Profile header and that token in X-Profile-Token gets its own stage breakdown in a
+    Server-Timing response header, and with X-Profile: sample the collapsed stacks of a sampling
+    profiler are written to profile_dir, up to max_profile_dumps files. Disabled metrics make span()
+    return a shared no-op context manager.
+    """
+
+    def __init__(self, namespace, enabled=True, profile_dir='profiles', sample_interval=0.001, profile_token=None,
+                 max_profile_dumps=100):
+        """
+        Args:
+            namespace: the prefix of every metric name, e.g. 'recommender'
+            enabled: record metrics; when False only /metrics keeps answering, with no samples
+            profile_dir: the directory the sampled stacks of profiled requests are written to
+            sample_interval: the sampling interval of the profiler in seconds
+            profile_token: the token a request must send in X-Profile-Token to be profiled; None disables profiling
+            max_profile_dumps: the most sampled stacks kept in profile_dir; further samples are refused
+        """
+        self.namespace = namespace
+        self.enabled = enabled
+        self.profile_dir = profile_dir
+        self.sample_interval = sample_interval
+        self.profile_token = profile_token
+        self.max_profile_dumps = max_profile_dumps
+        #dumps in profile_dir, counted on the first sampled request
+        self._profile_dumps = None
+        self._meta = {}
+        self._values = {}
+        self._histograms = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _declare(self, name, kind, help_text, buckets=None):
+        if name not in self._meta:
+            self._meta[name] = (kind, help_text, buckets)
+        return self._meta[name]
+
+    def inc(self, name, value=1, help_text='', **labels):
+        if not self.enabled:
+            return
+        self._declare(name, 'counter', help_text)
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, help_text='', **labels):
+        if not self.enabled:
+            return
+        self._declare(name, 'gauge', help_text)
+        with self._lock:
+            self._values[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, help_text='', **labels):
+        if not self.enabled:
+            return
+        kind, _, buckets = self._declare(name, 'histogram', help_text, buckets)
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(buckets), 0.0, 0]
+            counts = histogram[0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+
+    def span(self, stage):
+        """
+        Context manager timing a pipeline stage into <namespace>_stage_seconds{stage=...}.
+        """
+        return _Span(self, stage) if self.enabled else _NO_SPAN
+
+    def add_collector(self, collect):
+        """
+        Register a function called on every render that returns (name, kind, help, value) tuples,
+        for values kept elsewhere such as the response cache stats.
+        """
+        self._collectors.append(collect)
+
+    def propagate(self, fn):
+        """
+        Wrap fn so that its spans are sub-stages of the calling stage when it runs on another thread,
+        e.g. a worker pool, whether or not the request is profiled, and count towards the profile of
+        the calling request when it is.
+        """
+        profile = getattr(self._local, 'profile', None)
+        stage = getattr(self._local, 'stage', None)
+        if profile is None and stage is None:
+            return fn
+
+        def run(*args, **kwargs):
+            self._local.profile = profile
+            self._local.stage = stage
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._local.profile = None
+                self._local.stage = None
+        return run
+
+    def _profile_allowed(self):
+        token = request.headers.get('X-Profile-Token', '')
+        return self.profile_token is not None and hmac.compare_digest(token.encode(), self.profile_token.encode())
+
+    def _reserve_dump(self):
+        """
+        Count one more dump towards max_profile_dumps; False once the cap is reached.
+        """
+        with self._lock:
+            if self._profile_dumps is None:
+                self._profile_dumps = (sum(name.endswith('.txt') for name in os.listdir(self.profile_dir))
+                                       if os.path.isdir(self.profile_dir) else 0)
+            if self._profile_dumps >= self.max_profile_dumps:
+                return False
+            self._profile_dumps += 1
+            return True
+
+    def render(self):
+        """
+        Return every metric in the Prometheus text exposition format.
+        """
+        lines = []
+
+        def labels_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                  for k, v in pairs) + '}'
+
+        with self._lock:
+            values = dict(self._values)
+            histograms = {key: [list(h[0]), h[1], h[2]] for key, h in self._histograms.items()}
+        for name, (kind, help_text, buckets) in sorted(self._meta.items()):
+            full_name = f"{self.namespace}_{name}"
+            lines.append(f"# HELP {full_name} {help_text or name.replace('_', ' ')}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            if kind == 'histogram':
+                for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, bucket_count in zip(buckets, counts):
+                        cumulative += bucket_count
+                        lines.append(f"{full_name}_bucket{labels_text(labels, [('le', bound)])} {cumulative}")
+                    lines.append(f"{full_name}_bucket{labels_text(labels, [('le', '+Inf')])} {count}")
+                    lines.append(f"{full_name}_sum{labels_text(labels)} {total}")
+                    lines.append(f"{full_name}_count{labels_text(labels)} {count}")
+            else:
+                for (metric, labels), value in sorted(values.items()):
+                    if metric == name:
+                        lines.append(f"{full_name}{labels_text(labels)} {value}")
+        for collect in self._collectors:
+            for name, kind, help_text, value in collect():
+                full_name = f"{self.namespace}_{name}"
+                lines.append(f"# HELP {full_name} {help_text}")
+                lines.append(f"# TYPE {full_name} {kind}")
+                lines.append(f"{full_name} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def instrument(self, app):
+        """
+        Time every request of a Flask app, handle the X-Profile header and serve /metrics.
+        """
+        @app.before_request
+        def start_request():
+            g.metrics_start = time.perf_counter()
+            self._local.stage = None
+            mode = request.headers.get('X-Profile')
+            if mode and self.enabled and self._profile_allowed():
+                self._local.profile = []
+                if mode == 'sample':
+                    if self._reserve_dump():
+                        g.metrics_sampler = StackSampler(threading.get_ident(), self.sample_interval).start()
+                    else:
+                        app.logger.warning("profile dump limit of %d reached in %s", self.max_profile_dumps,
+                                           self.profile_dir)
+
+        @app.after_request
+        def finish_request(response):
+            start = g.pop('metrics_start', None)
+            if start is None:
+                return response
+            elapsed = time.perf_counter() - start
+            endpoint = request.endpoint or 'unknown'
+            self.observe('request_seconds', elapsed, help_text='request latency', endpoint=endpoint)
+            self.inc('requests_total', help_text='requests by status', endpoint=endpoint,
+                     status=response.status_code)
+            profile = getattr(self._local, 'profile', None)
+            if profile is not None:
+                self._local.profile = None
+                timings = [f"{stage};dur={seconds * 1000:.3f}" for stage, seconds in profile]
+                timings.append(f"total;dur={elapsed * 1000:.3f}")
+                response.headers['Server-Timing'] = ', '.join(timings)
+                app.logger.info("profile %s: %s", request.path, response.headers['Server-Timing'])
+                sampler = g.pop('metrics_sampler', None)
+                if sampler is not None:
+                    sampler.stop()
+                    os.makedirs(self.profile_dir, exist_ok=True)
+                    path = os.path.join(self.profile_dir, f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}-{endpoint}.txt")
+                    sampler.dump(path)
+                    app.logger.info("profile %s: sampled stacks written to %s", request.path, path)
+            return response
+
+        @app.teardown_request
+        def clear_profile(exc):
+            #a request that raised never reached finish_request
+            self._local.profile = None
+            self._local.stage = None
+            sampler = g.pop('metrics_sampler', None)
+            if sampler is not None:
+                sampler.stop()
+
+        @app.route('/metrics', methods=['GET'])
+        def metrics():
+            return app.response_class(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+def metrics_from_env(namespace):
+    """
+    Build the Metrics configured by METRICS (on|off), PROFILE_DIR, PROFILE_SAMPLE_INTERVAL,
+    PROFILE_TOKEN (unset: profiling off) and PROFILE_MAX_DUMPS.
+    """
+    return Metrics(namespace,
+                   enabled=os.getenv('METRICS', 'on') != 'off',
+                   profile_dir=os.getenv('PROFILE_DIR', 'profiles'),
+                   sample_interval=float(os.getenv('PROFILE_SAMPLE_INTERVAL', 0.001)),
+                   profile_token=os.getenv('PROFILE_TOKEN') or None,
+                   max_profile_dumps=int(os.getenv('PROFILE_MAX_DUMPS', 100)))
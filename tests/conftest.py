@@ -0,0 +1,25 @@
+import os
+import sys
+
+#the modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def service(tmp_path_factory):
+    """
+    The RecommenderSystem module serving a small synthetic dataset with a top N table, without
+    response caching or image searches. The module is imported once per test session.
+    """
+    from benchmarks.common import load_service
+    from benchmarks.synthetic_data import generate
+
+    data_dir = str(tmp_path_factory.mktemp('service'))
+    generate(data_dir, n_users=300, n_products=3000, n_interactions=6000, n_aisles=40, seed=2, topn=20)
+    cwd = os.getcwd()
+    try:
+        return load_service(data_dir)
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+from aisle_popularity import AislePopularity, load_or_build
+
+
+def test_load_or_build_rebuilds_on_new_matrix(tmp_path):
+    path = str(tmp_path / 'aisle_top_products.npz')
+    products_df = pd.DataFrame({'product_id': [0, 1, 2, 3], 'aisle_id': [1, 1, 2, 2]})
+    matrix = sparse.csr_matrix(np.array([[1, 0, 0, 2], [0, 3, 0, 0]]))
+    first = load_or_build(path, matrix, products_df)
+    assert list(first.top_products(1, 2)) == [1, 0]
+    assert AislePopularity.load(path).fingerprint == first.fingerprint
+
+    #a retrained matrix with other purchases replaces the stored table
+    matrix = sparse.csr_matrix(np.array([[5, 0, 1, 0], [0, 3, 0, 0]]))
+    second = load_or_build(path, matrix, products_df)
+    assert second.fingerprint != first.fingerprint
+    assert list(second.top_products(1, 2)) == [0, 1]
+    assert list(AislePopularity.load(path).top_products(2, 2)) == [2]
+
+
+def test_table_without_fingerprint_is_rebuilt(tmp_path):
+    path = str(tmp_path / 'aisle_top_products.npz')
+    products_df = pd.DataFrame({'product_id': [0, 1], 'aisle_id': [1, 1]})
+    matrix = sparse.csr_matrix(np.array([[1, 2]]))
+    table = AislePopularity.build_from_matrix(matrix, products_df)
+    np.savez(path, aisle_ids=table.aisle_ids, indptr=table.indptr, product_ids=table.product_ids,
+             purchase_counts=table.purchase_counts)
+    assert AislePopularity.load(path).fingerprint == ''
+    assert load_or_build(path, matrix, products_df).fingerprint != ''
+    assert AislePopularity.load(path).fingerprint != ''
+
+
+def test_largest_n_of_the_endpoint_is_filled_from_one_aisle(service):
+    products_df = pd.DataFrame({'product_id': np.arange(300), 'aisle_id': np.ones(300, dtype=np.int64)})
+    table = AislePopularity.build(np.arange(300, 0, -1), products_df)
+    assert list(table.recommend([1], service.MAX_N)) == list(range(service.MAX_N))
+
+    client = service.app.test_client()
+    assert client.get(f'/predict?interested_aisles=3&mood=happy&N={service.MAX_N}').status_code == 200
+    assert client.get(f'/predict?interested_aisles=3&mood=happy&N={service.MAX_N + 1}').status_code == 400
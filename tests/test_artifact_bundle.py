@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.sparse as sparse
+
+from aisle_popularity import AislePopularity
+from artifact_bundle import Artifacts, current_bundle_version, decode_names, open_bundle, write_bundle
+
+
+@pytest.fixture
+def artifacts():
+    rng = np.random.default_rng(0)
+    n_users, n_products = 30, 12
+    aisles_df = pd.DataFrame({'aisle_id': [1, 2, 3], 'aisle': ['fresh fruits', 'café', 'frozen']})
+    departments_df = pd.DataFrame({'department_id': [1, 2], 'department': ['produce', 'dairy eggs']})
+    products_df = pd.DataFrame({'product_id': np.arange(n_products),
+                                'product_name': [f'Product {i}' for i in range(n_products - 2)] + ['Crème fraîche', '豆腐'],
+                                'aisle_id': rng.integers(1, 4, n_products),
+                                'department_id': rng.integers(1, 3, n_products)})
+    products_df = pd.merge(products_df, aisles_df, on='aisle_id')
+    products_df = pd.merge(products_df, departments_df, on='department_id')
+    #aisle 3 has no mood and product 5 no expiration date
+    mood_df = pd.DataFrame({'aisle_id': [1, 2], 'mood': ['positive', 'negative']})
+    products_mood_df = pd.merge(products_df, mood_df, on='aisle_id')
+    expiration_df = pd.DataFrame({'product_id': [i for i in range(n_products) if i != 5],
+                                  'expiration_date': pd.Timestamp('2026-10-01') + pd.to_timedelta(
+                                      rng.integers(0, 30, n_products - 1), 'D')})
+    products_expiration_df = pd.merge(products_df, expiration_df, on='product_id')
+    user_product_matrix = sparse.random(n_users, n_products, density=0.2, format='csr', random_state=0) * 10
+    user_product_matrix.data = np.ceil(user_product_matrix.data)
+    embeddings = rng.normal(size=(n_products, 4)).astype(np.float32)
+    #two products close enough to be neighbors
+    embeddings[1] = embeddings[0] * 1.00001
+    return Artifacts('v1', rng.normal(size=(n_users, 8)).astype(np.float32),
+                     rng.normal(size=(n_products, 8)).astype(np.float32), user_product_matrix, embeddings,
+                     rng.normal(size=(n_users, 4)).astype(np.float32), products_df, products_mood_df,
+                     products_expiration_df, AislePopularity.build_from_matrix(user_product_matrix, products_df))
+
+
+def by_product(df, columns):
+    return df[columns].sort_values('product_id').reset_index(drop=True)
+
+
+def test_bundle_round_trip(artifacts, tmp_path):
+    path = write_bundle(artifacts, str(tmp_path), 'v1')
+    assert current_bundle_version(str(tmp_path)) == 'v1'
+    opened = open_bundle(path)
+
+    assert opened.version == 'v1'
+    for name in ('user_factors', 'item_factors', 'product_embeddings', 'user_embeddings'):
+        np.testing.assert_array_equal(getattr(opened, name), getattr(artifacts, name))
+        assert isinstance(getattr(opened, name), np.memmap)
+    assert opened.user_product_matrix.shape == artifacts.user_product_matrix.shape
+    assert (opened.user_product_matrix != artifacts.user_product_matrix).nnz == 0
+
+    columns = ['product_id', 'product_name', 'aisle_id', 'department_id', 'aisle', 'department']
+    pd.testing.assert_frame_equal(opened.products_df[columns], artifacts.products_df[columns], check_dtype=False)
+    pd.testing.assert_frame_equal(by_product(opened.products_mood_df, columns + ['mood']),
+                                  by_product(artifacts.products_mood_df, columns + ['mood']), check_dtype=False)
+    pd.testing.assert_frame_equal(by_product(opened.products_expiration_df, columns + ['expiration_date']),
+                                  by_product(artifacts.products_expiration_df, columns + ['expiration_date']),
+                                  check_dtype=False)
+
+    for name in ('aisle_ids', 'indptr', 'product_ids', 'purchase_counts'):
+        np.testing.assert_array_equal(getattr(opened.aisle_popularity, name), getattr(artifacts.aisle_popularity, name))
+    assert list(opened.aisle_popularity.recommend([1, 2], 4)) == list(artifacts.aisle_popularity.recommend([1, 2], 4))
+
+
+def test_existing_bundle_is_not_overwritten(artifacts, tmp_path):
+    write_bundle(artifacts, str(tmp_path), 'v1')
+    with pytest.raises(ValueError):
+        write_bundle(artifacts, str(tmp_path), 'v1')
+
+
+@pytest.mark.parametrize('names', [['milk', '', 'eggs'], ['Crème fraîche', 'milk', '豆腐'], []])
+def test_decode_names(names):
+    encoded = [name.encode('utf-8') for name in names]
+    offsets = np.concatenate([[0], np.cumsum([len(name) for name in encoded])]).astype(np.int64)
+    assert decode_names(np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets) == names
@@ -0,0 +1,76 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'expiration_dates'))
+
+import assign_expiration_dates as expiration  # noqa: E402
+
+TODAY = '2026-10-01'
+LOTS = 20000
+
+
+@pytest.fixture
+def departments():
+    return pd.DataFrame({'department_id': [1, 2, 3], 'department': ['produce', 'frozen', 'bakery']})
+
+
+@pytest.fixture
+def products():
+    department_ids = np.repeat([1, 2, 3], LOTS)
+    return pd.DataFrame({'product_id': np.arange(len(department_ids)), 'department_id': department_ids})
+
+
+def days_until_expiration(products):
+    return (pd.to_datetime(products['expiration_date']) - pd.Timestamp(TODAY)).dt.days.values
+
+
+def test_same_seed_gives_the_same_dates(products, departments):
+    first = expiration.assign_expiration_dates(products, departments, seed=7, today=TODAY)
+    pd.testing.assert_frame_equal(first, expiration.assign_expiration_dates(products, departments, seed=7, today=TODAY))
+    other = expiration.assign_expiration_dates(products, departments, seed=8, today=TODAY)
+    assert (first['expiration_date'] != other['expiration_date']).any()
+    assert list(first.columns) == ['product_id', 'department_id', 'department', 'expiration_date']
+
+
+def test_rule_shares_hold(products, departments):
+    products = expiration.assign_expiration_dates(products, departments, seed=3, today=TODAY)
+    days = days_until_expiration(products)
+    assert days.min() >= 1 and days.max() < expiration.MAX_DAYS
+    base = expiration.MAX_DAYS - 1
+    (fresh_3, within_3), (fresh_7, within_7) = expiration.FRESH_RULES
+    [(default_share, within_30)] = expiration.DEFAULT_RULES
+    for department in ('produce', 'bakery'):
+        fresh_days = days[products['department'].values == department]
+        #the 7-day rule overrides a random share of the 3-day one; the other dates are uniform over the year
+        expected_7 = fresh_7 + (1 - fresh_7) * (fresh_3 + (1 - fresh_3) * (within_7 - 1) / base)
+        expected_3 = (fresh_7 * (within_3 - 1) / (within_7 - 1)
+                      + (1 - fresh_7) * (fresh_3 + (1 - fresh_3) * (within_3 - 1) / base))
+        assert (fresh_days < within_7).mean() == pytest.approx(expected_7, abs=0.005)
+        assert (fresh_days < within_3).mean() == pytest.approx(expected_3, abs=0.01)
+        assert (fresh_days < within_7).sum() >= int(LOTS * fresh_7)
+    frozen_days = days[products['department'].values == 'frozen']
+    expected_30 = default_share + (1 - default_share) * (within_30 - 1) / base
+    assert (frozen_days < within_30).mean() == pytest.approx(expected_30, abs=0.01)
+    assert (frozen_days < within_30).sum() >= int(LOTS * default_share)
+
+
+def test_stores_are_reproducible_and_update_only_expired_lots(products, departments, tmp_path):
+    stores_dir = str(tmp_path / 'stores')
+    expiration.generate_stores(products, departments, stores_dir, 2, seed=1, today=TODAY)
+    first, _ = expiration.load_store(stores_dir, 0, mmap_mode=None)
+    expiration.generate_stores(products, departments, str(tmp_path / 'again'), 1, seed=1, today=TODAY)
+    again, _ = expiration.load_store(str(tmp_path / 'again'), 0)
+    np.testing.assert_array_equal(first['expiration_date'], again['expiration_date'])
+    assert expiration.store_ids(stores_dir) == [0, 1]
+
+    later = np.datetime64(TODAY, 'D') + 10
+    expired = first['expiration_date'] < later
+    assert expiration.update_store(stores_dir, 0, departments, later) == expired.sum()
+    updated, manifest = expiration.load_store(stores_dir, 0)
+    np.testing.assert_array_equal(updated['expiration_date'][~expired], first['expiration_date'][~expired])
+    assert (updated['expiration_date'][expired] > later).all()
+    assert manifest['updated'] == str(later)
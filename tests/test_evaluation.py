@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+import scipy.sparse as sparse
+
+import evaluation
+from cf_scoring import recommend_users
+
+N = 10
+
+
+@pytest.fixture(scope='module')
+def data():
+    """
+    Factors and purchases of 400 users and 150 items; test purchases are drawn from the best scored
+    items of every user, so the metrics are far from 0.
+    """
+    rng = np.random.default_rng(1)
+    n_users, n_items = 400, 150
+    user_factors = rng.normal(size=(n_users, 8)).astype(np.float32)
+    item_factors = rng.normal(size=(n_items, 8)).astype(np.float32)
+    train_users, train_items = rng.integers(0, n_users, 4000), rng.integers(1, n_items, 4000)
+    train_matrix = sparse.coo_matrix((np.ones(4000), (train_users, train_items)), shape=(n_users, n_items)).tocsr()
+    best = np.argsort(-(user_factors @ item_factors.T), axis=1)[:, :30]
+    test_users = rng.integers(0, n_users - 1, 1200)
+    test_items = best[test_users, rng.integers(0, 30, 1200)]
+    #one user only bought again what they bought before, so they have no relevant items
+    test_users = np.append(test_users, 399)
+    test_items = np.append(test_items, train_matrix[399].indices[:1])
+    test_matrix = sparse.coo_matrix((np.ones(len(test_users)), (test_users, test_items)),
+                                    shape=(n_users, n_items)).tocsr()
+    return user_factors, item_factors, train_matrix, test_matrix
+
+
+def reference_metrics(train_matrix, test_matrix, recommend):
+    """
+    The notebooks' per-user loops over the ranked recommendations of every user with test purchases.
+    """
+    results = {name: [] for name in evaluation.METRICS}
+    for user in np.unique(test_matrix.nonzero()[0]):
+        actual = set(test_matrix[user].indices) - set(train_matrix[user].indices)
+        recommended = [item for item in recommend(user) if item >= 0]
+        hits = [item in actual for item in recommended]
+        precision = sum(hits) / len(recommended) if recommended else 0
+        recall = sum(hits) / len(actual) if actual else 0
+        f1_score = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0
+        n_ideal = min(len(actual), N)
+        average_precision = (sum(sum(hits[:i + 1]) / (i + 1) for i, hit in enumerate(hits) if hit) / n_ideal
+                             if n_ideal else 0)
+        dcg = sum(1 / np.log2(i + 2) for i, hit in enumerate(hits) if hit)
+        ideal_dcg = sum(1 / np.log2(i + 2) for i in range(n_ideal))
+        for name, value in zip(evaluation.METRICS, (precision, recall, f1_score, average_precision,
+                                                    dcg / ideal_dcg if ideal_dcg else 0)):
+            results[name].append(value)
+    return {name: np.mean(values) for name, values in results.items()}
+
+
+def assert_metrics_close(metrics, reference):
+    assert set(metrics) == set(reference)
+    for name in reference:
+        assert metrics[name] == pytest.approx(reference[name]), name
+
+
+@pytest.mark.parametrize('processes', [1, 3])
+def test_filtered_recommendations_match_the_loops(data, processes):
+    user_factors, item_factors, train_matrix, test_matrix = data
+    reference = reference_metrics(train_matrix, test_matrix, lambda user: recommend_users(
+        user_factors, item_factors, train_matrix, [user], N)[0][0])
+    assert reference['precision'] > 0.1
+    metrics = evaluation.evaluate(user_factors, item_factors, train_matrix, test_matrix, N, block_size=64,
+                                  processes=processes)
+    assert_metrics_close(metrics, reference)
+
+
+def test_unfiltered_recommendations_match_the_loops(data):
+    user_factors, item_factors, train_matrix, test_matrix = data
+    reference = reference_metrics(train_matrix, test_matrix,
+                                  lambda user: np.argsort(-(user_factors[user] @ item_factors.T), kind='stable')[:N])
+    metrics = evaluation.evaluate(user_factors, item_factors, train_matrix, test_matrix, N, filter_purchased=False,
+                                  block_size=64, processes=2)
+    assert_metrics_close(metrics, reference)
+
+
+def test_popularity_matches_the_loops(data):
+    user_factors, item_factors, train_matrix, test_matrix = data
+    popular_items = np.argsort(-np.asarray(train_matrix.sum(axis=0)).ravel(), kind='stable')[:N]
+    reference = reference_metrics(train_matrix, test_matrix, lambda user: popular_items)
+    assert_metrics_close(evaluation.evaluate_popularity(train_matrix, test_matrix, N, block_size=64), reference)
+
+
+def test_neighbors_match_the_loops(data):
+    item_factors = data[1]
+    rng = np.random.default_rng(2)
+    #product id 0 is not a product
+    item_aisles = np.append(-1, rng.integers(0, 12, len(item_factors) - 1))
+    vectors = item_factors / np.linalg.norm(item_factors, axis=1, keepdims=True)
+    precision, recall, f1_score = [], [], []
+    for item in range(1, len(item_factors)):
+        top = np.argsort(-(vectors @ vectors[item]))[:N]
+        same_aisle = (item_aisles[top] == item_aisles[item]).sum()
+        precision.append(same_aisle / N)
+        recall.append(same_aisle / (item_aisles == item_aisles[item]).sum())
+        f1_score.append(2 * precision[-1] * recall[-1] / (precision[-1] + recall[-1]) if same_aisle else 0)
+    metrics = evaluation.evaluate_neighbors(item_factors, item_aisles, N, block_size=32, processes=2)
+    assert_metrics_close(metrics, {'precision': np.mean(precision), 'recall': np.mean(recall),
+                                   'f1_score': np.mean(f1_score)})
+
+
+def test_top_n_metrics_of_one_ranking():
+    #hits at ranks 1 and 3 of 4 recommendations, 3 relevant items
+    recommended = np.array([[5, 1, 7, -1]])
+    relevant = sparse.csr_matrix((np.ones(3), ([0, 0, 0], [5, 7, 9])), shape=(1, 10))
+    metrics = evaluation.top_n_metrics(recommended, relevant)
+    assert metrics['precision'][0] == pytest.approx(2 / 3)
+    assert metrics['recall'][0] == pytest.approx(2 / 3)
+    assert metrics['map'][0] == pytest.approx((1 + 2 / 3) / 3)
+    assert metrics['ndcg'][0] == pytest.approx((1 + 1 / np.log2(4)) / (1 + 1 / np.log2(3) + 1 / np.log2(4)))
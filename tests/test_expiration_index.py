@@ -0,0 +1,40 @@
+from datetime import datetime
+
+import pandas as pd
+
+from expiration_index import ExpirationIndex
+
+
+def products():
+    dates = pd.date_range('2024-01-02', periods=60, freq='D').strftime('%Y-%m-%d')
+    return pd.DataFrame({'product_id': range(60), 'expiration_date': dates})
+
+
+def test_pool_window():
+    index = ExpirationIndex(products())
+    pool_df, _ = index.close_to_expiration(5, now=datetime(2024, 1, 1, 12))
+    assert list(pool_df['days_until_expiration']) == [1, 2, 3, 4, 5]
+
+
+def test_pools_are_bounded_lru():
+    builds = []
+    index = ExpirationIndex(products(), pool_index_builder=builds.append, max_pools=3)
+    now = datetime(2024, 1, 1, 12)
+    for days in range(1, 50):
+        index.close_to_expiration(days, now=now)
+    assert len(index._pools) == 3
+    #a recently used pool stays cached, the least recently used one is rebuilt
+    index.close_to_expiration(47, now=now)
+    index.close_to_expiration(1, now=now)
+    n_builds = len(builds)
+    index.close_to_expiration(47, now=now)
+    assert len(builds) == n_builds
+    index.close_to_expiration(48, now=now)
+    assert len(builds) == n_builds + 1
+
+
+def test_pools_drop_on_new_day():
+    index = ExpirationIndex(products())
+    index.close_to_expiration(5, now=datetime(2024, 1, 1, 12))
+    index.close_to_expiration(5, now=datetime(2024, 1, 2, 12))
+    assert [key[0] for key in index._pools] == [ExpirationIndex.day_number(datetime(2024, 1, 2))]
@@ -0,0 +1,77 @@
+import io
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'frontend', 'src',
+                                'components'))
+
+from face_index import FaceIndex  # noqa: E402
+from local_storage import LocalBucket  # noqa: E402
+
+
+def test_sync_is_rate_limited(tmp_path):
+    bucket = LocalBucket(str(tmp_path))
+    worker, other_worker = FaceIndex(bucket, sync_interval=3600), FaceIndex(bucket, sync_interval=3600)
+    assert worker.sync() == 0
+    other_worker.add('alice', [1.0, 0.0, 0.0])
+    assert worker.sync() == 0
+    assert 'alice' not in worker
+    assert worker.sync(force=True) == 1
+    assert worker.search([1.0, 0.0, 0.0])[0] == 'alice'
+
+
+def test_sync_reloads_re_registered_users(tmp_path):
+    bucket = LocalBucket(str(tmp_path))
+    worker, other_worker = FaceIndex(bucket, sync_interval=0), FaceIndex(bucket, sync_interval=0)
+    other_worker.add('alice', [1.0, 0.0, 0.0])
+    assert worker.sync() == 1
+    #unchanged blobs are not downloaded again, and neither are the worker's own uploads
+    worker.add('bob', [0.0, 0.0, 1.0])
+    assert worker.sync() == 0
+
+    other_worker.add('alice', [0.0, 1.0, 0.0])
+    #a distinct generation even if both uploads land within one mtime tick
+    os.utime(bucket.blob(worker.blob_name('alice')).path, ns=(1, 1))
+    assert worker.sync() == 1
+    assert len(worker) == 2
+    user_key, distance = worker.search([0.0, 1.0, 0.0])
+    assert user_key == 'alice' and distance < 1e-6
+
+
+def test_search_returns_the_closest_user_within_the_threshold(tmp_path):
+    index = FaceIndex(LocalBucket(str(tmp_path)), threshold=0.1)
+    assert index.search([1.0, 0.0, 0.0]) is None
+    index.add('alice', [1.0, 0.0, 0.0])
+    index.add('bob', [0.0, 1.0, 0.0])
+    #embeddings are compared by cosine distance, whatever their norm
+    user_key, distance = index.search([0.0, 5.0, 0.2])
+    assert user_key == 'bob' and distance == pytest.approx(1 - 5 / np.hypot(5, 0.2), abs=1e-6)
+    assert index.search([1.0, 1.0, 0.0]) is None
+
+
+def test_matrix_grows_and_replaces_rows(tmp_path):
+    index = FaceIndex(LocalBucket(str(tmp_path)), threshold=1e-3)
+    embeddings = np.eye(40, dtype=np.float32)
+    for i, embedding in enumerate(embeddings):
+        index.add(f'user_{i}', embedding, persist=False)
+    assert len(index) == 40
+    assert all(index.search(embedding)[0] == f'user_{i}' for i, embedding in enumerate(embeddings))
+    #a re-registration replaces the row of the user
+    index.add('user_3', embeddings[39], persist=False)
+    assert len(index) == 40 and index.user_keys.count('user_3') == 1
+    assert index.search(embeddings[3]) is None
+
+
+def test_persisted_embeddings_load_in_a_new_worker(tmp_path):
+    bucket = LocalBucket(str(tmp_path))
+    FaceIndex(bucket).add('carol_smith', [0.0, 3.0, 4.0])
+    assert [blob.name for blob in bucket.list_blobs('face_embeddings/')] == ['face_embeddings/carol_smith.npy']
+    stored = np.load(io.BytesIO(bucket.blob('face_embeddings/carol_smith.npy').download_as_bytes()))
+    np.testing.assert_allclose(stored, [0.0, 0.6, 0.8], rtol=1e-6)
+    index = FaceIndex(bucket)
+    assert index.sync() == 1
+    assert index.search([0.0, 0.6, 0.8])[0] == 'carol_smith'
+    assert index.sync(force=True) == 0
@@ -0,0 +1,93 @@
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'frontend', 'src',
+                                'components'))
+
+from inference_pool import InferencePool, PoolBusy  # noqa: E402
+
+
+def test_every_caller_gets_its_own_result():
+    pool = InferencePool(max_workers=3, max_pending=20)
+
+    def job(i):
+        #later jobs finish first
+        time.sleep((20 - i) * 0.001)
+        return i * i
+
+    with ThreadPoolExecutor(max_workers=20) as callers:
+        results = list(callers.map(lambda i: pool.run(job, i), range(20)))
+    assert results == [i * i for i in range(20)]
+    assert pool.stats() == {'workers': 3, 'max_pending': 20, 'in_flight': 0, 'rejected': 0}
+    pool.shutdown()
+
+
+def test_at_most_max_workers_run_at_once():
+    pool = InferencePool(max_workers=2, max_pending=10)
+    running, most_running, lock = [0], [0], threading.Lock()
+
+    def job():
+        with lock:
+            running[0] += 1
+            most_running[0] = max(most_running[0], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+
+    with ThreadPoolExecutor(max_workers=8) as callers:
+        list(callers.map(lambda _: pool.run(job), range(8)))
+    assert most_running[0] == 2
+    pool.shutdown()
+
+
+def test_full_queue_rejects_after_the_timeout():
+    pool = InferencePool(max_workers=1, max_pending=1, queue_timeout=0.05)
+    release = threading.Event()
+    with ThreadPoolExecutor(max_workers=2) as callers:
+        blocked = [callers.submit(pool.run, release.wait, 5) for _ in range(2)]
+        while pool.stats()['in_flight'] < 2:
+            time.sleep(0.001)
+        with pytest.raises(PoolBusy):
+            pool.run(lambda: None)
+        assert pool.stats()['rejected'] == 1
+        release.set()
+        assert [future.result() for future in blocked] == [True, True]
+    #the slots are free again
+    assert pool.run(lambda: 'ok') == 'ok'
+    pool.shutdown()
+
+
+def test_failed_job_frees_its_slot():
+    pool = InferencePool(max_workers=1, max_pending=0, queue_timeout=0.05)
+
+    def fail():
+        raise ValueError('no face')
+    with pytest.raises(ValueError):
+        pool.run(fail)
+    assert pool.run(lambda: 'ok') == 'ok'
+    assert pool.stats()['in_flight'] == 0
+    pool.shutdown()
+
+
+def test_shutdown_finishes_running_jobs_then_refuses_new_ones():
+    pool = InferencePool(max_workers=1, max_pending=1)
+    started = threading.Event()
+
+    def job():
+        started.set()
+        time.sleep(0.05)
+        return 'done'
+
+    with ThreadPoolExecutor(max_workers=1) as callers:
+        running = callers.submit(pool.run, job)
+        started.wait(5)
+        pool.shutdown(wait=True)
+        assert running.result(timeout=5) == 'done'
+    with pytest.raises(RuntimeError):
+        pool.run(job)
+    assert pool.stats()['in_flight'] == 0
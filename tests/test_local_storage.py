@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'frontend', 'src',
+                                'components'))
+
+from local_storage import LocalBucket  # noqa: E402
+
+
+def test_upload_and_download(tmp_path):
+    bucket = LocalBucket(str(tmp_path / 'bucket'))
+    blob = bucket.blob('source_photos/alice/photo.txt')
+    assert not blob.exists() and blob.generation is None
+    blob.upload_from_string('héllo')
+    assert blob.exists()
+    assert blob.download_as_bytes() == 'héllo'.encode('utf-8')
+    assert blob.public_url == 'file://' + os.path.abspath(blob.path)
+    blob.download_to_filename(str(tmp_path / 'copy.txt'))
+    assert (tmp_path / 'copy.txt').read_bytes() == 'héllo'.encode('utf-8')
+    (tmp_path / 'upload.txt').write_bytes(b'other')
+    bucket.blob('source_photos/bob/photo.txt').upload_from_filename(str(tmp_path / 'upload.txt'))
+    assert bucket.blob('source_photos/bob/photo.txt').download_as_bytes() == b'other'
+
+
+def test_upload_writes_then_renames(tmp_path, monkeypatch):
+    bucket = LocalBucket(str(tmp_path))
+    blob = bucket.blob('face_embeddings/alice.npy')
+    blob.upload_from_string(b'old')
+    generation = blob.generation
+
+    #a writer that dies before the rename leaves the previous blob whole and the temporary file unlisted
+    def fail(src, dst):
+        raise OSError('interrupted')
+    with monkeypatch.context() as patch:
+        patch.setattr(os, 'replace', fail)
+        with pytest.raises(OSError):
+            blob.upload_from_string(b'new and longer')
+    assert blob.download_as_bytes() == b'old'
+    assert os.path.exists(blob.path + '.tmp')
+    assert [listed.name for listed in bucket.list_blobs()] == ['face_embeddings/alice.npy']
+
+    os.utime(blob.path, ns=(1, 1))
+    blob.upload_from_string(b'new')
+    assert blob.download_as_bytes() == b'new'
+    assert blob.generation not in (None, generation, 1)
+    assert not os.path.exists(blob.path + '.tmp')
+
+
+def test_list_blobs_filters_by_prefix_in_name_order(tmp_path):
+    bucket = LocalBucket(str(tmp_path))
+    for name in ('face_embeddings/bob.npy', 'source_photos/bob/1.jpg', 'face_embeddings/alice.npy'):
+        bucket.blob(name).upload_from_string(b'x')
+    assert [blob.name for blob in bucket.list_blobs('face_embeddings/')] == ['face_embeddings/alice.npy',
+                                                                             'face_embeddings/bob.npy']
+    assert len(bucket.list_blobs()) == 3
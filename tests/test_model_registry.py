@@ -0,0 +1,150 @@
+import threading
+import time
+
+import pytest
+
+from model_registry import ModelRegistry
+
+
+class FakeModels:
+    def __init__(self, version, valid=True):
+        self.version = version
+        self.valid = valid
+
+    def validate(self):
+        if not self.valid:
+            raise ValueError(f"version {self.version} is broken")
+
+
+class Builder:
+    """
+    Builds FakeModels, optionally blocking until released, and records the most builds running at once.
+    """
+
+    def __init__(self, broken=(), block=False):
+        self.broken = set(broken)
+        self.release = threading.Event()
+        if not block:
+            self.release.set()
+        self.started = threading.Event()
+        self.running = 0
+        self.max_running = 0
+        self.versions = []
+        self._lock = threading.Lock()
+
+    def __call__(self, version):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            self.versions.append(version)
+        self.started.set()
+        self.release.wait(5)
+        with self._lock:
+            self.running -= 1
+        return FakeModels(version or 'v1', version not in self.broken)
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_reload_swaps_the_version():
+    registry = ModelRegistry(Builder())
+    registry.load()
+    swapped = []
+    registry.swap_listeners.append(lambda models: swapped.append(models.version))
+    assert registry.reload_async('v2')
+    wait_until(lambda: registry.status()['loading'] is None)
+    status = registry.status()
+    assert status['active'] == 'v2'
+    assert [entry['version'] for entry in status['history']] == ['v2', 'v1']
+    assert swapped == ['v2']
+
+
+def test_failed_version_keeps_the_current_one():
+    registry = ModelRegistry(Builder(broken={'v2'}))
+    registry.load()
+    registry.reload_async('v2')
+    wait_until(lambda: registry.status()['loading'] is None)
+    assert registry.current.version == 'v1'
+    assert registry.last_error == {'version': 'v2', 'error': 'version v2 is broken'}
+    #a later successful load clears the error
+    registry.reload_async('v3')
+    wait_until(lambda: registry.status()['loading'] is None)
+    assert registry.current.version == 'v3' and registry.last_error is None
+
+
+def test_second_reload_is_refused_while_loading():
+    builder = Builder()
+    registry = ModelRegistry(builder)
+    registry.load()
+    builder.release.clear()
+    assert registry.reload_async('v2')
+    assert not registry.reload_async('v3')
+    assert registry.status()['loading'] == 'v2'
+    builder.release.set()
+    wait_until(lambda: registry.status()['loading'] is None)
+    assert registry.current.version == 'v2'
+
+
+def test_watcher_waits_for_a_running_reload():
+    builder = Builder()
+    registry = ModelRegistry(builder)
+    registry.load()
+    builder.release.clear()
+    builder.started.clear()
+    registry.reload_async('v2')
+    builder.started.wait(5)
+    registry.watch(lambda: 'v3', interval=0.01)
+    time.sleep(0.1)
+    #the watcher did not start a second build next to the running one
+    assert builder.versions == [None, 'v2']
+    builder.release.set()
+    wait_until(lambda: registry.current.version == 'v3')
+    assert builder.max_running == 1
+
+
+def test_watcher_does_not_retry_a_failed_version():
+    builder = Builder(broken={'v2'})
+    registry = ModelRegistry(builder)
+    registry.load()
+    registry.watch(lambda: 'v2', interval=0.01)
+    wait_until(lambda: registry.last_error is not None)
+    time.sleep(0.1)
+    assert builder.versions == [None, 'v2']
+    assert registry.current.version == 'v1'
+
+
+@pytest.fixture
+def registry(service, monkeypatch):
+    builder = Builder(block=True)
+    builder.release.set()
+    registry = ModelRegistry(builder)
+    registry.load()
+    builder.release.clear()
+    monkeypatch.setattr(service, 'model_registry', registry)
+    yield registry
+    builder.release.set()
+
+
+def test_reload_endpoint_answers_409_while_loading(service, registry):
+    client = service.app.test_client()
+    response = client.post('/models/reload', json={'version': 'v2'})
+    assert response.status_code == 202
+    assert response.get_json()['loading'] == 'v2'
+    response = client.post('/models/reload', json={'version': 'v3'})
+    assert response.status_code == 409
+    assert response.get_json()['loading'] == 'v2'
+    registry.build.release.set()
+    wait_until(lambda: registry.status()['loading'] is None)
+    assert client.get('/models').get_json()['active'] == 'v2'
+
+
+@pytest.mark.parametrize('version', ['../v2', 'bundles/v2', '/tmp/v2', '.', '..', '.hidden', 2, ['v2']])
+def test_reload_endpoint_rejects_invalid_versions(service, registry, version):
+    response = service.app.test_client().post('/models/reload', json={'version': version})
+    assert response.status_code == 400
+    assert registry.build.versions == [None]
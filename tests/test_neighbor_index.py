@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from artifact_bundle import open_bundle
+from benchmarks.synthetic_data import generate
+from neighbor_index import NeighborIndex, RadiusGraph
+
+
+def product_neighbors_scan(recommended_id, given_products_df, product_embeddings, threshold=0.0001):
+    """
+    The per-item scan /predict ran before the neighbor index, returning the row positions of the matches.
+    """
+    input_embedding = product_embeddings[recommended_id]
+    squared_distances = np.sum((product_embeddings[given_products_df["product_id"].values] - input_embedding)**2, axis=1)
+    matches = (squared_distances > 0) & (squared_distances <= threshold)
+    return pd.DataFrame({'position': np.flatnonzero(matches), 'similarity': squared_distances[matches]})
+
+
+def nearest_scan(recommended_items, given_products_df, product_embeddings, N=3):
+    union_df = pd.concat([product_neighbors_scan(item, given_products_df, product_embeddings)
+                          for item in recommended_items], ignore_index=True)
+    union_df = union_df.sort_values(by="similarity", kind="stable").head(N)
+    return union_df['position'].values, union_df['similarity'].values
+
+
+@pytest.fixture(scope='module')
+def artifacts(tmp_path_factory):
+    path = generate(str(tmp_path_factory.mktemp('synthetic')), n_users=300, n_products=3000, n_interactions=3000,
+                    n_aisles=40, seed=1)
+    return open_bundle(path)
+
+
+@pytest.fixture(scope='module')
+def graph(artifacts):
+    return RadiusGraph(artifacts.product_embeddings)
+
+
+def test_graph_has_neighbors(graph):
+    #the synthetic embeddings are clustered so that the threshold finds pairs
+    assert len(graph.indices) > 0
+
+
+@pytest.mark.parametrize('mood', ['positive', 'negative', 'unclassified'])
+def test_nearest_matches_scan(artifacts, graph, mood):
+    pool_df = artifacts.products_mood_df[artifacts.products_mood_df["mood"] == mood].reset_index(drop=True)
+    neighbor_index = NeighborIndex(pool_df["product_id"].values, artifacts.product_embeddings, graph)
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        recommended_items = rng.choice(len(artifacts.product_embeddings), 10, replace=False)
+        for N in (3, 1000):
+            positions, similarities = neighbor_index.nearest(recommended_items, N=N)
+            expected_positions, expected_similarities = nearest_scan(recommended_items, pool_df,
+                                                                     artifacts.product_embeddings, N)
+            np.testing.assert_array_equal(positions, expected_positions)
+            np.testing.assert_array_equal(similarities, expected_similarities)
+
+
+def test_duplicate_pool_products_match_scan(artifacts, graph):
+    #a product listed twice in a pool is a match twice, as in the scan
+    pool_df = pd.concat([artifacts.products_df.iloc[:1500], artifacts.products_df.iloc[:300]], ignore_index=True)
+    neighbor_index = NeighborIndex(pool_df["product_id"].values, artifacts.product_embeddings, graph)
+    recommended_items = np.arange(0, 3000, 7)
+    positions, similarities = neighbor_index.nearest(recommended_items, N=10000)
+    expected_positions, expected_similarities = nearest_scan(recommended_items, pool_df, artifacts.product_embeddings,
+                                                             10000)
+    np.testing.assert_array_equal(positions, expected_positions)
+    np.testing.assert_array_equal(similarities, expected_similarities)
+
+
+def test_nearest_groups_matches_nearest(artifacts, graph):
+    pool_df = artifacts.products_expiration_df
+    neighbor_index = NeighborIndex(pool_df["product_id"].values, artifacts.product_embeddings, graph)
+    rng = np.random.default_rng(1)
+    lists = [rng.choice(len(artifacts.product_embeddings), 10, replace=False) for _ in range(40)]
+    groups = np.repeat(np.arange(len(lists)), 10)
+    grouped = neighbor_index.nearest_groups(np.concatenate(lists), groups, len(lists))
+    for items, (positions, similarities) in zip(lists, grouped):
+        expected_positions, expected_similarities = neighbor_index.nearest(items)
+        np.testing.assert_array_equal(positions, expected_positions)
+        np.testing.assert_array_equal(similarities, expected_similarities)
+
+
+def test_threshold_above_graph_is_rejected(artifacts, graph):
+    neighbor_index = NeighborIndex(artifacts.products_df["product_id"].values, artifacts.product_embeddings, graph)
+    with pytest.raises(ValueError):
+        neighbor_index.nearest([0], threshold=0.001)
+
+
+def test_graph_matches_brute_force_on_unit_embeddings():
+    #L2-normalized embeddings like the content-based model's, where every norm is the same
+    rng = np.random.default_rng(2)
+    centers = rng.normal(size=(30, 32))
+    vectors = centers[rng.integers(0, 30, 2000)] + rng.normal(size=(2000, 32)) * rng.uniform(0.0002, 0.003, (2000, 1))
+    vectors = (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+    graph = RadiusGraph(vectors, block_size=64)
+    for product_id in range(0, 2000, 5):
+        squared_distances = np.sum((vectors - vectors[product_id])**2, axis=1)
+        expected = np.flatnonzero((squared_distances > 0) & (squared_distances <= 0.0001))
+        start, stop = graph.indptr[product_id], graph.indptr[product_id + 1]
+        np.testing.assert_array_equal(graph.indices[start:stop], expected)
+        np.testing.assert_array_equal(graph.distances[start:stop], squared_distances[expected])
+
+
+def test_bundle_stores_the_graph(artifacts, graph):
+    #open_bundle maps the graph written by write_bundle instead of building it
+    stored = artifacts.neighbor_graph
+    assert stored is not None and isinstance(stored.indptr, np.memmap)
+    assert stored.threshold == graph.threshold
+    np.testing.assert_array_equal(stored.indptr, graph.indptr)
+    np.testing.assert_array_equal(stored.indices, graph.indices)
+    np.testing.assert_array_equal(stored.distances, graph.distances)
@@ -0,0 +1,65 @@
+import copy
+
+import numpy as np
+import pytest
+
+from precomputed_recommendations import TopNTable
+from product_catalog import ProductCatalog
+
+
+def test_covers():
+    table = TopNTable('v1', np.zeros((5, 4), dtype=np.int32), np.zeros((5, 4), dtype=np.float32))
+    assert list(table.covers([-1, 0, 4, 5], 4)) == [False, True, True, False]
+    assert not table.covers([0], 5).any()
+    assert not table.covers([0], 0).any()
+    assert not table.covers([0], -3).any()
+
+
+def models_with_table(service, item_ids, scores=None, version=None):
+    models = copy.copy(service.model_registry.current)
+    scores = scores if scores is not None else np.zeros(np.shape(item_ids), dtype=np.float32)
+    models.topn_table = TopNTable(version or models.version, item_ids, scores)
+    return models
+
+
+def test_validate_accepts_the_precomputed_table(service):
+    models = service.model_registry.current
+    table = models.topn_table
+    models_with_table(service, np.asarray(table.item_ids), np.asarray(table.scores)).validate()
+    #padded rows and an empty table
+    models_with_table(service, np.full((3, 4), -1, dtype=np.int32)).validate()
+    models_with_table(service, np.zeros((0, 4), dtype=np.int32)).validate()
+
+
+@pytest.mark.parametrize('change', ['version', 'shape', 'scores', 'dtype', 'users', 'last row', 'below -1',
+                                    'not in catalog'])
+def test_validate_rejects_bad_tables(service, change):
+    models = service.model_registry.current
+    n_users, n_items = models.user_product_matrix.shape
+    item_ids = np.array(models.topn_table.item_ids)
+    scores = np.array(models.topn_table.scores)
+    version = None
+    if change == 'version':
+        version = 'other'
+    elif change == 'shape':
+        item_ids = item_ids[:, 0]
+    elif change == 'scores':
+        scores = scores[:, :-1]
+    elif change == 'dtype':
+        item_ids = item_ids.astype(np.float32)
+    elif change == 'users':
+        item_ids = np.zeros((n_users + 1, 4), dtype=np.int32)
+        scores = None
+    elif change == 'last row':
+        item_ids[-1, -1] = n_items
+    elif change == 'below -1':
+        item_ids[len(item_ids) // 2, 0] = -2
+    elif change == 'not in catalog':
+        catalog = models.products_df
+        models = models_with_table(service, item_ids, scores)
+        models.catalog = ProductCatalog(catalog[catalog['product_id'] != item_ids[-1, 0]])
+        with pytest.raises(ValueError, match='not in the catalog'):
+            models.validate()
+        return
+    with pytest.raises(ValueError):
+        models_with_table(service, item_ids, scores, version).validate()
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+
+def post_batch(service, body):
+    return service.app.test_client().post('/predict_batch', json=body)
+
+
+def test_batch_matches_predict(service):
+    client = service.app.test_client()
+    users = [{'userId': 3, 'mood': 'happy'}, {'userId': 11, 'mood': 'sad'}, {'userId': 3, 'mood': 'neutral'}]
+    response = post_batch(service, {'users': users, 'N': 10, 'days': 20})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['model_version'] == service.model_registry.current.version
+    assert [result['userId'] for result in body['results']] == [3, 11, 3]
+    for user, result in zip(users, body['results']):
+        single = client.get(f"/predict?userId={user['userId']}&mood={user['mood']}&N=10&days=20").get_json()
+        for section in ('initial_recommendations', 'mood_related_recommendations', 'close_to_exp_recommendations'):
+            assert result[section] == single[section]
+
+
+@pytest.mark.parametrize('user_id', [True, 2.7, '7', None, [7]])
+def test_non_integer_user_ids_are_rejected(service, user_id):
+    response = post_batch(service, {'users': [{'userId': user_id, 'mood': 'happy'}]})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('field, value', [('N', 2.5), ('N', False), ('days', '15'), ('N', 0), ('N', 101),
+                                          ('days', 0), ('cf_mode', 'cached')])
+def test_invalid_parameters_are_rejected(service, field, value):
+    response = post_batch(service, {'users': [{'userId': 1, 'mood': 'happy'}], field: value})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('users', [None, [], {'userId': 1}, [1], [{'userId': 1}], [{'userId': 1, 'mood': 'bored'}],
+                                   [{'userId': -1, 'mood': 'happy'}], [{'userId': 10 ** 9, 'mood': 'happy'}]])
+def test_invalid_users_are_rejected(service, users):
+    response = post_batch(service, {'users': users})
+    assert response.status_code == 400
+
+
+def test_batch_size_is_capped(service):
+    users = [{'userId': 1, 'mood': 'happy'}] * (service.MAX_BATCH_USERS + 1)
+    response = post_batch(service, {'users': users})
+    assert response.status_code == 400
+    assert str(service.MAX_BATCH_USERS) in response.get_json()['error']
+    assert post_batch(service, {'users': users[:service.MAX_BATCH_USERS]}).status_code == 200
+
+
+def test_malformed_body_is_rejected(service):
+    response = service.app.test_client().post('/predict_batch', data='{"users": [', content_type='application/json')
+    assert response.status_code == 400
+    response = service.app.test_client().post('/predict_batch', data=json.dumps([1, 2]),
+                                              content_type='application/json')
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('aisles', ['abc', '1,,2', '1,2,', ',', '1;2', '-3', '1.5'])
+def test_malformed_interested_aisles_are_rejected(service, aisles):
+    response = service.app.test_client().get(f'/predict?interested_aisles={aisles}&mood=happy')
+    assert response.status_code == 400
+    assert 'interested_aisles' in response.get_json()['error']
+
+
+def test_interested_aisles_allow_spaces(service):
+    response = service.app.test_client().get('/predict?interested_aisles=3,%205&mood=happy')
+    assert response.status_code == 200
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from flask import jsonify
+
+RECORD_COLUMNS = ['product_id', 'product_name', 'aisle', 'department']
+
+
+def jsonify_records(service, models, product_ids, head=None):
+    """
+    The records the /predict of the notebooks built: an isin lookup in products_df, in catalog order.
+    """
+    products_df = models.products_df
+    records_df = products_df[products_df['product_id'].isin(product_ids)][RECORD_COLUMNS]
+    if head is not None:
+        records_df = records_df.head(head)
+    records_df = records_df.assign(image_url=service.image_resolver.default_url)
+    return records_df.to_dict(orient='records')
+
+
+def assert_same_bytes(service, response, initial_records, actual_records=None):
+    """
+    The pre-encoded response must equal jsonify of the same body with the reference records.
+    """
+    body = response.get_json()
+    body['initial_recommendations'] = initial_records
+    if actual_records is not None:
+        body['actual_purchased_products'] = actual_records
+    with service.app.app_context():
+        assert response.get_data() == jsonify(body).get_data()
+
+
+@pytest.mark.parametrize('aisles', ['1,1,1', '3,5,3', '7'])
+def test_cold_start_matches_jsonify(service, aisles):
+    models = service.model_registry.current
+    client = service.app.test_client()
+    response = client.get(f'/predict?interested_aisles={aisles}&mood=happy&N=12')
+    assert response.status_code == 200
+    product_ids = service.get_initial_recommendations_for_new_users(aisles, 12, models)
+    assert_same_bytes(service, response, jsonify_records(service, models, product_ids, 6))
+    initial_ids = [record['product_id'] for record in response.get_json()['initial_recommendations']]
+    assert len(initial_ids) == len(set(initial_ids))
+
+
+def test_known_user_matches_jsonify(service):
+    models = service.model_registry.current
+    client = service.app.test_client()
+    user_id = int(np.argmax(np.diff(models.user_product_matrix.indptr)))
+    response = client.get(f'/predict?userId={user_id}&mood=sad&N=10')
+    assert response.status_code == 200
+    product_ids = service.base_recommendations([user_id], 10, models)[0][0]
+    purchased_ids, _ = models.purchase_history.products(user_id)
+    assert_same_bytes(service, response, jsonify_records(service, models, product_ids, 6),
+                      jsonify_records(service, models, purchased_ids, service.HISTORY_PAGE_SIZE))
+
+
+def test_batch_initial_recommendations_are_unique(service):
+    client = service.app.test_client()
+    response = client.post('/predict_batch', json={'users': [{'userId': u, 'mood': 'happy'} for u in range(5)]})
+    assert response.status_code == 200
+    for result in response.get_json()['results']:
+        initial_ids = [record['product_id'] for record in result['initial_recommendations']]
+        assert initial_ids == sorted(set(initial_ids), key=initial_ids.index)
@@ -0,0 +1,151 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from product_images import ImageCache, ProductImageResolver
+
+
+class StubSearch(ThreadingHTTPServer):
+    """
+    A local image search API: queries listed in failures get a 429 while they have failures left,
+    queries listed in delays are answered after that many seconds, the others right away.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubSearchHandler)
+        self.failures = {}
+        self.delays = {}
+        self.retry_after = None
+        self.calls = []
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/customsearch/v1'
+
+
+class StubSearchHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)['q'][0]
+        self.server.calls.append(query)
+        time.sleep(self.server.delays.get(query, 0))
+        if self.server.failures.get(query, 0) > 0:
+            self.server.failures[query] -= 1
+            self.send_response(429)
+            if self.server.retry_after is not None:
+                self.send_header('Retry-After', str(self.server.retry_after))
+            self.end_headers()
+            return
+        body = json.dumps({'items': [{'link': f'http://images/{query}.png'}]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = StubSearch()
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_resolver(stub, retry_after=60, **kwargs):
+    return ProductImageResolver(api_key='key', search_engine_id='engine', search_url=stub.url, cache=ImageCache(),
+                                default_url='default', retry_after=retry_after, **kwargs)
+
+
+def test_images_are_searched_and_cached(stub):
+    resolver = make_resolver(stub)
+    assert resolver.resolve_status([1, 2], ['milk', 'eggs']) == (['http://images/milk.png', 'http://images/eggs.png'], True)
+    assert resolver.resolve([1, 2], ['milk', 'eggs']) == ['http://images/milk.png', 'http://images/eggs.png']
+    assert sorted(stub.calls) == ['eggs', 'milk']
+
+
+def test_failed_search_is_not_retried_before_retry_after(stub):
+    stub.failures['milk'] = 1
+    resolver = make_resolver(stub)
+    assert resolver.resolve_status([1], ['milk']) == (['default'], False)
+    assert resolver.resolve_status([1], ['milk']) == (['default'], False)
+    assert stub.calls == ['milk']
+    assert resolver.failed_recently(1)
+
+
+def test_failed_search_is_retried_after_retry_after(stub):
+    stub.failures['milk'] = 1
+    resolver = make_resolver(stub, retry_after=0)
+    assert resolver.resolve([1], ['milk']) == ['default']
+    assert resolver.resolve_status([1], ['milk']) == (['http://images/milk.png'], True)
+    assert not resolver.failed_recently(1)
+    assert len(resolver._failures) == 0
+
+
+def test_retry_after_header_extends_the_wait(stub):
+    stub.failures['milk'] = 1
+    stub.retry_after = 3600
+    resolver = make_resolver(stub, retry_after=0)
+    resolver.resolve([1], ['milk'])
+    assert resolver.failed_recently(1)
+
+
+def test_slow_search_misses_the_deadline_and_fills_the_cache(stub):
+    stub.delays['milk'] = 0.3
+    resolver = make_resolver(stub)
+    urls, complete = resolver.resolve_status([1, 2], ['milk', 'eggs'], deadline=time.monotonic() + 0.05)
+    assert (urls, complete) == (['default', 'http://images/eggs.png'], False)
+    resolver.executor.shutdown(wait=True)
+    assert resolver.cache.get(1)[0] == 'http://images/milk.png'
+
+
+def test_failures_are_bounded(stub):
+    resolver = make_resolver(stub, max_failures=3)
+    stub.failures.update({f'product {i}': 1 for i in range(5)})
+    for i in range(5):
+        resolver.resolve([i], [f'product {i}'])
+    assert list(resolver._failures) == [2, 3, 4]
+    assert not resolver.failed_recently(0)
+
+
+def test_warm_counts_failures_separately(stub):
+    stub.failures['milk'] = 1
+    resolver = make_resolver(stub)
+    searched, failed = resolver.warm([1, 2], ['milk', 'eggs'])
+    assert (searched, failed) == (1, 1)
+    assert len(resolver.cache) == 1
+
+
+def test_disabled_resolver_is_complete():
+    resolver = ProductImageResolver(default_url='default')
+    assert resolver.resolve_status([1, 2], ['milk', 'eggs']) == (['default', 'default'], True)
+
+
+def test_degraded_responses_are_not_cached(service, stub, monkeypatch):
+    from response_cache import MemoryBackend, ResponseCache
+
+    resolver = make_resolver(stub)
+    response_cache = ResponseCache(MemoryBackend())
+    monkeypatch.setattr(service, 'image_resolver', resolver)
+    monkeypatch.setattr(service, 'response_cache', response_cache)
+    models = service.model_registry.current
+    stub.failures.update({name: 1 for name in models.catalog.product_names})
+    client = service.app.test_client()
+    path = '/predict?interested_aisles=3,5&mood=happy&N=6'
+    degraded = client.get(path).get_json()
+    assert {record['image_url'] for record in degraded['initial_recommendations']} == {'default'}
+    assert response_cache.stats()['entries'] == 0
+
+    resolver._failures.clear()
+    resolved = client.get(path).get_json()
+    assert all(record['image_url'].startswith('http://images/') for record in resolved['initial_recommendations'])
+    assert response_cache.stats()['entries'] == 1
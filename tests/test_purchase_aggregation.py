@@ -0,0 +1,94 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.sparse as sparse
+
+import purchase_aggregation
+
+
+@pytest.fixture(scope='module')
+def dataset_dir(tmp_path_factory):
+    """
+    A small Instacart-shaped dataset, with purchases of a product missing from products.csv,
+    of an order missing from orders.csv and of test orders, which the notebook merges drop.
+    """
+    rng = np.random.default_rng(5)
+    path = tmp_path_factory.mktemp('dataset')
+    n_aisles, n_products, n_orders = 12, 80, 400
+    pd.DataFrame({'aisle_id': np.arange(1, n_aisles + 1),
+                  'aisle': [f'aisle {i}' for i in range(1, n_aisles + 1)]}).to_csv(path / 'aisles.csv', index=False)
+    pd.DataFrame({'department_id': [1, 2, 3],
+                  'department': ['produce', 'dairy', 'frozen']}).to_csv(path / 'departments.csv', index=False)
+    pd.DataFrame({'product_id': np.arange(1, n_products + 1),
+                  'product_name': [f'p{i}' for i in range(1, n_products + 1)],
+                  'aisle_id': rng.integers(1, n_aisles + 1, n_products),
+                  'department_id': rng.integers(1, 4, n_products)}).to_csv(path / 'products.csv', index=False)
+    pd.DataFrame({'order_id': np.arange(1, n_orders + 1),
+                  'user_id': rng.integers(1, 60, n_orders),
+                  'eval_set': rng.choice(['prior', 'prior', 'prior', 'train', 'test'], n_orders)}).to_csv(
+        path / 'orders.csv', index=False)
+    for name, n_rows in (('order_products__prior.csv', 3000), ('order_products__train.csv', 800)):
+        order_ids = rng.integers(1, n_orders + 1, n_rows)
+        product_ids = rng.integers(1, n_products + 1, n_rows)
+        order_ids[0], product_ids[1] = n_orders + 7, n_products + 3
+        pd.DataFrame({'order_id': order_ids, 'product_id': product_ids, 'add_to_cart_order': 1,
+                      'reordered': 0}).to_csv(path / name, index=False)
+    return str(path)
+
+
+@pytest.fixture(scope='module')
+def notebook(dataset_dir):
+    """
+    The aisle ranking, train_df, test_df and user-product matrix as the notebooks compute them.
+    """
+    def read(name):
+        return pd.read_csv(os.path.join(dataset_dir, name))
+
+    aisles_df = read('aisles.csv')
+    products_df = pd.merge(pd.merge(read('products.csv'), aisles_df, on='aisle_id'), read('departments.csv'),
+                           on='department_id')
+    orders_df = read('orders.csv')
+    prior_df = pd.merge(orders_df[orders_df['eval_set'] == 'prior'],
+                        pd.merge(read('order_products__prior.csv'), products_df, on='product_id'), on='order_id')
+    train_df = pd.merge(orders_df[orders_df['eval_set'] == 'train'],
+                        pd.merge(read('order_products__train.csv'), products_df, on='product_id'), on='order_id')
+    all_orders_df = pd.concat([prior_df, train_df])
+    top_df = (all_orders_df.groupby(['aisle_id', 'aisle'])['product_id'].count()
+              .reset_index(name='total_purchases').nlargest(5, 'total_purchases'))
+    purchase_train_df = prior_df.groupby(['user_id', 'product_id']).size().reset_index(name='purchase_count')
+    purchase_test_df = train_df.groupby(['user_id', 'product_id']).size().reset_index(name='purchase_count')
+    matrix = sparse.coo_matrix((purchase_train_df['purchase_count'],
+                                (purchase_train_df['user_id'], purchase_train_df['product_id']))).tocsr()
+    return aisles_df, top_df, purchase_train_df, purchase_test_df, matrix
+
+
+@pytest.mark.parametrize('processes', [1, 3])
+def test_streamed_aggregation_matches_the_notebooks(dataset_dir, notebook, processes):
+    aisles_df, top_df, purchase_train_df, purchase_test_df, matrix = notebook
+    aisle_totals, pair_counts = purchase_aggregation.aggregate(dataset_dir, chunksize=250, processes=processes)
+
+    assert (purchase_aggregation.top_aisles(aisle_totals, aisles_df, n=5).to_csv(index=False)
+            == top_df.to_csv(index=False))
+    pd.testing.assert_frame_equal(purchase_aggregation.purchase_count_df(pair_counts['prior']), purchase_train_df)
+    pd.testing.assert_frame_equal(purchase_aggregation.purchase_count_df(pair_counts['train']), purchase_test_df)
+    streamed = purchase_aggregation.build_user_product_matrix(pair_counts['prior'])
+    assert streamed.shape == matrix.shape and streamed.dtype == matrix.dtype
+    np.testing.assert_array_equal(streamed.indptr, matrix.indptr)
+    np.testing.assert_array_equal(streamed.indices, matrix.indices)
+    np.testing.assert_array_equal(streamed.data, matrix.data)
+
+
+def test_aisle_totals_only(dataset_dir):
+    aisle_totals, pair_counts = purchase_aggregation.aggregate(dataset_dir, chunksize=250, count_pairs=False)
+    assert pair_counts == {'prior': None, 'train': None}
+    np.testing.assert_array_equal(aisle_totals, purchase_aggregation.aggregate(dataset_dir)[0])
+
+
+def test_write_csv_in_slices(notebook, tmp_path):
+    purchase_train_df = notebook[2]
+    purchase_aggregation.write_csv(purchase_train_df, str(tmp_path / 'out.csv'), rows_per_write=100)
+    assert (tmp_path / 'out.csv').read_text() == purchase_train_df.to_csv(index=False)
+    purchase_aggregation.write_csv(purchase_train_df.iloc[:0], str(tmp_path / 'empty.csv'))
+    assert (tmp_path / 'empty.csv').read_text() == purchase_train_df.iloc[:0].to_csv(index=False)
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+import scipy.sparse as sparse
+
+from purchase_history import PurchaseHistory
+
+
+@pytest.fixture
+def history():
+    #user 0 bought products 7, 2, 5, 9 with counts 1, 3, 3, 2; user 1 nothing
+    matrix = sparse.csr_matrix((np.array([1.0, 3.0, 3.0, 2.0]), (np.zeros(4, dtype=np.int64), np.array([7, 2, 5, 9]))),
+                               shape=(3, 10))
+    return PurchaseHistory(matrix)
+
+
+def test_products_are_ordered_by_id(history):
+    product_ids, counts = history.products(0)
+    assert list(product_ids) == [2, 5, 7, 9]
+    assert list(counts) == [3, 3, 1, 2]
+
+
+def test_by_count_orders_by_descending_count_then_id(history):
+    product_ids, counts = history.products(0, by_count=True)
+    assert list(product_ids) == [2, 5, 9, 7]
+    assert list(counts) == [3, 3, 2, 1]
+
+
+@pytest.mark.parametrize('by_count', [False, True])
+def test_pages_cover_the_history(history, by_count):
+    whole, _ = history.products(0, by_count=by_count)
+    pages = [history.products(0, offset, 3, by_count)[0] for offset in range(0, 6, 3)]
+    assert [len(page) for page in pages] == [3, 1]
+    assert list(np.concatenate(pages)) == list(whole)
+    assert len(history.products(0, 10, 3, by_count)[0]) == 0
+
+
+def test_users_without_purchases(history):
+    assert history.count(0) == 4
+    assert history.count(1) == 0
+    assert history.count(-1) == history.count(3) == 0
+    assert len(history.products(1)[0]) == len(history.products(-1)[0]) == len(history.products(3)[0]) == 0
+
+
+def most_active_user(models):
+    return int(np.argmax(np.diff(models.user_product_matrix.indptr)))
+
+
+def test_predict_pages_the_history_by_default(service, monkeypatch):
+    models = service.model_registry.current
+    user_id = most_active_user(models)
+    total = models.purchase_history.count(user_id)
+    monkeypatch.setattr(service, 'HISTORY_PAGE_SIZE', 5)
+    client = service.app.test_client()
+    body = client.get(f'/predict?userId={user_id}&mood=happy').get_json()
+    assert len(body['actual_purchased_products']) == 5
+    assert body['actual_purchased_total'] == total > 5
+
+    #the pages of either order join up to the whole history
+    for order, by_count in (('catalog', False), ('count', True)):
+        pages = []
+        for offset in range(0, total, 5):
+            page = client.get(f'/predict?userId={user_id}&mood=happy&history_order={order}'
+                              f'&history_offset={offset}').get_json()['actual_purchased_products']
+            pages.extend(record['product_id'] for record in page)
+        positions = service.purchased_product_positions(user_id, by_count=by_count, models=models)
+        assert pages == list(models.catalog.product_ids[positions])
+
+
+def test_predict_caps_the_history_limit(service):
+    user_id = most_active_user(service.model_registry.current)
+    client = service.app.test_client()
+    limit = service.MAX_HISTORY_LIMIT
+    assert client.get(f'/predict?userId={user_id}&mood=happy&history_limit={limit}').status_code == 200
+    assert client.get(f'/predict?userId={user_id}&mood=happy&history_limit={limit + 1}').status_code == 400
+    assert client.get(f'/predict?userId={user_id}&mood=happy&history_limit=-1').status_code == 400
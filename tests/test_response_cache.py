@@ -0,0 +1,74 @@
+from response_cache import SQLiteBackend, cache_from_env
+
+
+def test_sqlite_evicts_in_batches(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'cache.sqlite'), max_entries=10, eviction_slack=5)
+    for i in range(15):
+        backend.set(f'k{i}', b'v')
+    #within the slack nothing is evicted
+    assert backend.size()['entries'] == 15
+    backend.set('k15', b'v')
+    backend.evict()
+    assert backend.size()['entries'] == 10
+    #the least recently used entries went first
+    assert backend.get('k5') is None
+    assert backend.get('k6') == b'v'
+
+
+def test_sqlite_writes_trigger_eviction(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'cache.sqlite'), max_entries=10, eviction_slack=5)
+    for i in range(100):
+        backend.set(f'k{i}', b'v')
+    assert backend.size()['entries'] <= 10 + 5
+    assert backend.get('k99') == b'v'
+
+
+def test_sqlite_hit_touches_only_after_interval(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'cache.sqlite'), touch_interval=3600)
+    backend.set('k', b'v')
+    accessed = backend._connection().execute("SELECT accessed FROM cache").fetchone()[0]
+    assert backend.get('k') == b'v'
+    assert backend._connection().execute("SELECT accessed FROM cache").fetchone()[0] == accessed
+
+    backend.touch_interval = 0
+    assert backend.get('k') == b'v'
+    assert backend._connection().execute("SELECT accessed FROM cache").fetchone()[0] > accessed
+
+
+def test_memory_max_bytes_from_env(monkeypatch):
+    monkeypatch.setenv('RESPONSE_CACHE', 'memory')
+    monkeypatch.setenv('RESPONSE_CACHE_MAX_BYTES', '10')
+    cache = cache_from_env()
+    assert cache.backend.max_bytes == 10
+    cache.set('a', b'123456')
+    cache.set('b', b'123456')
+    assert cache.get('a') is None and cache.get('b') == b'123456'
+
+
+def test_sqlite_size_is_recounted_after_interval(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'cache.sqlite'), size_interval=3600)
+    backend.set('a', b'123')
+    assert backend.size() == {'entries': 1, 'bytes': 3}
+    backend.set('b', b'45')
+    #the last count is reused within the interval
+    assert backend.size() == {'entries': 1, 'bytes': 3}
+    backend.size_interval = 0
+    assert backend.size() == {'entries': 2, 'bytes': 5}
+    backend.size_interval = 3600
+    backend.clear()
+    assert backend.size() == {'entries': 0, 'bytes': 0}
+
+
+def test_predict_cache_key_uses_parsed_ids(service, monkeypatch):
+    from response_cache import MemoryBackend, ResponseCache
+
+    response_cache = ResponseCache(MemoryBackend())
+    monkeypatch.setattr(service, 'response_cache', response_cache)
+    client = service.app.test_client()
+    first = client.get('/predict?userId=7&mood=happy')
+    for user_id in ('07', '%207', '+7'):
+        assert client.get(f'/predict?userId={user_id}&mood=happy').get_data() == first.get_data()
+    client.get('/predict?interested_aisles=3,5&mood=happy')
+    client.get('/predict?interested_aisles=3,%205&mood=happy')
+    assert response_cache.stats()['entries'] == 2
+    assert response_cache.stats()['hits'] == 4
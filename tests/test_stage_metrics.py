@@ -0,0 +1,84 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask
+
+from stage_metrics import Metrics
+
+
+def make_app(metrics):
+    app = Flask(__name__)
+    metrics.instrument(app)
+
+    @app.route('/work')
+    def work():
+        with metrics.span('outer'):
+            with metrics.span('inner'):
+                time.sleep(0.002)
+        with metrics.span('after'):
+            pass
+        return 'ok'
+    return app
+
+
+def test_profiling_needs_token(tmp_path):
+    client = make_app(Metrics('test', profile_dir=str(tmp_path))).test_client()
+    response = client.get('/work', headers={'X-Profile': 'sample'})
+    assert 'Server-Timing' not in response.headers
+    assert os.listdir(tmp_path) == []
+
+    client = make_app(Metrics('test', profile_dir=str(tmp_path), profile_token='secret')).test_client()
+    response = client.get('/work', headers={'X-Profile': '1', 'X-Profile-Token': 'wrong'})
+    assert 'Server-Timing' not in response.headers
+
+
+def test_nested_spans_are_sub_stages(tmp_path):
+    client = make_app(Metrics('test', profile_dir=str(tmp_path), profile_token='secret')).test_client()
+    response = client.get('/work', headers={'X-Profile': '1', 'X-Profile-Token': 'secret'})
+    stages = [timing.split(';')[0] for timing in response.headers['Server-Timing'].split(', ')]
+    assert stages == ['outer.inner', 'outer', 'after', 'total']
+
+
+def test_profile_dumps_are_capped(tmp_path):
+    metrics = Metrics('test', profile_dir=str(tmp_path), profile_token='secret', max_profile_dumps=2)
+    client = make_app(metrics).test_client()
+    for _ in range(4):
+        response = client.get('/work', headers={'X-Profile': 'sample', 'X-Profile-Token': 'secret'})
+        stages = [timing.split(';')[0] for timing in response.headers['Server-Timing'].split(', ')]
+        assert stages == ['outer.inner', 'outer', 'after', 'total']
+        #the dump path is only logged, never sent to the client
+        assert not any(str(tmp_path) in value for value in response.headers.values())
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def stage_counts(metrics):
+    return {line.split('"')[1] for line in metrics.render().splitlines()
+            if line.startswith('test_stage_seconds_count')}
+
+
+def test_propagated_spans_keep_the_calling_stage(tmp_path):
+    metrics = Metrics('test', profile_dir=str(tmp_path), profile_token='secret')
+    app = Flask(__name__)
+    metrics.instrument(app)
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    def detect():
+        with metrics.span('detection'):
+            pass
+
+    @app.route('/infer')
+    def infer():
+        with metrics.span('inference'):
+            executor.submit(metrics.propagate(detect)).result()
+        return 'ok'
+
+    client = app.test_client()
+    #the same series whether the request is profiled or not
+    client.get('/infer')
+    assert stage_counts(metrics) == {'inference', 'inference.detection'}
+    response = client.get('/infer', headers={'X-Profile': '1', 'X-Profile-Token': 'secret'})
+    assert stage_counts(metrics) == {'inference', 'inference.detection'}
+    stages = [timing.split(';')[0] for timing in response.headers['Server-Timing'].split(', ')]
+    assert stages == ['inference.detection', 'inference', 'total']
+    executor.shutdown()
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+from worker_pool import fork_map, shared
+
+
+def _setup(values):
+    return {'values': values}
+
+
+def _scale(start, stop, factor):
+    return shared['values'][start:stop].sum() * factor
+
+
+@pytest.mark.parametrize('processes', [1, 3])
+def test_fork_map_keeps_task_order(processes):
+    values = np.arange(100)
+    tasks = ((start, start + 10, start) for start in range(0, 100, 10))
+    results = list(fork_map(_scale, tasks, _setup, (values,), processes))
+    assert results == [values[start:start + 10].sum() * start for start in range(0, 100, 10)]
+    #the serial run does not keep the shared objects alive
+    assert shared == {}
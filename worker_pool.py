@@ -0,0 +1,41 @@
+import multiprocessing
+from collections import deque
+
+#objects shared with the task functions of fork_map, set by its setup in every worker process
+shared = {}
+
+
+def _init_worker(setup, setup_args):
+    shared.update(setup(*setup_args))
+
+
+def fork_map(fn, tasks, setup, setup_args=(), processes=1):
+    """
+    Yield fn(*task) for every task, in order, from a pool of forked processes when processes > 1
+    and fork is available, else serially in this process.
+    Forked workers inherit setup_args instead of unpickling a copy each: setup(*setup_args) runs once
+    per worker and returns the dict of objects the task functions read from shared. At most two tasks
+    per process are in flight, so tasks may be a generator reading its input lazily.
+    Args:
+        fn: the task function, a module-level function
+        tasks: an iterable of argument tuples of fn
+        setup: a module-level function returning the dict of shared objects
+        setup_args: the arguments of setup, e.g. large arrays
+        processes: the number of processes
+    """
+    if processes > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        with multiprocessing.get_context('fork').Pool(processes, _init_worker, (setup, setup_args)) as pool:
+            pending = deque()
+            for task in tasks:
+                pending.append(pool.apply_async(fn, task))
+                while len(pending) >= 2 * processes:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+    else:
+        _init_worker(setup, setup_args)
+        try:
+            for task in tasks:
+                yield fn(*task)
+        finally:
+            shared.clear()